@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import threading
+from Lamia.pool import Future, ThreadPool, TimeoutError
+'''
+@summary:
+    キャッシュファイルの入出力をワーカースレッドで非同期に実行するモジュール
+    通常のファイルは常に読み書き可能と判定されるため、selectによるイベントループでは
+    非同期になりません。そのためディスクI/Oはスレッドプールで実行し、
+    結果をFutureで返します
+'''
+
+__all__ = ("AsyncExecutor", "gather")
+
+def gather(futures):
+    '''
+    @summary:
+        全てのFutureが終了した時点で結果のリストを持つFutureを返します
+        いずれかが例外で終了した場合は最初の例外を設定します
+    '''
+    futures = list(futures)
+    result = Future()
+    if not futures:
+        result.set_result([])
+        return result
+    lock = threading.Lock()
+    remaining = [len(futures)]
+    def _done(f):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if not last:
+            return
+        for future in futures:
+            if future._exc_info is not None:
+                result.set_exception(future._exc_info)
+                return
+        result.set_result([future.result() for future in futures])
+    for future in futures:
+        future.add_done_callback(_done)
+    return result
+
+class AsyncExecutor(object):
+    '''
+    @summary:
+        キャッシュファイルの入出力を実行するワーカースレッドの集合
+        ワーカー毎に待ち行列を持ち、キーを指定した処理は常に同じワーカーで
+        投入順に実行されるため、同じキーの書き込みが入れ替わることはありません
+        待ち行列が一杯の場合、投入は空きができるまで呼び出し元をブロックします
+    '''
+    def __init__(self, workers=4, max_queue=1024, batch_size=64):
+        '''
+        @param workers: int: ワーカースレッドの数
+        @param max_queue: int: 全ワーカーの待ち行列の合計の上限
+        @param batch_size: int: map_batchesで1回の処理にまとめる要素数
+        '''
+        if workers < 1:
+            raise ValueError("You must specify positive number for 'workers'.")
+        self.batch_size = batch_size
+        per_worker = max(1, max_queue // workers) if max_queue else 0
+        self._pools = [ThreadPool(1, per_worker, name="lamia-io")
+                       for _ in xrange(workers)]
+        self._next = 0
+        self._lock = threading.Lock()
+        self._pending = set()
+
+    def _pool(self, key):
+        if key is not None:
+            return self._pools[hash(key) % len(self._pools)]
+        with self._lock:
+            self._next = (self._next + 1) % len(self._pools)
+            return self._pools[self._next]
+
+    def _track(self, future):
+        with self._lock:
+            self._pending.add(future)
+        def _untrack(f):
+            with self._lock:
+                self._pending.discard(f)
+        future.add_done_callback(_untrack)
+        return future
+
+    def submit(self, func, args=(), key=None):
+        '''
+        @summary:
+            func(*args)を投入し、Futureを返します
+        @param key: キーを指定した場合、同じキーの処理は投入順に実行されます
+        '''
+        return self._track(self._pool(key).submit(func, *args))
+
+    def map_batches(self, func, items):
+        '''
+        @summary:
+            itemsをbatch_size毎に分割してfunc(batch)を投入し、
+            全ての処理の終了を待つFutureを返します
+        '''
+        items = list(items)
+        size = self.batch_size or len(items) or 1
+        futures = [self._track(self._pool(None).submit(func, items[i:i + size]))
+                   for i in xrange(0, len(items), size)]
+        return gather(futures)
+
+    def completed(self, value):
+        '''
+        @summary:
+            既に値が確定している処理のFutureを返します
+        '''
+        future = Future()
+        future.set_result(value)
+        return future
+
+    def wait(self, timeout=None):
+        '''
+        @summary:
+            投入済みの処理が終了するまで待ちます
+        @return: bool: timeoutまでに全て終了した場合は真
+        '''
+        with self._lock:
+            pending = list(self._pending)
+        try:
+            gather(pending).result(timeout)
+        except TimeoutError:
+            return False
+        except Exception:
+            # 処理の例外はそれぞれのFutureで受け取ります
+            pass
+        return True
+
+    def __len__(self):
+        '''
+        @summary:
+            終了していない処理の数
+        '''
+        return len(self._pending)
+
+    def shutdown(self, wait=True):
+        '''
+        @summary:
+            投入済みの処理を実行した後、ワーカースレッドを終了します
+        '''
+        for pool in self._pools:
+            pool.shutdown(wait)
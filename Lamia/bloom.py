@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import math
+import struct
+from array import array
+from hashlib import md5
+'''
+@summary:
+    キーの存在を判定する確率的なデータ構造を提供するモジュール
+'''
+
+__all__ = ("CountingBloomFilter",)
+
+class CountingBloomFilter(object):
+    '''
+    @summary:
+        削除に対応したBloom filter
+        含まれないと判定した要素は確実に含まれません(偽陰性はありません)
+        含まれると判定した要素はerror_rate程度の確率で実際には含まれません
+        カウンタは255で飽和し、飽和したカウンタは減らしません
+    '''
+    def __init__(self, capacity=100000, error_rate=0.01):
+        '''
+        @param capacity: int: 想定する要素数
+        @param error_rate: float: capacity個の要素を追加した時の偽陽性率
+        '''
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ValueError("Invalid capacity=%r, error_rate=%r" % (capacity, error_rate))
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self._counters = array('B', [0]) * self.size
+        self.count = 0
+
+    def _indexes(self, item):
+        if isinstance(item, unicode):
+            item = item.encode('utf8')
+        h1, h2 = struct.unpack("<QQ", md5(item).digest())
+        size = self.size
+        return [(h1 + i * h2) % size for i in xrange(self.hashes)]
+
+    def add(self, item):
+        counters = self._counters
+        for i in self._indexes(item):
+            if counters[i] < 255:
+                counters[i] += 1
+        self.count += 1
+
+    def discard(self, item):
+        '''
+        @summary:
+            要素を取り除きます。追加していない要素を指定してはいけません
+        '''
+        counters = self._counters
+        indexes = self._indexes(item)
+        if not all(counters[i] for i in indexes):
+            return
+        for i in indexes:
+            if counters[i] < 255:
+                counters[i] -= 1
+        self.count -= 1
+
+    def __contains__(self, item):
+        counters = self._counters
+        for i in self._indexes(item):
+            if not counters[i]:
+                return False
+        return True
+
+    def clear(self):
+        self._counters = array('B', [0]) * self.size
+        self.count = 0
+
+    def __len__(self):
+        return self.count
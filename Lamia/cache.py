@@ -3,38 +3,136 @@
 # Copyright 2011-2012 Jun Kimura
 # LICENSE MIT
 import os
+import time
+import threading
 from functools import wraps
 from Lamia.util import current_time, create_expiration_date, is_expired, \
-                 make_cache_dir, build_path, get_func_key,\
+                 make_cache_dir, get_func_prefix, make_file_key, FuncKey,\
                  logger, _CacheData, ExpiredError
-from Lamia.serialize import dump, load, \
+from Lamia.serialize import dump, load, iter_chunks, \
                       DumpError, LoadError
-from Lamia.async import AsyncPurgeFile, AsyncSaveFile, loop
+from Lamia.eviction import make_store, make_admission
+from Lamia.expiry import ExpirationIndex
+from Lamia.layout import make_layout
+from Lamia.storage import make_storage
+from Lamia.compress import Compressor
+from Lamia.lock import NullLock, StripedLock, SingleFlight, null_lock
+from Lamia.pool import ThreadPool
+from Lamia.aio import AsyncExecutor, gather
+from Lamia.janitor import Janitor
+from Lamia.stats import CacheStats
 
 join = os.path.join
 
+# get_manyでファイル上に見つからなかったことを表す値
+_missing = object()
+
+# mmapへのビューの型 (メモリ上のキャッシュへは昇格しません)
+_views = (memoryview, buffer)
+
 __all__ = ("Cache",)
 
 class Cache():
 
-    _max_cache_file = 1000
+    # 有効期限のインデックスに残す古い要素の許容数
+    _expiry_index_slack = 1024
+    # purge_memoryで有効期限のインデックスから1度に取り出す件数
+    _purge_batch = 256
     def __init__(self, cache_root, default_expires,
-                  cache=dict(), namespace='default', mode=0777,
-                  default_encoding='utf8'):
+                  cache=dict(), namespace='default', mode=0700,
+                  default_encoding='utf8', max_entries=None, max_bytes=None,
+                  eviction='lru', layout='flat', storage='file',
+                  storage_options=None, codec='pickle', compression=None,
+                  compress_threshold=1024, compress_level=None,
+                  mmap_threshold=1024 * 1024, thread_safe=False, lock_stripes=64,
+                  io_workers=4, io_queue=1024, io_batch=64,
+                  write_behind=False, flush_interval=1.0, flush_batch=256,
+                  janitor=None, negative_filter=False, stats=False,
+                  promote=None, promote_min_hits=2, max_disk_bytes=None,
+                  disk_eviction='lru'):
         '''
         @param cache_root: str or unicode: キャッシュファイルの格納ディレクトリのrootパス
         @param default_expires: float: デフォルトの有効期限
         @param cache: キャッシュオブジェクト
         @param namespace: str: キャッシュのnamespace
         @param mode: int: ディレクトリの作成パーミッション
+                          他のユーザーと名前空間を共有する場合のみ、グループなどの権限を与えます
+                          (他のユーザーが書き込めるディレクトリのファイルは、復元時に
+                          任意のコードを実行できるため、許可していない場合は使用しません)
         @param default_encoding: str: キャッシュファイル出力時のデフォルトのエンコード
+        @param max_entries: int: メモリ上に保持するエントリ数の上限
+        @param max_bytes: int: メモリ上に保持するエントリの合計サイズの上限
+        @param eviction: str: 上限を超えた際の追い出しポリシー 'lru', 'lfu', 'tinylfu'
+        @param layout: str: キャッシュファイルの配置 'flat', 'sharded'
+        @param storage: str: ファイル層の格納方式 'file'(1キー1ファイル), 'log'(追記型のセグメント)
+        @param storage_options: dict: 格納方式に渡すオプション
+        @param codec: str: ファイル上の値の変換方式 'pickle', 'marshal', 'json', 'raw'
+                           'raw'以外は値の型を保ったまま復元します
+        @param compression: str: ファイル上の値の圧縮方式 'zlib', 'bz2', 'lzma'
+        @param compress_threshold: int: このサイズ(bytes)未満の値は圧縮しません
+        @param compress_level: int: 圧縮レベル
+        @param mmap_threshold: int: fetch(zero_copy=True)でmmapのビューを返す値のサイズ(bytes)
+        @param thread_safe: bool: 真の場合、複数のスレッドから同時に利用できます
+        @param lock_stripes: int: thread_safeの場合のキー毎のロックの分割数
+                                  キー毎の更新(書き込み、期限切れの削除)のみを分割します
+                                  max_entries、max_bytesを指定した容量制限付きのストアは
+                                  参照時も順序を更新するため、メモリ上の読み書きは全て
+                                  1つのロックで直列化されます(分割の効果はありません)
+        @param io_workers: int: 非同期のファイル入出力を行うワーカースレッドの数
+        @param io_queue: int: 非同期のファイル入出力の待ち行列の上限
+                              一杯の場合、a*メソッドは空きができるまでブロックします
+        @param io_batch: int: asaveで1回の処理にまとめるエントリ数
+        @param write_behind: bool: 真の場合、storeはメモリ上に格納して変更済みとして記録するのみで、
+                                   ファイルへはバックグラウンドのスレッドがまとめて書き出します
+                                   (スレッドを使用するため、thread_safeも有効になります)
+        @param flush_interval: float: write_behindの場合の書き出しの間隔(秒)
+        @param flush_batch: int: write_behindの場合、変更済みのエントリがこの数に達すると
+                                 間隔を待たずに書き出します
+        @param janitor: bool or dict: 真の場合、期限切れのキャッシュを少しずつ削除する
+                                      バックグラウンドのスレッドを起動します
+                                      dictの場合はLamia.janitor.Janitorのオプションです
+                                      (スレッドを使用するため、thread_safeも有効になります)
+        @param negative_filter: bool or int: 真の場合、ファイル層('file')に存在しないキーを
+                                             メモリ上のBloom filterで判定し、ファイルを開かずに返します
+                                             intの場合は想定するファイル数です
+        @param stats: bool or list: 真の場合、名前空間と階層毎のヒット数、ミス数、
+                                    処理時間などを集計します(stats()で参照できます)
+                                    listの場合は登録するLamia.stats.StatsObserverです
+        @param promote: str: ファイル上で見つかった値をメモリ上のキャッシュに昇格させる
+                             アドミッションポリシー(有効期限はファイル上のものを保ちます)
+                             'always'(またはTrue): 常に昇格します
+                             'frequency': 参照回数の推定値がpromote_min_hits以上のキーのみ
+                                          昇格し、1回だけの走査でメモリ上のキャッシュを
+                                          入れ替えないようにします
+                             省略時は昇格しません
+        @param promote_min_hits: int: 'frequency'の場合に昇格に必要な参照回数
+        @param max_disk_bytes: int: ファイル層('file')の名前空間毎の合計サイズの上限(bytes)
+                                    超えた場合はdisk_evictionの順にファイルを削除します
+        @param disk_eviction: str: 削除するファイルの選び方
+                                   'lru': 最も長く読み書きされていないファイル
+                                   'expiry': 最も早く期限切れになるファイル
         '''
         self.cache_root = cache_root
-        self._init_cache(cache)
+        self.storage = None
+        self._init_locks(thread_safe or write_behind or bool(janitor), lock_stripes)
+        self._init_cache(cache, max_entries, max_bytes, eviction)
+        self._admission = make_admission(promote, promote_min_hits,
+                                         max(1024, max_entries or 0))
         self._init_mode(mode)
+        self._init_layout(layout)
+        self._init_storage_options(storage, storage_options, codec, negative_filter,
+                                   max_disk_bytes, disk_eviction)
+        self._init_compressor(compression, compress_threshold, compress_level)
+        self.mmap_threshold = mmap_threshold
+        self._io = AsyncExecutor(io_workers, io_queue, io_batch)
+        # stale_ttlを指定したcache_decoratorが共有する更新用のThreadPool
+        self._refresh_pool = None
+        self._init_stats(stats)
         self._init_cache_dir(self.cache_root, namespace)
         self._init_default_encoding(default_encoding)
         self._init_default_expires(default_expires)
+        self._init_write_behind(write_behind, flush_interval, flush_batch)
+        self._init_janitor(janitor)
         
     def change_namespace(self, namespace, default_expires=None,
                   mode=None, default_encoding=None):
@@ -48,24 +146,28 @@ class Cache():
             self._init_mode(mode)
         if default_encoding is not None:
             self.default_encoding = default_encoding
+        # 変更済みのエントリは切り替え前の名前空間に書き出します
+        self.flush()
         self._init_cache_dir(self.cache_root, namespace)
     
-    def fetch(self, key):
+    def fetch(self, key, zero_copy=False):
         '''
         @summary: 
             キーに対応する値を取り出します
             メモリ上にキーが存在しない場合、ディスク上のファイルを探索
             以上で見つからない場合、raise KeyError
+        @param zero_copy: bool: 真の場合、ファイル上のmmap_threshold以上の'raw'の値を
+                                コピーせずにmmapへのビュー(memoryviewまたはbuffer)で返します
         '''
         try:
             # search on memory
             val = self._fetch_cache_memory(key)
         except (KeyError, ExpiredError):
             # search on disk
-            val = self._fetch_cache_file(key)
+            val = self._fetch_cache_file(key, zero_copy)
         return val
     
-    def get(self, key, default=None):
+    def get(self, key, default=None, zero_copy=False):
         '''
         @summary: 
             キーに対応する値を取り出します
@@ -78,30 +180,198 @@ class Cache():
                 val = self._fetch_cache_memory(key)
             except (KeyError, ExpiredError):
                 # search on disk
-                val = self._fetch_cache_file(key)
+                val = self._fetch_cache_file(key, zero_copy)
         except (KeyError, ExpiredError):
             return default
         return val
         
+    def afetch(self, key, zero_copy=False):
+        '''
+        @summary: 
+            fetchを非同期に行い、値を持つFutureを返します
+            メモリ上で見つかった場合は完了済みのFutureを返し、
+            それ以外はワーカースレッドでファイルを探索します
+        '''
+        try:
+            val = self._fetch_cache_memory(key)
+        except (KeyError, ExpiredError):
+            return self._io.submit(self._fetch_cache_file,
+                                   (key, zero_copy, self.thread_safe), key)
+        return self._io.completed(val)
+        
+    def get_many(self, keys, zero_copy=False):
+        '''
+        @summary: 
+            複数のキーに対応する値をまとめて取り出します
+            メモリ上のキャッシュを先に1回で走査し、見つからなかったキーのみを
+            ワーカースレッドで並行してファイル上から探します
+            有効期限の扱い、メモリ上への昇格(アドミッションポリシー)はfetchと同じです
+        @return: dict: 見つかったキーと値 (見つからないキーは含みません)
+        '''
+        found = {}
+        misses = []
+        for key in keys:
+            try:
+                found[key] = self._fetch_cache_memory(key)
+            except (KeyError, ExpiredError):
+                misses.append(key)
+        if len(misses) == 1:
+            results = [self._fetch_file_or_missing(misses[0], zero_copy, True)]
+        elif misses:
+            promote = self.thread_safe
+            results = self._wait_all(
+                self._io.submit(self._fetch_file_or_missing,
+                                (key, zero_copy, promote), key)
+                for key in misses)
+            if not promote:
+                # thread_safeでない場合はワーカースレッドで昇格させないため、
+                # 読み込んだ値を呼び出し元のスレッドで昇格させます
+                self._promote_many(misses, results)
+        else:
+            results = []
+        for key, data in zip(misses, results):
+            if data is not _missing:
+                found[key] = data.val
+        return found
+        
+    def _fetch_file_or_missing(self, key, zero_copy=False, promote=True):
+        try:
+            return self._fetch_file_data(key, zero_copy, promote)
+        except KeyError:
+            return _missing
+
+    def _promote_many(self, keys, results):
+        '''
+        @summary:
+            ファイル上から読み込んだ値のうち、アドミッションポリシーが受け入れたものを
+            メモリ上に昇格させます
+        '''
+        admission = self._admission
+        if admission is None:
+            return
+        for key, data in zip(keys, results):
+            if data is not _missing and admission.admit(key):
+                self._promote(key, data)
+        
+    def _wait_all(self, futures):
+        '''
+        @summary: 
+            Futureの終了を全て待って結果のリストを返します
+            いずれかが例外で終了した場合は最初の例外を送出します
+        '''
+        return gather(futures).result()
+        
     def _fetch_cache_memory(self, key):
         '''
         @summary:
             指定したキーでメモリ上のキャッシュからデータを取得します
         '''
-        data = self.cache[key]
+        recorder = self._recorder
+        if recorder is not None:
+            start = time.time()
+        data = self._memory_get(key)
         if is_expired(data.expiration_date):
-            del self.cache[key]
+            self._expire_memory(key, data)
+            if recorder is not None:
+                recorder.record_expire('memory', key)
             raise ExpiredError("ExpiredError")
+        if recorder is not None:
+            recorder.record_fetch('memory', key, time.time() - start)
         return data.val
     
-    def _fetch_cache_file(self, key):
+    def _memory_get(self, key):
+        '''
+        @summary:
+            メモリ上のキャッシュからデータを取得します
+            dictの参照はそれ自体がスレッドセーフなため、ロックを取りません
+            参照時に内部の順序を更新するストアの場合のみロックを取ります
+        '''
+        if self._memory_lock is None:
+            return self.cache[key]
+        with self._memory_lock:
+            return self.cache[key]
+    
+    def _memory_peek(self, key):
+        '''
+        @summary:
+            参照順序などを更新せずにメモリ上のデータを返します。無い場合はNone
+        '''
+        peek = getattr(self.cache, 'peek', self.cache.__getitem__)
+        try:
+            return peek(key)
+        except KeyError:
+            return None
+    
+    def _expire_memory(self, key, data):
+        '''
+        @summary:
+            期限切れのデータをメモリ上から削除します
+            別のスレッド(またはプロセス)で既に更新されていた場合は削除しません
+        '''
+        with self._key_lock(key):
+            with self._lock:
+                current = self._memory_peek(key)
+                if current is not None and current.expiration_date == data.expiration_date:
+                    del self.cache[key]
+                    self._dirty.discard(key)
+    
+    def _fetch_cache_file(self, key, zero_copy=False, promote=True):
         '''
         @summary: 
             指定したキーでファイル上からデータを取得します
+            アドミッションポリシーが受け入れた場合はメモリ上のキャッシュに昇格させます
+        @param promote: bool: 偽の場合は昇格させません
+                              (thread_safeでない場合にワーカースレッドから呼ぶ場合)
+        '''
+        return self._fetch_file_data(key, zero_copy, promote).val
+
+    def _fetch_file_data(self, key, zero_copy=False, promote=True):
         '''
+        @summary:
+            _fetch_cache_fileと同様に取得し、値ではなく_CacheDataを返します
+        '''
+        recorder = self._recorder
+        if recorder is not None:
+            start = time.time()
         try:
-            path = build_path(self.cache_dir, key)
-            data = load(path)
+            admission = self._admission
+            if promote and admission is not None and admission.admit(key):
+                # 読み込みから昇格までの間に更新、削除されないようにします
+                with self._key_lock(key):
+                    data = self._load_cache_file(key, zero_copy)
+                    self._promote(key, data)
+            else:
+                data = self._load_cache_file(key, zero_copy)
+        except KeyError:
+            if recorder is not None:
+                recorder.record_fetch(None, key, time.time() - start)
+            raise
+        if recorder is not None:
+            recorder.record_fetch('file', key, time.time() - start)
+        return data
+    
+    def _promote(self, key, data):
+        '''
+        @summary: 
+            ファイル上から読み込んだデータを、有効期限を保ったままメモリ上に格納します
+            メモリ上に有効なエントリがある場合と、mmapへのビューは格納しません
+        '''
+        if isinstance(data.val, _views):
+            return
+        with self._lock:
+            current = self._memory_peek(key)
+            if current is not None and not is_expired(current.expiration_date):
+                return
+            self._put_memory(key, data, False)
+        if self._recorder is not None:
+            self._recorder.promotions += 1
+    
+    def _load_cache_file(self, key, zero_copy=False):
+        try:
+            if zero_copy:
+                data = self.storage.load(self._file_key(key), self.mmap_threshold)
+            else:
+                data = self.storage.load(self._file_key(key))
             if is_expired(data.expiration_date):
                 raise ExpiredError("ExpiredError")
         except IOError:
@@ -111,53 +381,254 @@ class Cache():
             # Not Found key-cachefile
             raise KeyError(key)
         except ValueError,err:
-            raise ValueError("Cache File '%s' style is wrong." % path)
+            raise ValueError("Cache File '%s' style is wrong." % key)
         except LoadError:
+            # 壊れたキャッシュファイル
+            with self._key_lock(key):
+                self._delete_file(key)
             raise KeyError(key)
         except ExpiredError:
-            self._delete_file(path)
+            if self._recorder is not None:
+                self._recorder.record_expire('file', key)
+            with self._key_lock(key):
+                try:
+                    # 別のスレッドで更新されていないか確認して削除します
+                    self._delete_expired_key(key)
+                except (KeyError, LoadError):
+                    pass
             raise KeyError(key)
         else:
-            return data.val
+            return data
     
     def store(self, key, val, expires=None, is_store_file=True):
         '''
         @summary: 
             キャッシュにキーと値を格納します
             __setitem__と比べて引数が多いのでデフオルト引数が必要
+            write_behindの場合、is_store_fileのエントリは変更済みとして記録し、
+            save()またはwrite_behindのスレッドが書き出します
+            is_store_fileが偽のエントリはファイルに書き出しません(save(full=True)を除きます)
         '''
         if expires is None:
             _expires = self.default_expires
         else:
             _expires = expires
         expiration_date = create_expiration_date(_expires)
-        try:
-            if is_store_file:
+        write_through = is_store_file and not self.write_behind
+        with self._key_lock(key):
+            if write_through:
                 self._store_cache_file(key, val, expiration_date)
-            self._store_cache_memory(key, val, expiration_date)
-        except:
+            self._store_cache_memory(key, val, expiration_date,
+                                     dirty=is_store_file and self.write_behind)
+        if self.write_behind and len(self._dirty) >= self.flush_batch:
+            self._flush_event.set()
+        
+    def store_many(self, mapping, expires=None, is_store_file=True):
+        '''
+        @summary: 
+            複数のキーと値をまとめて格納します
+            全てのエントリに同じ有効期限を設定し、ファイルへの書き出しは
+            ワーカースレッドで並行して行い、全て終わってから戻ります
+        @param mapping: dict or list: キーと値のdict、または(key, val)のリスト
+        '''
+        if expires is None:
+            _expires = self.default_expires
+        else:
+            _expires = expires
+        expiration_date = create_expiration_date(_expires)
+        items = mapping.items() if isinstance(mapping, dict) else list(mapping)
+        write_through = is_store_file and not self.write_behind
+        if not write_through or len(items) < 2:
+            self._store_entries(items, expiration_date, write_through,
+                                dirty=is_store_file and self.write_behind)
+        elif self.thread_safe:
+            # キー毎にファイルとメモリをまとめて更新し、storeと同じ順序を保ちます
+            self._wait_all(
+                self._io.submit(self._store_entries,
+                                ([(key, val)], expiration_date, True), key)
+                for key, val in items)
+        else:
+            # メモリ上のキャッシュは呼び出し元のスレッドでのみ更新します
+            self._wait_all(
+                self._io.submit(self._store_cache_file, (key, val, expiration_date), key)
+                for key, val in items)
+            self._store_entries(items, expiration_date, False)
+        if self.write_behind and len(self._dirty) >= self.flush_batch:
+            self._flush_event.set()
+        
+    def _store_entries(self, items, expiration_date, write_through, dirty=False):
+        '''
+        @summary: 
+            (key, val)のリストを格納します
+            write_throughが真の場合はファイルにも書き出し、
+            dirtyが真の場合は変更済みとして記録します
+        '''
+        for key, val in items:
+            with self._key_lock(key):
+                if write_through:
+                    self._store_cache_file(key, val, expiration_date)
+                self._store_cache_memory(key, val, expiration_date, dirty=dirty)
+        
+    def astore(self, key, val, expires=None, is_store_file=True):
+        '''
+        @summary: 
+            storeを非同期に行い、ファイルへの書き出しが終了するFutureを返します
+            メモリ上へは直ちに格納し、ファイルへはワーカースレッドで書き出します
+        '''
+        if expires is None:
+            _expires = self.default_expires
+        else:
+            _expires = expires
+        expiration_date = create_expiration_date(_expires)
+        with self._key_lock(key):
+            data = self._store_cache_memory(key, val, expiration_date)
+        if not is_store_file:
+            return self._io.completed(None)
+        return self._io.submit(self._dump_file, (key, data), key)
+        
+    def store_stream(self, key, source, expires=None):
+        '''
+        @summary: 
+            strの断片のiterable、またはファイルオブジェクトの内容を値としてファイル上に格納します
+            メモリ上のキャッシュを経由せず、一時ファイルに断片毎に書き出してから
+            renameで置き換える('log'ではセグメントに書き写す)ため、
+            使用するメモリは値のサイズによらず一定です
+            メモリ上にある同じキーのエントリは削除します
+            値は圧縮せず'raw'として格納し、open_streamで読み込みます
+        @param source: iterable or file: strの断片のiterable、またはreadを持つオブジェクト
+        '''
+        dump_stream = getattr(self.storage, 'dump_stream', None)
+        if dump_stream is None:
+            raise NotImplementedError("store_stream is not supported by '%s' storage." %
+                                      self.storage.name)
+        if expires is None:
+            _expires = self.default_expires
+        else:
+            _expires = expires
+        expiration_date = create_expiration_date(_expires)
+        recorder = self._recorder
+        if recorder is not None:
+            start = time.time()
+        with self._key_lock(key):
+            dump_stream(self._file_key(key), iter_chunks(source), expiration_date)
+            with self._lock:
+                self.cache.pop(key, None)
+                self._dirty.discard(key)
+        if recorder is not None:
+            recorder.record_store('file', key, time.time() - start)
+        
+    def open_stream(self, key):
+        '''
+        @summary: 
+            ファイル上の値を読み込むファイルライクなオブジェクト
+            (Lamia.serialize.StreamReader)を返します
+            メモリ上のキャッシュは参照せず、使用するメモリは読み込む断片のサイズのみです
+            無い場合、期限切れの場合はKeyError、'raw'以外の値はTypeError
+        '''
+        open_stream = getattr(self.storage, 'open_stream', None)
+        if open_stream is None:
+            raise NotImplementedError("open_stream is not supported by '%s' storage." %
+                                      self.storage.name)
+        recorder = self._recorder
+        if recorder is not None:
+            start = time.time()
+        try:
+            reader = open_stream(self._file_key(key))
+            if is_expired(reader.expiration_date):
+                reader.close()
+                raise ExpiredError("ExpiredError")
+        except KeyError:
+            if recorder is not None:
+                recorder.record_fetch(None, key, time.time() - start)
             raise
+        except LoadError:
+            # 壊れたキャッシュファイル
+            with self._key_lock(key):
+                self._delete_file(key)
+            raise KeyError(key)
+        except ExpiredError:
+            if recorder is not None:
+                recorder.record_expire('file', key)
+            with self._key_lock(key):
+                # 値を読み込まずに、別のスレッドで更新されていないか確認して削除します
+                try:
+                    with open_stream(self._file_key(key)) as current:
+                        expired = is_expired(current.expiration_date)
+                except (KeyError, LoadError):
+                    expired = False
+                if expired:
+                    self._delete_file(key)
+            raise KeyError(key)
+        if recorder is not None:
+            recorder.record_fetch('file', key, time.time() - start)
+        return reader
         
-    def _store_cache_memory(self, key, val, expiration_date):
+    def _store_cache_memory(self, key, val, expiration_date, dirty=False):
         '''
         @summary: 
             メモリ上のキャッシュにキーと値を格納します
-        '''
-        self.cache[key] = _CacheData(val=val, expiration_date=expiration_date)
+        @param dirty: bool: 真の場合、ファイルに未書き出しのエントリとして記録します
+        @return: _CacheData: 格納したデータ
+        '''
+        recorder = self._recorder
+        if recorder is not None:
+            start = time.time()
+        data = _CacheData(val=val, expiration_date=expiration_date)
+        with self._lock:
+            self._put_memory(key, data, dirty)
         #logger.debug("STORE MEMORY: Key:%s" % (key,))
+        if recorder is not None:
+            recorder.record_store('memory', key, time.time() - start)
+        return data
+        
+    def _put_memory(self, key, data, dirty):
+        '''
+        @summary: 
+            メモリ上のキャッシュと有効期限のインデックスを更新します
+            self._lockを取得した状態で呼びます
+        '''
+        self.cache[key] = data
+        if dirty:
+            self._dirty.add(key)
+        else:
+            self._dirty.discard(key)
+        self._expiry_index.push(key, data.expiration_date)
+        if len(self._expiry_index) > self._expiry_index_limit:
+            # 上書きや追い出しで古くなった要素が増えたら作り直す
+            # (len(self.cache)は走査が必要なストアがあるため、上限は作り直す時点で決めます)
+            self._rebuild_expiry_index()
         
     def _store_cache_file(self, key, val, expiration_date):
         '''
         @summary: 
             ファイル上のキャッシュにキーと値を格納します
         '''
-        try:
-            if isinstance(val, unicode):
-                val = val.encode(self.default_encoding)
-            dump(_CacheData(val=val, expiration_date=expiration_date),
-                 build_path(self.cache_dir, key))
-        except Exception:
-            raise
+        self._dump_file(key, _CacheData(val=val, expiration_date=expiration_date))
+        
+    def _dump_file(self, key, data):
+        '''
+        @summary: 
+            データをファイル層に書き出します
+        '''
+        recorder = self._recorder
+        if recorder is None:
+            self.storage.dump(self._file_key(key), self._file_data(data))
+            return
+        start = time.time()
+        self.storage.dump(self._file_key(key), self._file_data(data))
+        recorder.record_store('file', key, time.time() - start)
+        
+    _file_key = staticmethod(make_file_key)
+        
+    def _file_data(self, data):
+        '''
+        @summary: 
+            'raw'の場合のみ、unicodeをdefault_encodingでエンコードします
+        '''
+        if self.codec == 'raw' and isinstance(data.val, unicode):
+            return _CacheData(val=data.val.encode(self.default_encoding),
+                              expiration_date=data.expiration_date)
+        return data
         
     def sync(self):
         '''
@@ -170,110 +641,192 @@ class Cache():
             # pickle error
             raise
         
-    def save(self, is_async=False):
+    def save(self, is_async=False, full=False):
         '''
         @summary:
-            現在のメモリキャッシュでキャッシュファイルを更新します
+            メモリキャッシュのうち、ファイルに未書き出しのエントリを書き出します
+        @param full: bool: 真の場合はメモリ上の全てのエントリを書き出します
         '''
         if is_async:
-            self._save_async()
+            self.asave(full=full)
         else:
-            self._save()
+            self.flush(full)
         
-    def _save_async(self):
+    def asave(self, full=False):
         '''
         @summary: 
-            非同期に現在のメモリキャッシュでキャッシュファイルを更新します
-            SimpleCacheInstance.save(async=True)
+            saveを非同期に行います
+            エントリをio_batch件ずつまとめてワーカースレッドで書き出し、
+            全ての書き出しが終了するFutureを返します
         '''
-        try:
-            for key, cache in self.cache.iteritems():
-                AsyncSaveFile(build_path(self.cache_dir, key), cache)
-        except Exception:
-            # pickle error
-            raise
+        return self._io.map_batches(self._write_keys, self._take_dirty(full))
         
-    def _save(self):
+    def flush(self, full=False):
         '''
         @summary: 
-            現在のメモリキャッシュでキャッシュファイルを更新します
+            ファイルに未書き出しのエントリを書き出します
+            同じキーへの複数回のstoreは最新の値の1回の書き出しにまとまります
+        @return: int: 書き出したエントリ数
         '''
-        try:
-            for key, cache in self.cache.iteritems():
-                dump(cache, build_path(self.cache_dir, key))
-        except Exception:
-            # pickle error
-            raise
+        return self._write_keys(self._take_dirty(full))
         
-    def purge(self, date=current_time(), is_async=False):
+    def _take_dirty(self, full=False):
+        '''
+        @summary: 
+            書き出すキーのリストを返し、変更済みの記録を消去します
+        '''
+        with self._lock:
+            if full:
+                keys = list(self.cache.keys())
+            else:
+                keys = list(self._dirty)
+            self._dirty.clear()
+        return keys
+        
+    def _write_keys(self, keys):
+        '''
+        @summary: 
+            キーに対応するメモリ上の最新の値をファイルに書き出します
+            期限切れ、または削除済みのキーは書き出しません
+            書き出しに失敗した場合、残りのキーは変更済みに戻します
+        '''
+        written = 0
+        for i, key in enumerate(keys):
+            with self._key_lock(key):
+                with self._lock:
+                    data = self._memory_peek(key)
+                if data is None or is_expired(data.expiration_date):
+                    continue
+                try:
+                    self._dump_file(key, data)
+                except Exception:
+                    with self._lock:
+                        self._dirty.update(keys[i:])
+                    raise
+            written += 1
+        return written
+        
+    def close(self):
+        '''
+        @summary: 
+            write_behindのスレッドと更新用のワーカースレッドを停止し、
+            未書き出しのエントリと非同期の入出力を書き出してからファイル層を閉じます
+        '''
+        if self._closed:
+            return
+        self._closed = True
+        if self.janitor is not None:
+            self.janitor.stop()
+        if self._refresh_pool is not None:
+            self._refresh_pool.shutdown()
+        if self.write_behind:
+            self._flush_event.set()
+            self._flusher.join()
+        self.flush()
+        self._io.wait()
+        self._io.shutdown()
+        self.storage.close()
+        
+    def dirty_keys(self):
+        '''
+        @summary: 
+            ファイルに未書き出しのキーのリストを返します
+        '''
+        with self._lock:
+            return list(self._dirty)
+        
+    def purge(self, date=None, is_async=False):
         '''
         @summary: 
             現在保持しているキャッシュの中で有効期限を過ぎたものを削除します
             purge_*は引数に指定した時刻、関数呼び出し時刻を基準に削除します
         '''
+        if is_async:
+            self.apurge(date)
+            return
         try:
-            self.purge_file(date, is_async)
+            self.purge_file(date)
             self.purge_memory(date)
         except:
             raise
         
-    def purge_file(self, date=current_time(), is_async=False):
+    def apurge(self, date=None):
         '''
         @summary: 
-            期限切れ、または不正なスタイルのキャッシュファイルを削除します
+            メモリ上の期限切れのキャッシュを削除し、
+            キャッシュファイルの削除をワーカースレッドで行うFutureを返します
         '''
-        if not os.path.isdir(self.cache_dir):
-            raise IOError("%s is not directory." % self.cache_dir)
-        try:
-            root, _, files = os.walk(self.cache_dir).next()
-            if not len(files): raise StopIteration
-        except StopIteration:
-            #logger.debug("There are no cache-file at %s" % self.cache_dir)
-            return
-        if is_async:
-            self._purge_file_async(date, root, files)
-        else:
-            self._purge_file(date, root, files)
+        if date is None:
+            date = current_time()
+        self.purge_memory(date)
+        return self._io.submit(self.purge_file, (date,))
         
-    def _purge_file(self, date, root, files):
+    def purge_file(self, date=None, is_async=False, max_items=None):
         '''
         @summary: 
-            期限切れのキャッシュファイルを削除します
-        '''
-        for fpath in files:
-            path = join(root, fpath)
-            with open(path, 'rb') as f:
-                try:
-                    if float(f.readline()) <= date:
-                        os.remove(path)
-                        #logger.debug("PURGE FILE: %s" % path)
-                except ValueError:
-                    os.remove(path)
-                    #logger.debug("PURGE FILE: %s" % path)
-                    
-    def _purge_file_async(self, date, root, files):
-        '''
-        @summary: 
-            期限切れのキャッシュファイルを非同期に削除します
+            期限切れ、または不正なスタイルのキャッシュファイルを削除します
+        @param max_items: int: 指定した場合はその件数を確認した時点で中断します
+        @return: int: 削除した件数 (is_asyncの場合はFuture)
         '''
-        for fpath in files:
-            AsyncPurgeFile(join(root, fpath), date)
+        if date is None:
+            date = current_time()
+        if is_async:
+            return self._io.submit(self.purge_file, (date, False, max_items))
+        recorder = self._recorder
+        if recorder is None:
+            return self.storage.purge(date, max_items)
+        start = time.time()
+        removed = self.storage.purge(date, max_items) or 0
+        recorder.record_purge('file', removed, time.time() - start)
+        return removed
     
-    def purge_memory(self, date=current_time()):
+    def purge_memory(self, date=None, max_items=None, deadline=None):
         '''
         @summary: 
-            memory上のキャッシュを削除します
-        '''
-        delete_key = set()
-        try:
-            for key, cache in self.cache.iteritems():
-                if cache.expiration_date <= current_time():
-                    delete_key.add(key)
-            for key in delete_key:
-                del self.cache[key]
+            memory上の有効期限切れのキャッシュを削除します
+            有効期限のインデックスから期限切れのものだけを_purge_batch件ずつ取り出すため、
+            処理量は期限切れのエントリ数に比例します
+        @param date: float: 基準時刻 省略時は呼び出し時刻
+        @param max_items: int: 指定した場合はその件数を処理した時点で中断します
+        @param deadline: float: 指定した場合はtime.time()がこの時刻を過ぎた時点で中断します
+                                (残りはインデックスに残し、次回に削除します)
+        @return: int: 削除した件数
+        '''
+        if date is None:
+            date = current_time()
+        recorder = self._recorder
+        if recorder is not None:
+            start = time.time()
+        removed = 0
+        remaining = max_items
+        while remaining is None or remaining > 0:
+            batch = self._purge_batch if remaining is None \
+                else min(remaining, self._purge_batch)
+            with self._lock:
+                expired = list(self._expiry_index.pop_expired(date, batch))
+            for key, expiration_date in expired:
+                with self._key_lock(key):
+                    with self._lock:
+                        data = self._memory_peek(key)
+                        if data is None:
+                            # 既に削除、追い出し済み
+                            continue
+                        if data.expiration_date != expiration_date:
+                            # 上書き済み
+                            continue
+                        del self.cache[key]
+                        self._dirty.discard(key)
+                removed += 1
                 #logger.debug("PURGE MEMORY: %s" % key)
-        except:
-            raise
+            if len(expired) < batch:
+                break
+            if remaining is not None:
+                remaining -= len(expired)
+            if deadline is not None and time.time() >= deadline:
+                break
+        if recorder is not None:
+            recorder.record_purge('memory', removed, time.time() - start)
+        return removed
         
     def clear_cache(self):
         '''
@@ -291,77 +844,325 @@ class Cache():
         @summary: 
             現在の名前空間のキャッシュファイルを削除します
         '''
-        if not os.path.isdir(self.cache_dir):
-            raise IOError("%s is not directory." % self.cache_dir)
-        try:
-            root, _, files = os.walk(self.cache_dir).next()
-            if not len(files): raise StopIteration
-        except StopIteration:
-            #logger.debug("There are no cache-file at %s" % self.cache_dir)
-            return
-        for fpath in files:
-            os.remove(join(root, fpath))
+        self.storage.clear()
         
     def _clear_cache_memory(self):
         '''
         @summary: 
             メモリ上のキャッシュを削除します
         '''
-        self.cache.clear()
+        with self._lock:
+            self.cache.clear()
+            self._expiry_index.clear()
+            self._expiry_index_limit = self._expiry_index_slack
+            self._dirty.clear()
         
-    def cache_decorator(self, expires=None, is_store_file=False):
+    def cache_decorator(self, expires=None, is_store_file=False,
+                        stale_ttl=None, refresh_workers=1, key=None):
         '''
         @summary: 
             関数の名前と引数でキーを構成し、存在すれば、キーを取得します
             無ければ、キーと関数の結果をセットします
-        '''
+            引数が全てhash可能な場合、メモリ上のキーは文字列に変換しないFuncKeyで、
+            ファイル名はファイルの読み書きの時点でのみ作成します
+        @param key: function: key(*args, **kw)関数の引数からキーを返す関数
+                              戻り値をそのままキーにします(文字列以外はファイル層でhashします)
+        @param stale_ttl: float: 指定した場合、有効期限を過ぎてからこの秒数の間は
+                                 古い値を直ちに返し、バックグラウンドで関数を再実行して更新します
+                                 更新に失敗し続けた場合も、この期間が過ぎるまでは古い値を返します
+        @param refresh_workers: int: stale_ttlを指定した場合の更新用のワーカースレッドの数
+                                     (スレッドはCache毎に共有し、close()で停止します)
+        '''
+        if stale_ttl is not None:
+            return self._stale_cache_decorator(expires, is_store_file,
+                                               stale_ttl, refresh_workers, key)
+        key_func = key
         def _cache_decorator(func):
+            make_key = self._key_builder(func, key_func)
+            def _load(key, args, kw):
+                # 待っている間に他の呼び出しが格納した可能性があるため再確認
+                try:
+                    return self[key]
+                except KeyError:
+                    pass
+                val = func(*args, **kw)
+                self.store(key, val, expires, is_store_file)
+                return val
             @wraps(func)
             def __cache_decorator(*args, **kw):
-                key = get_func_key(func, *args, **kw)
+                key = make_key(args, kw)
                 try:
                     return self[key]
                 except KeyError:
                     pass
-                self.store(key, func(*args, **kw), expires, is_store_file)
-                return self[key]
+                # 同じキーの同時呼び出しでは1つだけがfuncを実行します
+                return self._flights.do(key, _load, key, args, kw)
             return __cache_decorator
         return _cache_decorator
     
+    def _key_builder(self, func, key_func=None):
+        '''
+        @summary: 
+            cache_decoratorの(args, kw)からキーを作る関数を返します
+            関数の接頭辞はここで1回だけ計算します
+            hash不可能な引数を含む場合と、文字列のキーのみを扱うストア
+            (Lamia.shm.SharedMemoryStore)の場合は文字列のキーを返します
+        '''
+        if key_func is not None:
+            return lambda args, kw: key_func(*args, **kw)
+        prefix = get_func_prefix(func)
+        string_keys = getattr(self.cache, 'string_keys', False)
+        def make_key(args, kw):
+            key = FuncKey(prefix, args, tuple(sorted(kw.iteritems())) if kw else ())
+            if string_keys:
+                return key.file_key()
+            try:
+                hash(key)
+            except TypeError:
+                return key.file_key()
+            return key
+        return make_key
+    
+    def _stale_cache_decorator(self, expires, is_store_file, stale_ttl,
+                               refresh_workers, key_func=None):
+        '''
+        @summary: 
+            stale-while-revalidateを行うcache_decorator
+            値は(更新時刻, 値)の組で、有効期限+stale_ttlの期限で格納します
+            更新時刻を過ぎた値を返した場合、同じキーの更新が実行中でなければ
+            ワーカースレッドに更新を投入します
+            デコレートした関数のrefresh_stats()で更新回数、失敗回数、古い値を返した回数を、
+            refresh_poolで更新用のThreadPoolを参照できます
+            ワーカースレッドから格納するため、スレッドセーフでない場合はロックを有効にします
+        '''
+        if float(stale_ttl) < 0:
+            raise ValueError("You must specify positive number for 'stale_ttl'.")
+        self._enable_thread_safety()
+        def _cache_decorator(func):
+            make_key = self._key_builder(func, key_func)
+            pool = self._get_refresh_pool(refresh_workers)
+            stats = dict(refreshes=0, failures=0, stale_hits=0, dropped=0)
+            pending = set()
+            lock = threading.Lock()
+            def _count(name):
+                with lock:
+                    stats[name] += 1
+            def _compute(key, args, kw):
+                val = func(*args, **kw)
+                _expires = self.default_expires if expires is None else expires
+                self.store(key, (create_expiration_date(_expires), val),
+                           float(_expires) + stale_ttl, is_store_file)
+                return val
+            def _load(key, args, kw):
+                # 待っている間に他の呼び出しが格納した可能性があるため再確認
+                try:
+                    return self[key][1]
+                except KeyError:
+                    pass
+                return _compute(key, args, kw)
+            def _refresh(key, args, kw):
+                try:
+                    _compute(key, args, kw)
+                except Exception:
+                    # 古い値はハードリミットまで返し続けます
+                    _count('failures')
+                else:
+                    _count('refreshes')
+                finally:
+                    with lock:
+                        pending.discard(key)
+            @wraps(func)
+            def __cache_decorator(*args, **kw):
+                key = make_key(args, kw)
+                try:
+                    refresh_date, val = self[key]
+                except KeyError:
+                    return self._flights.do(key, _load, key, args, kw)
+                if is_expired(refresh_date):
+                    with lock:
+                        stats['stale_hits'] += 1
+                        start = key not in pending
+                        if start:
+                            pending.add(key)
+                    if start and pool.try_submit(_refresh, key, args, kw) is None:
+                        # 更新の待ち行列が一杯の場合は次の呼び出しに任せます
+                        with lock:
+                            pending.discard(key)
+                            stats['dropped'] += 1
+                return val
+            def refresh_stats():
+                with lock:
+                    return dict(stats)
+            __cache_decorator.refresh_stats = refresh_stats
+            __cache_decorator.refresh_pool = pool
+            return __cache_decorator
+        return _cache_decorator
+
+    def _get_refresh_pool(self, workers):
+        '''
+        @summary:
+            更新用のThreadPoolを返します (無い場合は作成します)
+            待ち行列の上限は最初に指定したworkersで決まり、
+            より大きなworkersを指定した場合はワーカースレッドを増やします
+            close()で停止します
+        '''
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Cache is already closed.")
+            pool = self._refresh_pool
+            if pool is None:
+                pool = self._refresh_pool = ThreadPool(
+                    workers, max_queue=workers * 64, name="lamia-refresh")
+            elif workers > pool.workers:
+                pool.workers = workers
+            return pool
+    
     def async_loop(self, timeout=30.0, use_poll=False, map=None, count=None):
         '''
         @summary: 
-            イベントループを起動します
+            非同期に投入したファイルの入出力が終了するまで待ちます
+            use_poll, map, countは以前のasyncoreのループとの互換性のための引数で、使用しません
+        @return: bool: timeoutまでに全て終了した場合は真
         '''
-        if count is None:
-            count = self._max_cache_file
-        loop(timeout, use_poll, map, count)
+        return self._io.wait(timeout)
     
-    def _delete_file(self, path):
+    def delete_many(self, keys):
+        '''
+        @summary: 
+            複数のキーをメモリ上とファイル上の両方から削除します
+            ファイルの削除はワーカースレッドで並行して行います
+        @return: int: いずれかの層から削除したキーの数
+        '''
+        keys = list(keys)
+        if len(keys) < 2:
+            return sum(self._delete_key(key) for key in keys)
+        return sum(self._wait_all(
+            self._io.submit(self._delete_key, (key,), key) for key in keys))
+        
+    def _delete_key(self, key):
+        '''
+        @summary: 
+            キーをメモリ上とファイル上から削除し、いずれかにあった場合は真を返します
+        '''
+        with self._key_lock(key):
+            with self._lock:
+                removed = self.cache.pop(key, None) is not None
+                self._dirty.discard(key)
+            try:
+                self.storage.delete(self._file_key(key))
+            except KeyError:
+                pass
+            else:
+                removed = True
+        return removed
+        
+    def _delete_file(self, key):
         '''
         @summary: 
-            指定したパスのファイルを削除します
+            指定したキーのファイル上のキャッシュを削除します
         '''
-        os.remove(path)
-        #logger.debug("DELETE FILE: %s" % path)
+        try:
+            self.storage.delete(self._file_key(key))
+        except KeyError:
+            pass
+        #logger.debug("DELETE FILE: %s" % key)
         
     def _delete_expired_key(self, key):
         '''
         @summary: 
-            指定されたパスのファイルが期限切れの場合、削除します
+            指定されたキーのファイル上のキャッシュが期限切れの場合、削除します
         '''
-        path = build_path(self.cache_dir, key)
-        data = load(path)
+        data = self.storage.load(self._file_key(key))
         if is_expired(data.expiration_date):
             # 古いキャッシュの際は削除する
-            self._delete_file(path)
+            self._delete_file(key)
         
-    def _init_cache(self, cache):
+    def _init_cache(self, cache, max_entries=None, max_bytes=None,
+                    eviction='lru'):
         '''
         @summary: 
             init self.cache
+            max_entries, max_bytesのいずれかを指定した場合は
+            容量制限付きのストアを作成します
         '''
+        if max_entries is not None or max_bytes is not None:
+            cache = make_store(eviction, max_entries, max_bytes,
+                               on_evict=self._on_evict)
         self.cache = cache
+        # ファイルに未書き出しのキー
+        self._dirty = set()
+        self._init_memory_lock()
+        self._expiry_index = ExpirationIndex()
+        self._rebuild_expiry_index()
+        
+    def _on_evict(self, key, data):
+        '''
+        @summary: 
+            容量制限で追い出されたエントリが未書き出し(write_behind)の場合、ファイルに書き出します
+            is_store_fileが偽のエントリは変更済みにならないため、書き出しません
+        '''
+        if self._recorder is not None:
+            self._recorder.record_evict(key)
+        if key in self._dirty:
+            self._dirty.discard(key)
+            if not is_expired(data.expiration_date):
+                self._dump_file(key, data)
+        
+    def _rebuild_expiry_index(self):
+        '''
+        @summary: 
+            メモリ上のキャッシュから有効期限のインデックスを作り直します
+        '''
+        with self._lock:
+            self._expiry_index.rebuild(
+                (key, data.expiration_date) for key, data in self.cache.items())
+            self._expiry_index_limit = 2 * len(self._expiry_index) + \
+                self._expiry_index_slack
+        
+    def _init_memory_lock(self):
+        '''
+        @summary:
+            init self._memory_lock: dict以外のメモリ上のキャッシュの操作を保護するロック
+            スレッドセーフでない場合、またはキャッシュが自身で排他する場合はNoneです
+            容量制限付きのストアではself._lockと共通のため、参照もキーのstripeに関わらず
+            直列化されます
+        '''
+        cache = self.cache
+        if self.thread_safe and not isinstance(cache, dict) and \
+                not getattr(cache, 'lock_free', False):
+            self._memory_lock = self._lock
+        else:
+            self._memory_lock = None
+
+    def _enable_thread_safety(self):
+        '''
+        @summary:
+            スレッドセーフでない場合、ロックを有効にします
+            ワーカースレッドを起動する前に呼び出します
+        '''
+        if self.thread_safe:
+            return
+        self.thread_safe = True
+        self._lock = threading.RLock()
+        self._key_lock = StripedLock(self._lock_stripes)
+        self._init_memory_lock()
+
+    def _init_locks(self, thread_safe, lock_stripes):
+        '''
+        @summary: 
+            init self._lock: メモリ上のキャッシュと有効期限のインデックスを保護するロック
+            init self._key_lock: キー毎の更新を直列化するロック
+            スレッドセーフでない場合はいずれも何もしないロックです
+        '''
+        self.thread_safe = thread_safe
+        self._lock_stripes = lock_stripes
+        if thread_safe:
+            self._lock = threading.RLock()
+            self._key_lock = StripedLock(lock_stripes)
+        else:
+            self._lock = NullLock()
+            self._key_lock = null_lock
+        self._flights = SingleFlight()
         
     def _init_mode(self, mode):
         '''
@@ -370,6 +1171,149 @@ class Cache():
         '''
         self.mode = mode
         
+    def _init_layout(self, layout):
+        '''
+        @summary: 
+            init self.layout: キャッシュファイルの配置方法
+        '''
+        self.layout = make_layout(layout)
+        
+    def _init_storage_options(self, storage, options, codec, negative_filter=False,
+                              max_disk_bytes=None, disk_eviction='lru'):
+        '''
+        @summary: 
+            ファイル層の格納方式を記録します
+            格納方式は名前空間のディレクトリ毎に_init_cache_dirで作成します
+            'log'はメモリ上にキーの索引を持つため、negative_filterは'file'のみに渡します
+            max_disk_bytesは'file'のみが対応します
+        '''
+        self.storage_name = storage
+        self.storage_options = dict(options or {})
+        if negative_filter and storage == 'file':
+            self.storage_options.setdefault('negative_filter', negative_filter)
+        if max_disk_bytes:
+            if storage != 'file':
+                raise ValueError("max_disk_bytes is supported only by the 'file' storage.")
+            self.storage_options.setdefault('max_disk_bytes', max_disk_bytes)
+            self.storage_options.setdefault('disk_eviction', disk_eviction)
+        self.codec = codec
+        
+    def _init_compressor(self, compression, threshold, level):
+        '''
+        @summary: 
+            init self.compressor: 現在の名前空間のファイル上の値の圧縮方式
+            init self._compressors: 名前空間毎のCompressor (集計値を名前空間毎に分けます)
+        '''
+        if compression is not None:
+            # 方式の指定を確認します
+            Compressor(compression, threshold, level)
+        self._compression = (compression, threshold, level)
+        self._compressors = {}
+        self.compressor = None
+
+    def _namespace_compressor(self, namespace):
+        '''
+        @summary:
+            名前空間のCompressorを返します。無い場合は作成します
+            圧縮を使用しない場合はNone
+        '''
+        compression, threshold, level = self._compression
+        if compression is None:
+            return None
+        compressor = self._compressors.get(namespace)
+        if compressor is None:
+            compressor = Compressor(compression, threshold, level)
+            self._compressors[namespace] = compressor
+        return compressor
+        
+    def _init_stats(self, stats):
+        '''
+        @summary: 
+            init self.statistics: 名前空間毎の集計値 (集計しない場合はNone)
+            init self._recorder: 現在の名前空間の集計値
+        '''
+        self._recorder = None
+        if not stats:
+            self.statistics = None
+            return
+        if stats is True:
+            stats = None
+        self.statistics = CacheStats(stats)
+        
+    def stats(self, namespace=None, all_namespaces=False):
+        '''
+        @summary: 
+            集計値(ヒット数、ミス数、有効期限切れ、追い出し、読み書きしたbytes数、
+            fetch/store/purgeの処理時間のヒストグラム)をdictで返します
+            集計していない場合はNone
+        @param namespace: str: 省略時は現在の名前空間
+        @param all_namespaces: bool: 真の場合は名前空間をキーとするdictを返します
+        '''
+        if self.statistics is None:
+            return None
+        if all_namespaces:
+            return self.statistics.snapshot()
+        return self.statistics.snapshot(namespace or self.namespace)
+        
+    def add_observer(self, observer):
+        '''
+        @summary: 
+            集計のイベントを受け取るLamia.stats.StatsObserverを登録します
+            集計していない場合は集計を開始します
+        '''
+        if self.statistics is None:
+            self.statistics = CacheStats()
+            self._recorder = self.statistics.get(self.namespace)
+            self.storage.stats = self._recorder
+        self.statistics.add_observer(observer)
+        
+    def remove_observer(self, observer):
+        if self.statistics is not None:
+            self.statistics.remove_observer(observer)
+        
+    def disk_usage(self):
+        '''
+        @summary: 
+            現在の名前空間のファイル層の使用量(上限、使用中のbytes数、ファイル数、
+            上限による削除数)をdictで返します
+            max_disk_bytesを指定していない場合はNone
+        '''
+        disk_usage = getattr(self.storage, 'disk_usage', None)
+        if disk_usage is None:
+            return None
+        return disk_usage()
+        
+    def compression_stats(self, namespace=None, all_namespaces=False):
+        '''
+        @summary: 
+            圧縮の集計値(圧縮率、処理時間など)を返します
+            圧縮を使用していない場合はNone
+        @param namespace: str: 省略時は現在の名前空間
+        @param all_namespaces: bool: 真の場合は名前空間をキーとするdictを返します
+        '''
+        if self._compression[0] is None:
+            return None
+        if all_namespaces:
+            return dict((name, compressor.stats())
+                        for name, compressor in self._compressors.items())
+        return self._namespace_compressor(namespace or self.namespace).stats()
+        
+    def _init_storage(self):
+        '''
+        @summary: 
+            init self.storage: ファイル層の格納方式
+        '''
+        if self.storage is not None:
+            # 投入済みの入出力が終わってから閉じます
+            self._io.wait()
+            self.storage.close()
+        self.compressor = self._namespace_compressor(self.namespace)
+        self.storage = make_storage(self.storage_name, self.cache_dir,
+                                    self.layout, self.mode, self.codec,
+                                    self.compressor, **self.storage_options)
+        self.storage.stats = self._recorder
+        
+
     def _init_default_expires(self, expires):
         '''
         @summary: 
@@ -377,6 +1321,45 @@ class Cache():
         '''
         self.default_expires = float(expires)
         
+    def _init_write_behind(self, write_behind, interval, batch):
+        '''
+        @summary: 
+            init self.write_behind: 真の場合、バックグラウンドのスレッドが
+            flush_interval秒毎、または変更済みのエントリがflush_batchに達した時点で
+            flushを行います
+        '''
+        self.write_behind = write_behind
+        self.flush_interval = interval
+        self.flush_batch = batch
+        self._flush_event = threading.Event()
+        self._closed = False
+        if not write_behind:
+            return
+        def run():
+            while not self._closed:
+                self._flush_event.wait(interval)
+                self._flush_event.clear()
+                try:
+                    self.flush()
+                except Exception:
+                    # 書き出せなかったキーは変更済みのまま次回に再試行します
+                    pass
+        self._flusher = threading.Thread(target=run, name="lamia-flusher")
+        self._flusher.daemon = True
+        self._flusher.start()
+        
+    def _init_janitor(self, janitor):
+        '''
+        @summary: 
+            init self.janitor: 期限切れのキャッシュを削除するバックグラウンドのスレッド
+        '''
+        if not janitor:
+            self.janitor = None
+            return
+        options = janitor if isinstance(janitor, dict) else {}
+        self.janitor = Janitor(self, **options)
+        self.janitor.start()
+        
     def _init_default_encoding(self, encoding):
         '''
         @summary: 
@@ -391,6 +1374,10 @@ class Cache():
             init self.cache_dir: キャッシュの格納パス
         '''
         self.cache_dir = make_cache_dir(cache_root, namespace, self.mode)
+        self.namespace = namespace
+        if self.statistics is not None:
+            self._recorder = self.statistics.get(namespace)
+        self._init_storage()
         
     def _valid_expires(self, expires):
         '''
@@ -405,7 +1392,10 @@ class Cache():
         @summary: 
             del self[key]
         '''
-        del self.cache[key]
+        with self._key_lock(key):
+            with self._lock:
+                del self.cache[key]
+                self._dirty.discard(key)
         
     def __contains__(self, key):
         '''
@@ -413,7 +1403,7 @@ class Cache():
             key in self.cache
         '''
         try:
-            self.cache[key]
+            self._memory_get(key)
         except KeyError:
             return False
         else:
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import socket
+import threading
+from functools import wraps
+from Lamia.protocol import RESPONSE_HEADER, GET, SET, DELETE, GET_MULTI, PURGE, PING, \
+                           OK, NOT_FOUND, ERROR, ProtocolError, \
+                           pack_request, pack_set, pack_keys, unpack_values, unpack_count
+from Lamia.util import get_func_prefix, make_file_key, FuncKey
+'''
+@summary:
+    Lamiaのキャッシュサーバ(Lamia.server)のクライアント
+    CacheClientはCacheと同じインターフェース(fetch, get, store, cache_decoratorなど)を持ち、
+    Cacheの代わりに使用できます
+'''
+
+__all__ = ("CacheClient", "ConnectionPool", "Connection", "ServerError")
+
+class ServerError(Exception):
+    '''
+    @summary:
+        サーバが要求の処理に失敗した場合に発生する例外クラスです
+    '''
+    pass
+
+class Connection(object):
+    '''
+    @summary:
+        サーバへの1つの接続
+        要求をまとめて送信してから、同じ順序で応答を読み込めます(パイプライン)
+    '''
+    def __init__(self, address, timeout=None):
+        '''
+        @param address: str or tuple: Unixドメインソケットのパス、または(host, port)
+        @param timeout: float: 送受信のタイムアウト(秒)
+        '''
+        if isinstance(address, basestring):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(timeout)
+        sock.connect(address)
+        self.sock = sock
+        self._rfile = sock.makefile('rb')
+        self._next_id = 0
+
+    def send(self, requests):
+        '''
+        @summary:
+            (opcode, namespace, body)のリストを送信し、要求IDのリストを返します
+        '''
+        ids = []
+        frames = []
+        for opcode, namespace, body in requests:
+            self._next_id = (self._next_id + 1) & 0xffffffff
+            ids.append(self._next_id)
+            frames.append(pack_request(opcode, self._next_id, namespace, body))
+        self.sock.sendall("".join(frames))
+        return ids
+
+    def receive(self, request_id):
+        '''
+        @summary:
+            次の応答を読み込み、(status, body)を返します
+        '''
+        header = self._rfile.read(RESPONSE_HEADER.size)
+        if len(header) < RESPONSE_HEADER.size:
+            raise socket.error("Connection closed by server.")
+        status, response_id, length = RESPONSE_HEADER.unpack(header)
+        if response_id != request_id:
+            raise ProtocolError("Unexpected response id %d (expected %d)." %
+                                (response_id, request_id))
+        body = self._rfile.read(length) if length else ""
+        if len(body) < length:
+            raise socket.error("Connection closed by server.")
+        return status, body
+
+    def close(self):
+        self._rfile.close()
+        self.sock.close()
+
+class ConnectionPool(object):
+    '''
+    @summary:
+        スレッド間で共有する接続のプール
+        空いている接続が無い場合は新しく接続し、返却時にmax_idleを超えた接続は閉じます
+    '''
+    def __init__(self, address, max_idle=8, timeout=10.0):
+        self.address = address
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Connection(self.address, self.timeout)
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def execute(self, requests):
+        '''
+        @summary:
+            要求をまとめて送信し、(status, body)のリストを返します
+            通信に失敗した接続はプールに戻さずに閉じます
+        '''
+        conn = self.get()
+        try:
+            ids = conn.send(requests)
+            responses = [conn.receive(request_id) for request_id in ids]
+        except Exception:
+            conn.close()
+            raise
+        self.put(conn)
+        return responses
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+class CacheClient(object):
+    '''
+    @summary:
+        キャッシュサーバの1つの名前空間をCacheと同じインターフェースで扱うクラス
+        値はpickleで変換して送信します(サーバは値を復元しません)
+        文字列でないキーはCacheのファイル層と同じ規則で文字列にします
+    '''
+    def __init__(self, address, namespace='default', default_expires=None,
+                 max_idle=8, timeout=10.0, pool=None):
+        '''
+        @param address: str or tuple: Unixドメインソケットのパス、または(host, port)
+        @param namespace: str: キャッシュのnamespace
+        @param default_expires: float: デフォルトの有効期限 省略時はサーバのデフォルト
+        @param max_idle: int: プールに保持する接続数
+        @param timeout: float: 送受信のタイムアウト(秒)
+        @param pool: ConnectionPool: 指定した場合は他のクライアントと接続を共有します
+        '''
+        self.address = address
+        self.namespace = namespace.encode('utf8') if isinstance(namespace, unicode) \
+            else namespace
+        self.default_expires = default_expires
+        self.pool = pool or ConnectionPool(address, max_idle, timeout)
+
+    def _key(self, key):
+        key = make_file_key(key)
+        if isinstance(key, unicode):
+            return key.encode('utf8')
+        return key
+
+    def _check(self, status, body):
+        if status == ERROR:
+            raise ServerError(body)
+        return status
+
+    def _call(self, opcode, body=""):
+        status, body = self.pool.execute([(opcode, self.namespace, body)])[0]
+        return self._check(status, body), body
+
+    def change_namespace(self, namespace, default_expires=None):
+        self.namespace = namespace.encode('utf8') if isinstance(namespace, unicode) \
+            else namespace
+        if default_expires is not None:
+            self.default_expires = default_expires
+
+    def ping(self):
+        self._call(PING)
+        return True
+
+    def fetch(self, key, zero_copy=False):
+        '''
+        @summary:
+            キーに対応する値を取り出します。無い場合はKeyError
+        '''
+        status, body = self._call(GET, self._key(key))
+        if status == NOT_FOUND:
+            raise KeyError(key)
+        return pickle.loads(body)
+
+    def get(self, key, default=None, zero_copy=False):
+        try:
+            return self.fetch(key)
+        except KeyError:
+            return default
+
+    def store(self, key, val, expires=None, is_store_file=True):
+        if expires is None:
+            expires = self.default_expires
+        self._call(SET, pack_set(self._key(key), pickle.dumps(val, pickle.HIGHEST_PROTOCOL),
+                                 expires, is_store_file))
+
+    def get_many(self, keys, zero_copy=False):
+        '''
+        @summary:
+            複数のキーに対応する値を1回の要求で取り出します
+        @return: dict: 見つかったキーと値
+        '''
+        keys = list(keys)
+        if not keys:
+            return {}
+        status, body = self._call(GET_MULTI, pack_keys([self._key(key) for key in keys]))
+        return dict((key, pickle.loads(value))
+                    for key, value in zip(keys, unpack_values(body)) if value is not None)
+
+    def store_many(self, mapping, expires=None, is_store_file=True):
+        '''
+        @summary:
+            複数のキーと値をパイプラインでまとめて格納します
+        '''
+        if expires is None:
+            expires = self.default_expires
+        items = mapping.items() if isinstance(mapping, dict) else list(mapping)
+        if not items:
+            return
+        requests = [(SET, self.namespace,
+                     pack_set(self._key(key), pickle.dumps(val, pickle.HIGHEST_PROTOCOL),
+                              expires, is_store_file))
+                    for key, val in items]
+        for status, body in self.pool.execute(requests):
+            self._check(status, body)
+
+    def delete_many(self, keys):
+        '''
+        @summary:
+            複数のキーをパイプラインでまとめて削除します
+        @return: int: 削除したキーの数
+        '''
+        requests = [(DELETE, self.namespace, self._key(key)) for key in keys]
+        if not requests:
+            return 0
+        return sum(self._check(status, body) == OK
+                   for status, body in self.pool.execute(requests))
+
+    def purge(self):
+        '''
+        @summary:
+            サーバ上の名前空間の期限切れのキャッシュを削除します
+        @return: int: 削除した件数
+        '''
+        status, body = self._call(PURGE)
+        return unpack_count(body)
+
+    def cache_decorator(self, expires=None, is_store_file=False, key=None):
+        '''
+        @summary:
+            Cache.cache_decoratorと同様に関数の結果をキャッシュします
+            キーはCacheのファイル層と同じ文字列です
+        @param key: function: key(*args, **kw)関数の引数からキーを返す関数
+        '''
+        key_func = key
+        def _cache_decorator(func):
+            prefix = get_func_prefix(func)
+            @wraps(func)
+            def __cache_decorator(*args, **kw):
+                if key_func is not None:
+                    key = key_func(*args, **kw)
+                else:
+                    key = FuncKey(prefix, args, tuple(sorted(kw.iteritems())) if kw else ())
+                try:
+                    return self.fetch(key)
+                except KeyError:
+                    pass
+                val = func(*args, **kw)
+                self.store(key, val, expires, is_store_file)
+                return val
+            return __cache_decorator
+        return _cache_decorator
+
+    def close(self):
+        self.pool.close()
+
+    def __getitem__(self, key):
+        return self.fetch(key)
+
+    def __setitem__(self, key, val):
+        self.store(key, val)
+
+    def __delitem__(self, key):
+        if not self.delete_many([key]):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self.get_many([key]) != {}
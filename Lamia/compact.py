@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+from array import array
+from Lamia.util import _CacheData
+'''
+@summary:
+    多数の小さなエントリを少ないメモリで保持するメモリ上のキャッシュを提供するモジュール
+    Cacheのcacheに指定して使います
+        cache = Cache(..., cache=CompactStore())
+'''
+
+__all__ = ("CompactStore",)
+
+# ハッシュテーブルのスロットの値 (0以上はエントリの番号です)
+_EMPTY = -1
+_DELETED = -2
+
+# エントリのフラグ
+_LIVE = 1
+_KEY_INLINE = 2
+_VAL_INLINE = 4
+_VAL_UNICODE = 8
+
+class CompactStore(object):
+    '''
+    @summary:
+        オープンアドレス法(線形探索)のハッシュテーブルと、エントリ毎の列(array)で
+        キャッシュを保持するストア
+        エントリはハッシュ値、有効期限(array('d'))、位置と長さ、フラグの列からなり、
+        strのキーとinline_max bytes以下のstr(unicode)の値は1つのbytearrayに詰めて格納します
+        それ以外のキーと値のみPythonのオブジェクトとして保持します
+        エントリ毎にdictの要素、キーの文字列、_CacheDataと有効期限のfloatを持たないため、
+        小さなエントリのメモリ使用量はdictの数分の1になります
+        取り出しの度に_CacheDataを作成するため、参照はdictより遅くなります
+        削除、上書きしたエントリの領域は、不要な領域が半分を超えた時点で詰め直します
+    '''
+    # 最小のテーブルのサイズ(2の累乗)
+    _min_capacity = 8
+
+    def __init__(self, inline_max=256, capacity=None):
+        '''
+        @param inline_max: int: bytearrayに詰めて格納する値の長さの上限(bytes)
+        @param capacity: int: 想定するエントリ数 (テーブルを予め確保します)
+        '''
+        self.inline_max = inline_max
+        self._allocate(capacity or 0)
+
+    def _allocate(self, entries):
+        '''
+        @summary:
+            entries個のエントリを再ハッシュせずに保持できる空のテーブルと列を用意します
+        '''
+        size = self._min_capacity
+        while size * 2 < entries * 3:
+            size *= 2
+        self._table = array('i', [_EMPTY]) * size
+        self._mask = size - 1
+        # スロットの使用数 (_DELETEDを含みます)
+        self._used = 0
+        self._len = 0
+        self._hashes = array('l')
+        self._expires = array('d')
+        self._offsets = array('L')
+        self._key_lengths = array('I')
+        self._val_lengths = array('I')
+        self._flags = array('B')
+        self._arena = bytearray()
+        # 削除、上書きされたエントリのbytearray上のbytes数
+        self._garbage = 0
+        # エントリの番号 => キー、値 (bytearrayに格納しないもののみ)
+        self._key_objects = {}
+        self._val_objects = {}
+
+    def _key_at(self, i):
+        if self._flags[i] & _KEY_INLINE:
+            offset = self._offsets[i]
+            return str(self._arena[offset:offset + self._key_lengths[i]])
+        return self._key_objects[i]
+
+    def _val_at(self, i):
+        flags = self._flags[i]
+        if not flags & _VAL_INLINE:
+            return self._val_objects[i]
+        start = self._offsets[i] + self._key_lengths[i]
+        val = str(self._arena[start:start + self._val_lengths[i]])
+        if flags & _VAL_UNICODE:
+            return val.decode('utf8')
+        return val
+
+    def _lookup(self, key, h):
+        '''
+        @summary:
+            キーのスロットの位置とエントリの番号を返します
+            無い場合のエントリの番号は-1で、位置は格納に使うスロットです
+        '''
+        table = self._table
+        hashes = self._hashes
+        mask = self._mask
+        slot = h & mask
+        free = -1
+        while True:
+            i = table[slot]
+            if i == _EMPTY:
+                return (slot if free < 0 else free), -1
+            if i == _DELETED:
+                if free < 0:
+                    free = slot
+            elif hashes[i] == h and self._key_at(i) == key:
+                return slot, i
+            slot = (slot + 1) & mask
+
+    def __getitem__(self, key):
+        i = self._lookup(key, hash(key))[1]
+        if i < 0:
+            raise KeyError(key)
+        return _CacheData(val=self._val_at(i), expiration_date=self._expires[i])
+
+    peek = __getitem__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self._lookup(key, hash(key))[1] >= 0
+
+    def __setitem__(self, key, data):
+        h = hash(key)
+        slot, i = self._lookup(key, h)
+        if i >= 0:
+            self._drop(i)
+        elif self._table[slot] == _EMPTY:
+            self._used += 1
+        self._table[slot] = self._append(key, h, data.val, data.expiration_date)
+        self._len += 1
+        if self._used * 3 > len(self._table) * 2:
+            self._rebuild()
+        elif i >= 0:
+            self._compact()
+
+    def _append(self, key, h, val, expiration_date):
+        '''
+        @summary:
+            列の末尾にエントリを追加し、その番号を返します
+        '''
+        i = len(self._hashes)
+        flags = _LIVE
+        offset = len(self._arena)
+        key_length = val_length = 0
+        if type(key) is str:
+            flags |= _KEY_INLINE
+            key_length = len(key)
+            self._arena += key
+        else:
+            self._key_objects[i] = key
+        if type(val) is unicode:
+            encoded = val.encode('utf8')
+            if len(encoded) <= self.inline_max:
+                flags |= _VAL_INLINE | _VAL_UNICODE
+                val = encoded
+        elif type(val) is str and len(val) <= self.inline_max:
+            flags |= _VAL_INLINE
+        if flags & _VAL_INLINE:
+            val_length = len(val)
+            self._arena += val
+        else:
+            self._val_objects[i] = val
+        self._hashes.append(h)
+        self._expires.append(expiration_date)
+        self._offsets.append(offset)
+        self._key_lengths.append(key_length)
+        self._val_lengths.append(val_length)
+        self._flags.append(flags)
+        return i
+
+    def _drop(self, i):
+        '''
+        @summary:
+            エントリを削除済みにします (列とbytearrayの領域は_rebuildで詰めます)
+        '''
+        self._flags[i] = 0
+        self._key_objects.pop(i, None)
+        self._val_objects.pop(i, None)
+        self._garbage += self._key_lengths[i] + self._val_lengths[i]
+        self._len -= 1
+
+    def __delitem__(self, key):
+        slot, i = self._lookup(key, hash(key))
+        if i < 0:
+            raise KeyError(key)
+        self._drop(i)
+        self._table[slot] = _DELETED
+        self._compact()
+
+    def pop(self, key, *default):
+        slot, i = self._lookup(key, hash(key))
+        if i < 0:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        data = _CacheData(val=self._val_at(i), expiration_date=self._expires[i])
+        self._drop(i)
+        self._table[slot] = _DELETED
+        self._compact()
+        return data
+
+    def _compact(self):
+        '''
+        @summary:
+            削除、上書きしたエントリの領域が有効なエントリの領域を超えた場合に詰め直します
+        '''
+        if self._garbage * 2 > len(self._arena) + 4096 or \
+                len(self._hashes) > 2 * self._len + 1024:
+            self._rebuild()
+
+    def _rebuild(self):
+        '''
+        @summary:
+            有効なエントリのみで列、bytearrayとテーブルを作り直します
+            エントリ数に応じてテーブルを拡大(または縮小)します
+        '''
+        hashes, expires, offsets = self._hashes, self._expires, self._offsets
+        key_lengths, val_lengths, flags = self._key_lengths, self._val_lengths, self._flags
+        arena, key_objects, val_objects = self._arena, self._key_objects, self._val_objects
+        count = self._len
+        self._allocate(count * 2)
+        table = self._table
+        mask = self._mask
+        # エントリ毎に列の値を写すため、全てのエントリのオブジェクトを一度に作りません
+        for i in xrange(len(hashes)):
+            if not flags[i] & _LIVE:
+                continue
+            j = len(self._hashes)
+            h = hashes[i]
+            offset = offsets[i]
+            length = key_lengths[i] + val_lengths[i]
+            self._offsets.append(len(self._arena))
+            self._arena += arena[offset:offset + length]
+            self._hashes.append(h)
+            self._expires.append(expires[i])
+            self._key_lengths.append(key_lengths[i])
+            self._val_lengths.append(val_lengths[i])
+            self._flags.append(flags[i])
+            if i in key_objects:
+                self._key_objects[j] = key_objects[i]
+            if i in val_objects:
+                self._val_objects[j] = val_objects[i]
+            slot = h & mask
+            while table[slot] != _EMPTY:
+                slot = (slot + 1) & mask
+            table[slot] = j
+        self._used = self._len = count
+
+    def iteritems(self):
+        for i in xrange(len(self._hashes)):
+            if self._flags[i] & _LIVE:
+                yield self._key_at(i), \
+                      _CacheData(val=self._val_at(i), expiration_date=self._expires[i])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return [key for key, _ in self.iteritems()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def update(self, other):
+        for key, data in other.items():
+            self[key] = data
+
+    def clear(self):
+        self._allocate(0)
+
+    def __len__(self):
+        return self._len
+
+    def stats(self):
+        '''
+        @summary:
+            エントリ数、テーブルのサイズ、bytearrayのサイズなどをdictで返します
+        '''
+        return dict(entries=self._len, capacity=len(self._table),
+                    arena_bytes=len(self._arena), garbage_bytes=self._garbage,
+                    objects=len(self._key_objects) + len(self._val_objects))
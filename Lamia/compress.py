@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import bz2
+import zlib
+import time
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+'''
+@summary:
+    キャッシュファイルの値の圧縮をサポートするモジュール
+    圧縮方式の識別子はレコードのヘッダのflagsに記録されるため、
+    圧縮方式や閾値を変更しても既存のファイルはそのまま読み込めます
+'''
+
+__all__ = ("Compressor", "compress_ids", "decompress")
+
+COMPRESS_NONE = 0
+COMPRESS_ZLIB = 1
+COMPRESS_BZ2 = 2
+COMPRESS_LZMA = 3
+
+# flagsのうち圧縮方式に使うビット
+COMPRESS_MASK = 0x0f
+
+# compression id => (name, compress(data, level), decompress(data))
+_algorithms = {
+    COMPRESS_ZLIB: ('zlib',
+                    lambda data, level: zlib.compress(data, 6 if level is None else level),
+                    zlib.decompress),
+    COMPRESS_BZ2: ('bz2',
+                   lambda data, level: bz2.compress(data, 9 if level is None else level),
+                   bz2.decompress),
+}
+if lzma is not None:
+    _algorithms[COMPRESS_LZMA] = (
+        'lzma',
+        lambda data, level: lzma.compress(data, preset=6 if level is None else level),
+        lzma.decompress)
+
+compress_ids = dict((name, compress_id)
+                    for compress_id, (name, _, _) in _algorithms.iteritems())
+
+def decompress(compress_id, data):
+    '''
+    @summary:
+        識別子に対応する方式でデータを展開します
+    '''
+    try:
+        _, _, decompress_data = _algorithms[compress_id]
+    except KeyError:
+        raise ValueError("Unsupported compression id: %d" % compress_id)
+    return decompress_data(data)
+
+class Compressor(object):
+    '''
+    @summary:
+        閾値以上のサイズの値を圧縮し、圧縮率と処理時間を集計するクラス
+        圧縮しても小さくならない値はそのまま格納します
+    '''
+    def __init__(self, method='zlib', threshold=1024, level=None):
+        '''
+        @param method: str: 'zlib', 'bz2', 'lzma'
+        @param threshold: int: このサイズ(bytes)未満の値は圧縮しません
+        @param level: int: 圧縮レベル 省略時は方式ごとのデフォルト
+        '''
+        try:
+            self.compress_id = compress_ids[method]
+        except KeyError:
+            raise ValueError("Unsupported compression '%s'." % method)
+        self.method = method
+        self.threshold = threshold
+        self.level = level
+        self._compress = _algorithms[self.compress_id][1]
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.compressed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_time = 0.0
+        self.decompressed = 0
+        self.decompress_time = 0.0
+
+    def compress(self, payload):
+        '''
+        @summary:
+            値を圧縮して(compression id, data)を返します
+        '''
+        if len(payload) < self.threshold:
+            self.skipped += 1
+            return COMPRESS_NONE, payload
+        start = time.time()
+        data = self._compress(payload, self.level)
+        self.compress_time += time.time() - start
+        if len(data) >= len(payload):
+            self.skipped += 1
+            return COMPRESS_NONE, payload
+        self.compressed += 1
+        self.bytes_in += len(payload)
+        self.bytes_out += len(data)
+        return self.compress_id, data
+
+    def decompress(self, compress_id, data):
+        '''
+        @summary:
+            値を展開し、処理時間を記録します
+        '''
+        start = time.time()
+        data = decompress(compress_id, data)
+        self.decompressed += 1
+        self.decompress_time += time.time() - start
+        return data
+
+    @property
+    def ratio(self):
+        '''
+        @summary:
+            圧縮した値の圧縮後/圧縮前のサイズの比
+        '''
+        if not self.bytes_in:
+            return 1.0
+        return float(self.bytes_out) / self.bytes_in
+
+    def stats(self):
+        '''
+        @summary:
+            集計値をdictで返します
+        '''
+        return dict(method=self.method,
+                    compressed=self.compressed,
+                    skipped=self.skipped,
+                    bytes_in=self.bytes_in,
+                    bytes_out=self.bytes_out,
+                    ratio=self.ratio,
+                    compress_time=self.compress_time,
+                    decompressed=self.decompressed,
+                    decompress_time=self.decompress_time)
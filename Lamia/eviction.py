@@ -0,0 +1,621 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import sys
+from collections import OrderedDict
+'''
+@summary:
+    メモリ上のキャッシュの容量を制限するためのストアを提供するモジュール
+    いずれのストアもdictと同じインターフェースを持ち、
+    Cache.cacheとしてそのまま利用できます
+'''
+
+__all__ = ("LRUStore", "LFUStore", "TinyLFUStore", "CountMinSketch",
+           "AlwaysAdmission", "FrequencyAdmission", "make_store", "make_admission",
+           "sizeof_entry")
+
+# 1エントリあたりの管理コストの概算(dictのスロット、_CacheData、expiration_date)
+_ENTRY_OVERHEAD = 128
+
+def sizeof_entry(key, data):
+    '''
+    @summary:
+        エントリのおおよそのメモリ使用量(bytes)を返します
+        dataが_CacheDataの場合はval属性のサイズを計測します
+    '''
+    val = getattr(data, 'val', data)
+    try:
+        size = sys.getsizeof(key) + sys.getsizeof(val)
+    except TypeError:
+        size = 0
+    return size + _ENTRY_OVERHEAD
+
+class _BoundedStore(object):
+    '''
+    @summary:
+        容量制限付きストアの基底クラス
+        max_entries: エントリ数の上限, max_bytes: 合計サイズの上限
+        どちらもNoneの場合は制限しません
+    '''
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=sizeof_entry,
+                 on_evict=None):
+        '''
+        @param max_entries: int: 保持するエントリ数の上限
+        @param max_bytes: int: 保持するエントリの合計サイズの上限
+        @param sizeof: function: sizeof(key, value)でエントリのサイズを返す関数
+        @param on_evict: function: on_evict(key, value)追い出し時に呼ばれる関数
+        '''
+        if max_entries is not None and int(max_entries) <= 0:
+            raise ValueError("You must specify positive number for 'max_entries'.")
+        if max_bytes is not None and int(max_bytes) <= 0:
+            raise ValueError("You must specify positive number for 'max_bytes'.")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def _evicted(self, key, value):
+        '''
+        @summary:
+            追い出されたエントリを記録し、コールバックを呼び出します
+        '''
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self.peek(key)
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def update(self, other=(), **kw):
+        if hasattr(other, 'iteritems'):
+            other = other.iteritems()
+        elif hasattr(other, 'items'):
+            other = other.items()
+        for key, value in other:
+            self[key] = value
+        for key, value in kw.iteritems():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        for key in self.keys():
+            yield self.peek(key)
+
+    def iteritems(self):
+        '''
+        @summary:
+            (key, value)を列挙します
+            列挙中に削除されても良いように、キーのスナップショットを走査します
+            アクセス順序や頻度は更新しません
+        '''
+        for key in self.keys():
+            try:
+                yield key, self.peek(key)
+            except KeyError:
+                continue
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __repr__(self):
+        return "<%s entries=%d bytes=%d>" % (self.__class__.__name__,
+                                             len(self), self.total_bytes)
+
+class LRUStore(_BoundedStore):
+    '''
+    @summary:
+        最も長く参照されていないエントリから追い出すストア
+    '''
+    def __init__(self, *args, **kw):
+        _BoundedStore.__init__(self, *args, **kw)
+        # key => (value, size)
+        self._data = OrderedDict()
+
+    def __getitem__(self, key):
+        entry = self._data.pop(key)
+        self._data[key] = entry
+        return entry[0]
+
+    def peek(self, key):
+        '''
+        @summary:
+            アクセス順序を更新せずに値を返します
+        '''
+        return self._data[key][0]
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(key, value)
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old[1]
+        self._data[key] = (value, size)
+        self.total_bytes += size
+        self._evict()
+
+    def __delitem__(self, key):
+        _, size = self._data.pop(key)
+        self.total_bytes -= size
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return list(self._data)
+
+    def clear(self):
+        self._data.clear()
+        self.total_bytes = 0
+
+    def _evict(self):
+        data = self._data
+        while data and ((self.max_entries is not None and len(data) > self.max_entries) or
+                        (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            key, (value, size) = data.popitem(last=False)
+            self.total_bytes -= size
+            self._evicted(key, value)
+
+class _FreqNode(object):
+    '''
+    @summary:
+        LFUStoreの頻度リストのノード
+        同じ参照回数のキーを参照順に保持します
+    '''
+    __slots__ = ('freq', 'keys', 'prev', 'next')
+
+    def __init__(self, freq, prev, next):
+        self.freq = freq
+        self.keys = OrderedDict()
+        self.prev = prev
+        self.next = next
+
+class LFUStore(_BoundedStore):
+    '''
+    @summary:
+        最も参照回数が少ないエントリから追い出すストア
+        参照回数ごとのノードを双方向リストで繋ぐことで、
+        参照、格納、追い出しをO(1)で行います
+        同じ参照回数のエントリ同士では最も古いものから追い出します
+    '''
+    def __init__(self, *args, **kw):
+        _BoundedStore.__init__(self, *args, **kw)
+        # key => [value, size, node]
+        self._data = {}
+        # 番兵ノード: head.nextが最小頻度のノード
+        self._head = _FreqNode(0, None, None)
+        self._head.prev = self._head.next = self._head
+
+    def _unlink(self, node):
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+    def _node_after(self, node, freq):
+        '''
+        @summary:
+            nodeの直後にfreqのノードを返します。存在しなければ作成します
+        '''
+        nxt = node.next
+        if nxt is not self._head and nxt.freq == freq:
+            return nxt
+        new = _FreqNode(freq, node, nxt)
+        node.next = new
+        nxt.prev = new
+        return new
+
+    def _remove_from_node(self, key, node):
+        del node.keys[key]
+        if not node.keys:
+            self._unlink(node)
+
+    def __getitem__(self, key):
+        entry = self._data[key]
+        node = entry[2]
+        new = self._node_after(node, node.freq + 1)
+        new.keys[key] = None
+        self._remove_from_node(key, node)
+        entry[2] = new
+        return entry[0]
+
+    def peek(self, key):
+        return self._data[key][0]
+
+    def frequency(self, key):
+        '''
+        @summary:
+            キーの参照回数を返します
+        '''
+        return self._data[key][2].freq
+
+    def __setitem__(self, key, value):
+        size = self.sizeof(key, value)
+        entry = self._data.get(key)
+        if entry is not None:
+            # 上書きは参照として扱います
+            self.total_bytes += size - entry[1]
+            entry[0] = value
+            entry[1] = size
+            self[key]
+        else:
+            # 新規エントリのために先に追い出しておく
+            self._evict(extra_entries=1, extra_bytes=size)
+            node = self._node_after(self._head, 1)
+            node.keys[key] = None
+            self._data[key] = [value, size, node]
+            self.total_bytes += size
+        self._evict()
+
+    def __delitem__(self, key):
+        value, size, node = self._data.pop(key)
+        self._remove_from_node(key, node)
+        self.total_bytes -= size
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        return list(self._data)
+
+    def clear(self):
+        self._data.clear()
+        self._head.prev = self._head.next = self._head
+        self.total_bytes = 0
+
+    def _evict(self, extra_entries=0, extra_bytes=0):
+        while self._data and ((self.max_entries is not None and
+                               len(self._data) + extra_entries > self.max_entries) or
+                              (self.max_bytes is not None and
+                               self.total_bytes + extra_bytes > self.max_bytes)):
+            node = self._head.next
+            key = next(iter(node.keys))
+            value = self._data[key][0]
+            del self[key]
+            self._evicted(key, value)
+
+# カウンタを半減させるbytearray.translateの変換表
+_halve_table = "".join(chr(i >> 1) for i in xrange(256))
+_mask64 = 0xffffffffffffffff
+
+class CountMinSketch(object):
+    '''
+    @summary:
+        キーの参照頻度を概算するCount-Minスケッチ
+        カウンタは15で飽和し、sample_size回の加算ごとに半減させて
+        古い頻度を減衰させます
+    '''
+    _depth = 4
+    _max_count = 15
+
+    def __init__(self, width=1024, sample_size=None):
+        '''
+        @param width: int: 1行あたりのカウンタ数(2の累乗に切り上げます)
+        @param sample_size: int: 減衰させるまでの加算回数
+        '''
+        w = 16
+        while w < width:
+            w <<= 1
+        self.width = w
+        self._mask = w - 1
+        self._table = [bytearray(w) for _ in xrange(self._depth)]
+        self.sample_size = sample_size or w * 10
+        self._additions = 0
+
+    def _indexes(self, key):
+        '''
+        @summary:
+            hashを64bitに拡散し、上位と下位の32bitによるダブルハッシングで
+            行毎に独立した位置を求めます
+        '''
+        h = hash(key) & _mask64
+        h = ((h ^ (h >> 33)) * 0xff51afd7ed558ccd) & _mask64
+        h = ((h ^ (h >> 33)) * 0xc4ceb9fe1a85ec53) & _mask64
+        h ^= h >> 33
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) | 1
+        mask = self._mask
+        return [(h1 + i * h2) & mask for i in xrange(self._depth)]
+
+    def increment(self, key):
+        '''
+        @summary:
+            キーの参照回数を加算します
+        '''
+        added = False
+        max_count = self._max_count
+        for row, i in zip(self._table, self._indexes(key)):
+            if row[i] < max_count:
+                row[i] += 1
+                added = True
+        if added:
+            self._additions += 1
+            if self._additions >= self.sample_size:
+                self._reset()
+
+    def frequency(self, key):
+        '''
+        @summary:
+            キーの参照回数の推定値を返します
+        '''
+        return min([row[i] for row, i in zip(self._table, self._indexes(key))])
+
+    def _reset(self):
+        # 行毎にtranslateで一括して半減させます (カウンタ毎のループは行いません)
+        self._table = [row.translate(_halve_table) for row in self._table]
+        self._additions //= 2
+
+class TinyLFUStore(_BoundedStore):
+    '''
+    @summary:
+        W-TinyLFUによる追い出しを行うストア
+        新規エントリは小さなLRUのウィンドウに入り、
+        ウィンドウから溢れたエントリはCount-Minスケッチで見積もった頻度が
+        メインのSLRU(probation/protected)の追い出し候補より高い場合のみ受け入れます
+    '''
+    _window_ratio = 0.01
+    _protected_ratio = 0.8
+
+    def __init__(self, *args, **kw):
+        _BoundedStore.__init__(self, *args, **kw)
+        # key => (value, size)
+        self._window = OrderedDict()
+        self._probation = OrderedDict()
+        self._protected = OrderedDict()
+        self._segments = {'window': self._window, 'probation': self._probation,
+                          'protected': self._protected}
+        # segment => [entries, bytes]
+        self._usage = {'window': [0, 0], 'probation': [0, 0], 'protected': [0, 0]}
+        self._where = {}
+        width = self.max_entries or (self.max_bytes // 1024 if self.max_bytes else 0)
+        self.sketch = CountMinSketch(max(width * 8, 16))
+
+    def _limits(self, segment):
+        '''
+        @summary:
+            セグメントごとの(エントリ数, bytes)の上限を返します
+            ウィンドウは全体のおよそ1%、残りをメイン領域とし、
+            メイン領域の80%をprotectedとします
+        '''
+        limits = []
+        for total in (self.max_entries, self.max_bytes):
+            if total is None:
+                limits.append(None)
+                continue
+            window = max(1, int(total * self._window_ratio))
+            main = total - window
+            if segment == 'window':
+                limits.append(window)
+            elif segment == 'main':
+                limits.append(main)
+            else:
+                limits.append(int(main * self._protected_ratio))
+        return tuple(limits)
+
+    def _segment(self, name):
+        return self._segments[name]
+
+    def _put(self, name, key, entry):
+        self._segment(name)[key] = entry
+        usage = self._usage[name]
+        usage[0] += 1
+        usage[1] += entry[1]
+        self._where[key] = name
+
+    def _take(self, key):
+        name = self._where.pop(key)
+        entry = self._segment(name).pop(key)
+        usage = self._usage[name]
+        usage[0] -= 1
+        usage[1] -= entry[1]
+        return entry
+
+    def _main_usage(self):
+        p, q = self._usage['probation'], self._usage['protected']
+        return p[0] + q[0], p[1] + q[1]
+
+    def _over(self, used, limits, extra=(0, 0)):
+        entries, bytes_ = limits
+        return ((entries is not None and used[0] + extra[0] > entries) or
+                (bytes_ is not None and used[1] + extra[1] > bytes_))
+
+    def __getitem__(self, key):
+        name = self._where[key]
+        self.sketch.increment(key)
+        if name == 'probation':
+            # probationで再度参照されたものはprotectedへ昇格
+            entry = self._take(key)
+            self._put('protected', key, entry)
+            self._demote_protected()
+        else:
+            segment = self._segment(name)
+            segment[key] = segment.pop(key)
+            entry = segment[key]
+        return entry[0]
+
+    def peek(self, key):
+        return self._segment(self._where[key])[key][0]
+
+    def __setitem__(self, key, value):
+        entry = (value, self.sizeof(key, value))
+        if key in self._where:
+            name = self._where[key]
+            self._take(key)
+            self._put(name, key, entry)
+            self.sketch.increment(key)
+        else:
+            self.sketch.increment(key)
+            self._put('window', key, entry)
+        self._evict()
+
+    def __delitem__(self, key):
+        self._take(key)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def __len__(self):
+        return len(self._where)
+
+    @property
+    def total_bytes(self):
+        return sum(usage[1] for usage in self._usage.itervalues())
+
+    @total_bytes.setter
+    def total_bytes(self, value):
+        # _BoundedStore.__init__での初期化用 (使用量は_usageから計算します)
+        pass
+
+    def keys(self):
+        return list(self._where)
+
+    def clear(self):
+        for name in self._usage:
+            self._segment(name).clear()
+            self._usage[name] = [0, 0]
+        self._where.clear()
+
+    def _demote_protected(self):
+        limits = self._limits('protected')
+        while self._protected and self._over(self._usage['protected'], limits):
+            key = next(iter(self._protected))
+            self._put('probation', key, self._take(key))
+
+    def _main_victim(self):
+        for segment in (self._probation, self._protected):
+            if segment:
+                return next(iter(segment))
+        return None
+
+    def _evict(self):
+        window_limits = self._limits('window')
+        main_limits = self._limits('main')
+        while self._window and self._over(self._usage['window'], window_limits):
+            key = next(iter(self._window))
+            entry = self._take(key)
+            self._admit(key, entry, main_limits)
+        # 上書きで大きくなったメイン領域のエントリも上限に収めます
+        self._demote_protected()
+        while self._over(self._main_usage(), main_limits):
+            victim = self._main_victim()
+            if victim is None:
+                break
+            self._evicted(victim, self._take(victim)[0])
+
+    def _admit(self, key, entry, main_limits):
+        '''
+        @summary:
+            ウィンドウから溢れたエントリをメイン領域に受け入れるか判定します
+        '''
+        extra = (1, entry[1])
+        if self._over((0, 0), main_limits, extra):
+            # 単体で上限を超えるものは受け入れない
+            self._evicted(key, entry[0])
+            return
+        freq = self.sketch.frequency(key)
+        while self._over(self._main_usage(), main_limits, extra):
+            victim = self._main_victim()
+            if freq > self.sketch.frequency(victim):
+                self._evicted(victim, self._take(victim)[0])
+            else:
+                self._evicted(key, entry[0])
+                return
+        self._put('probation', key, entry)
+
+_policies = {
+    'lru': LRUStore,
+    'lfu': LFUStore,
+    'tinylfu': TinyLFUStore,
+    'w-tinylfu': TinyLFUStore,
+}
+
+def make_store(policy='lru', max_entries=None, max_bytes=None, **kw):
+    '''
+    @summary:
+        追い出しポリシー名に対応するストアを作成します
+    @param policy: str: 'lru', 'lfu', 'tinylfu'のいずれか
+    '''
+    try:
+        store_class = _policies[policy.lower()]
+    except KeyError:
+        raise ValueError("Unknown eviction policy '%s'." % policy)
+    return store_class(max_entries=max_entries, max_bytes=max_bytes, **kw)
+
+class AlwaysAdmission(object):
+    '''
+    @summary:
+        全てのキーを受け入れるアドミッションポリシー
+    '''
+    def admit(self, key):
+        return True
+
+class FrequencyAdmission(object):
+    '''
+    @summary:
+        Count-Minスケッチで見積もった参照回数がmin_hits以上のキーのみ受け入れる
+        アドミッションポリシー
+        1回しか参照されないキー(走査など)を受け入れないため、よく参照されるエントリを
+        追い出しません。頻度はスケッチの減衰で徐々に忘れます
+    '''
+    def __init__(self, min_hits=2, width=1024):
+        '''
+        @param min_hits: int: 受け入れるのに必要な参照回数
+        @param width: int: スケッチの1行あたりのカウンタ数
+        '''
+        self.min_hits = min_hits
+        self.sketch = CountMinSketch(width)
+
+    def admit(self, key):
+        '''
+        @summary:
+            キーの参照を記録し、受け入れる場合は真を返します
+        '''
+        self.sketch.increment(key)
+        return self.sketch.frequency(key) >= self.min_hits
+
+def make_admission(policy, min_hits=2, width=1024):
+    '''
+    @summary:
+        アドミッションポリシー名に対応するポリシーを作成します
+    @param policy: str: 'always'(またはTrue)、'frequency'のいずれか 偽の場合はNone
+    '''
+    if not policy:
+        return None
+    if policy is True or policy == 'always':
+        return AlwaysAdmission()
+    if policy == 'frequency':
+        return FrequencyAdmission(min_hits, width)
+    raise ValueError("Unknown admission policy '%s'." % policy)
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import os
+import fcntl
+import heapq
+import struct
+import threading
+from itertools import count
+from contextlib import contextmanager
+from Lamia.layout import EXPIRY_JOURNAL
+'''
+@summary:
+    有効期限順にキーを取り出すためのインデックスを提供するモジュール
+'''
+
+__all__ = ("ExpirationIndex", "FileExpiryIndex", "JOURNAL_MAGIC")
+
+class ExpirationIndex(object):
+    '''
+    @summary:
+        (expiration_date, key)の最小ヒープ
+        上書きや削除されたキーの古い要素はヒープに残りますが(遅延削除)、
+        取り出し側で現在の有効期限と照合して読み捨てます
+        古い要素が増えすぎた場合はrebuildで作り直します
+    '''
+    def __init__(self):
+        self._heap = []
+        self._counter = count()
+
+    def push(self, key, expiration_date):
+        '''
+        @summary:
+            キーと有効期限を登録します
+        '''
+        heapq.heappush(self._heap, (expiration_date, next(self._counter), key))
+
+    def peek_date(self):
+        '''
+        @summary:
+            最も早い有効期限を返します。空の場合はNone
+        '''
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def pop_expired(self, date, max_items=None):
+        '''
+        @summary:
+            有効期限がdate以前の(key, expiration_date)を期限の早い順に取り出します
+            max_itemsを指定した場合は、その件数を取り出した時点で終了します
+        '''
+        heap = self._heap
+        popped = 0
+        while heap and heap[0][0] <= date:
+            if max_items is not None and popped >= max_items:
+                break
+            expiration_date, _, key = heapq.heappop(heap)
+            popped += 1
+            yield key, expiration_date
+
+    def rebuild(self, items):
+        '''
+        @summary:
+            (key, expiration_date)の列からヒープを作り直します
+        '''
+        counter = self._counter
+        self._heap = [(expiration_date, next(counter), key)
+                      for key, expiration_date in items]
+        heapq.heapify(self._heap)
+
+    def clear(self):
+        del self._heap[:]
+
+    def __len__(self):
+        return len(self._heap)
+
+# ジャーナルの先頭の識別子 (レコードの形式の版を含みます)
+JOURNAL_MAGIC = "LMJ\x00\x00\x00\x00\x02"
+# ジャーナルのレコード: (有効期限, ファイルのbytes数, 相対パスの長さ) + 相対パス
+# 有効期限が負のレコードはファイルの削除を表します
+_record = struct.Struct(">dQH")
+_REMOVED = -1.0
+
+class FileExpiryIndex(object):
+    '''
+    @summary:
+        ファイル層の有効期限のインデックス
+        キャッシュファイルを書き出す度に(有効期限, bytes数, 名前空間からの相対パス)を
+        ジャーナルファイルに追記し、取り出しの前に前回からの追記分(他のプロセスの分を含む)を
+        読み込んでヒープに反映します
+        期限切れのファイルを探すためにキャッシュファイルを開く必要はありません
+        ジャーナルが無い(または古い形式の)既存の名前空間では、needs_rebuildが真になり、
+        一度だけ全ファイルのヘッダからresetで作り直す必要があります
+        プロセス間ではロックファイルのflockで、追記(共有ロック)と
+        作り直し、切り詰め(排他ロック)が重ならないようにします
+    '''
+    # ジャーナルに残す古いレコードの許容数
+    _slack = 4096
+    # 追記でジャーナルがこのサイズ(bytes)を超えた場合に、作り直すかを判定します
+    _compact_size = 256 * 1024
+    # 追記分を読み込む単位(bytes)
+    _chunk_size = 1024 * 1024
+
+    def __init__(self, cache_dir):
+        '''
+        @param cache_dir: str: 名前空間のディレクトリ
+        '''
+        self.path = os.path.join(cache_dir, EXPIRY_JOURNAL)
+        # 作り直しで置き換わらないロック用のファイル
+        self.lock_path = self.path + "-lock"
+        self.needs_rebuild = not self._check_format()
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._index = ExpirationIndex()
+        self._records = 0
+        self._offset = 0
+        self._file = None
+        self._inode = None
+        self._loaded = False
+        self._check_size = self._compact_size
+        # このインスタンスが追記したレコードの終端の位置
+        self._own = set()
+        # on_record(relpath, expiration_date, size, known): 他のインスタンスやプロセスが追記した
+        # レコードを読み込んだ時に呼ばれる関数 (削除のレコードではexpiration_dateがNone、
+        # knownはレコードの前からインデックスにあった相対パスの場合に真)
+        self.on_record = None
+
+    def _check_format(self):
+        '''
+        @summary:
+            ジャーナルが現在の形式であれば真を返します
+            古い形式のジャーナルは読み込めないため削除します
+        '''
+        try:
+            with open(self.path, 'rb') as f:
+                magic = f.read(len(JOURNAL_MAGIC))
+        except IOError:
+            return False
+        if magic == JOURNAL_MAGIC:
+            return True
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        return False
+
+    def add(self, relpath, expiration_date, size=0):
+        '''
+        @summary:
+            相対パスと有効期限、ファイルのbytes数をジャーナルに追記します
+        '''
+        if isinstance(relpath, unicode):
+            relpath = relpath.encode('utf8')
+        self._append(_record.pack(expiration_date, size, len(relpath)) + relpath)
+
+    def remove(self, relpath):
+        '''
+        @summary:
+            ファイルの削除をジャーナルに追記し、インデックスから取り除きます
+            他のプロセスはこのレコードを読み込んで、使用量からファイルを除きます
+        '''
+        if isinstance(relpath, unicode):
+            relpath = relpath.encode('utf8')
+        with self._lock:
+            self._append(_record.pack(_REMOVED, 0, len(relpath)) + relpath)
+            self._entries.pop(relpath, None)
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        '''
+        @summary:
+            ロックファイルにflockを取ります
+            同じプロセスでも開く度に別のロックになるため、入れ子にしてはいけません
+        '''
+        f = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            # 閉じるとロックも解放されます
+            f.close()
+
+    def _reload(self):
+        '''
+        @summary:
+            ロックを取った状態で呼び、ロックを待つ間に作り直されたジャーナルを読み込みます
+        '''
+        if self._check_replaced():
+            self._loaded = True
+            self._sync()
+
+    def _append(self, record):
+        with self._lock:
+            self._check_replaced()
+            self._load()
+            with self._locked():
+                self._reload()
+                if self._file is None:
+                    self._file = self._open()
+                    self._inode = os.fstat(self._file.fileno()).st_ino
+                # 1回のwriteで追記するため、他のプロセスの追記と混ざりません
+                self._file.write(record)
+                self._file.flush()
+                end = self._file.tell()
+                if self.on_record is not None:
+                    self._own.add(end)
+            if end > self._check_size:
+                self._compact()
+
+    def _compact(self):
+        '''
+        @summary:
+            排他ロックを取って追記分を読み込み、古いレコードが多すぎる場合は
+            ジャーナルを作り直します
+            次の判定はジャーナルが現在の2倍のサイズになった時点で行います
+        '''
+        self._check_replaced()
+        self._load()
+        with self._locked(True):
+            self._reload()
+            self._sync()
+            if self._records > 2 * len(self._entries) + self._slack:
+                self._rewrite(self.items())
+        self._check_size = max(2 * self._offset, self._compact_size)
+
+    def _open(self):
+        '''
+        @summary:
+            追記用にジャーナルを開きます
+            無い場合は識別子のみの一時ファイルをリンクして作成するため、
+            他のプロセスが識別子の前に追記することはありません
+        '''
+        if not os.path.exists(self.path):
+            tmp_path = "%s-%d-%d" % (self.path, os.getpid(), threading.current_thread().ident)
+            with open(tmp_path, 'wb') as f:
+                f.write(JOURNAL_MAGIC)
+            try:
+                os.link(tmp_path, self.path)
+            except OSError:
+                # 他のプロセスが作成済み
+                pass
+            finally:
+                os.remove(tmp_path)
+        return open(self.path, 'ab')
+
+    def _check_replaced(self):
+        '''
+        @summary:
+            他のインスタンスやプロセスがジャーナルを作り直した場合、読み込み直します
+        @return: bool: 読み込み直す状態にした場合は真
+        '''
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            inode = None
+        if inode == self._inode:
+            return False
+        self.close()
+        self._inode = inode
+        self._entries = {}
+        self._index.clear()
+        self._records = 0
+        self._offset = 0
+        self._own.clear()
+        self._loaded = False
+        self._check_size = self._compact_size
+        return True
+
+    def sync(self):
+        '''
+        @summary:
+            他のインスタンスやプロセスが追記したレコードを読み込みます
+        '''
+        with self._lock:
+            self._check_replaced()
+            self._load()
+            self._sync()
+
+    def _load(self):
+        '''
+        @summary:
+            初回のみジャーナル全体を読み込み、途中で途切れたレコードを切り詰めます
+            切り詰めは他のプロセスの追記と重ならないよう排他ロックを取って行います
+        '''
+        if self._loaded:
+            return
+        self._loaded = True
+        with self._locked(True):
+            self._sync()
+            if not self._offset:
+                # 識別子を読み込めないジャーナルは切り詰めません
+                return
+            try:
+                if os.path.getsize(self.path) > self._offset:
+                    with open(self.path, 'r+b') as f:
+                        f.truncate(self._offset)
+            except OSError:
+                pass
+
+    def _sync(self):
+        '''
+        @summary:
+            前回の読み込み以降に追記されたレコードをヒープに反映します
+        '''
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            return
+        with f:
+            if self._inode is None:
+                self._inode = os.fstat(f.fileno()).st_ino
+            if not self._offset:
+                if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+                    return
+                self._offset = len(JOURNAL_MAGIC)
+            f.seek(self._offset)
+            # 途中で途切れたレコードは次の単位と合わせて読み込みます
+            rest = ""
+            while True:
+                chunk = f.read(self._chunk_size)
+                if not chunk:
+                    break
+                data = rest + chunk
+                rest = data[self._apply(data):]
+
+    def _apply(self, data):
+        '''
+        @summary:
+            self._offsetから始まるdataに含まれるレコードをヒープに反映します
+        @return: int: 反映したbytes数 (末尾の途切れたレコードは含みません)
+        '''
+        pos = 0
+        size = _record.size
+        on_record = self.on_record
+        entries = self._entries
+        while pos + size <= len(data):
+            expiration_date, file_size, length = _record.unpack_from(data, pos)
+            if pos + size + length > len(data):
+                break
+            relpath = data[pos + size:pos + size + length]
+            pos += size + length
+            self._records += 1
+            known = relpath in entries
+            if expiration_date < 0:
+                entries.pop(relpath, None)
+                expiration_date = None
+            else:
+                entries[relpath] = (expiration_date, file_size)
+                self._index.push(relpath, expiration_date)
+            if on_record is not None:
+                end = self._offset + pos
+                if end in self._own:
+                    self._own.discard(end)
+                else:
+                    on_record(relpath, expiration_date, file_size, known)
+        self._offset += pos
+        return pos
+
+    def pop_expired(self, date, max_items=None):
+        '''
+        @summary:
+            有効期限がdate以前のファイルの(相対パス, 有効期限)のリストを返し、
+            インデックスから削除します
+            その後に上書きされたファイルの古いレコードは含みません
+        '''
+        with self._lock:
+            self._check_replaced()
+            self._load()
+            self._sync()
+            expired = []
+            entries = self._entries
+            for relpath, expiration_date in self._index.pop_expired(date, max_items):
+                entry = entries.get(relpath)
+                if entry is None or entry[0] != expiration_date:
+                    continue
+                del entries[relpath]
+                expired.append((relpath, expiration_date))
+            if self._records > 2 * len(entries) + self._slack:
+                self._compact()
+        return expired
+
+    def items(self):
+        '''
+        @summary:
+            インデックスに登録されている(相対パス, 有効期限, bytes数)のリストを返します
+        '''
+        with self._lock:
+            return [(relpath, expiration_date, size)
+                    for relpath, (expiration_date, size) in self._entries.iteritems()]
+
+    def reset(self, items):
+        '''
+        @summary:
+            (相対パス, 有効期限, bytes数)の列でジャーナルとヒープを作り直します
+        '''
+        with self._lock:
+            with self._locked(True):
+                self._rewrite(items)
+            self.needs_rebuild = False
+
+    def _rewrite(self, items):
+        '''
+        @summary:
+            現在の内容のみを持つジャーナルを一時ファイルに書き出して置き換えます
+        '''
+        entries = {}
+        for item in items:
+            relpath, expiration_date = item[:2]
+            if isinstance(relpath, unicode):
+                relpath = relpath.encode('utf8')
+            entries[relpath] = (expiration_date, item[2] if len(item) > 2 else 0)
+        tmp_path = "%s-%d-%d" % (self.path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'wb') as f:
+            f.write(JOURNAL_MAGIC)
+            f.write("".join(_record.pack(expiration_date, size, len(relpath)) + relpath
+                            for relpath, (expiration_date, size) in entries.iteritems()))
+            offset = f.tell()
+        os.rename(tmp_path, self.path)
+        self.close()
+        self._own.clear()
+        self._inode = os.stat(self.path).st_ino
+        self._entries = entries
+        self._index.rebuild((relpath, expiration_date)
+                            for relpath, (expiration_date, _) in entries.iteritems())
+        self._records = len(entries)
+        self._offset = offset
+        self._loaded = True
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import time
+import threading
+from Lamia.util import current_time
+'''
+@summary:
+    期限切れのキャッシュをバックグラウンドで少しずつ削除するモジュール
+'''
+
+__all__ = ("Janitor",)
+
+class Janitor(object):
+    '''
+    @summary:
+        期限切れのキャッシュを少しずつ削除するバックグラウンドのスレッド
+        interval秒毎に1回の処理(pass)を行い、各passは以下の順に
+        time_budget秒、またはio_budget件のファイル操作で打ち切ります
+            1. メモリ層: 有効期限のインデックスから最大memory_budget件を削除
+            2. ファイル層: 有効期限のインデックスから期限切れのファイルを削除
+            3. 巡回: ディレクトリを少しずつ読み進め、インデックスに無いファイル
+               (他のプロセスが書き出したもの、不正なスタイルのもの)を確認します
+               巡回は途中の位置を次のpassに引き継ぎ、一巡したらsweep_interval秒休みます
+        各passの集計値はlast_pass、累計はtotalsで参照できます
+    '''
+    def __init__(self, cache, interval=1.0, time_budget=0.05, io_budget=256,
+                 memory_budget=10000, sweep=True, sweep_interval=3600.0,
+                 on_pass=None):
+        '''
+        @param cache: Lamia.cache.Cache: 対象のキャッシュ
+        @param interval: float: passの間隔(秒)
+        @param time_budget: float: 1回のpassの処理時間の上限(秒)
+        @param io_budget: int: 1回のpassで確認するファイル数の上限
+        @param memory_budget: int: 1回のpassで削除するメモリ上のエントリ数の上限
+        @param sweep: bool: ディレクトリの巡回を行うか
+        @param sweep_interval: float: 巡回が一巡してから次の巡回を始めるまでの間隔(秒)
+        @param on_pass: function: on_pass(metrics)各passの終了時に呼ばれる関数
+        '''
+        self.cache = cache
+        self.interval = interval
+        self.time_budget = time_budget
+        self.io_budget = io_budget
+        self.memory_budget = memory_budget
+        self.sweep = sweep
+        self.sweep_interval = sweep_interval
+        self.on_pass = on_pass
+        self.passes = 0
+        self.last_pass = None
+        self.totals = dict(scanned=0, removed=0, memory_removed=0,
+                           file_removed=0, sweeps=0, duration=0.0)
+        self._storage = None
+        self._paths = None
+        self._next_sweep = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        '''
+        @summary:
+            バックグラウンドのスレッドを起動します
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="lamia-janitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=True):
+        '''
+        @summary:
+            バックグラウンドのスレッドを停止します
+        '''
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.interval)
+            if self._stop.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception:
+                # 次のpassで再試行します
+                pass
+
+    def run_once(self, date=None):
+        '''
+        @summary:
+            1回分の削除を行い、集計値を返します
+        @return: dict: scanned: 巡回でヘッダを確認したファイル数
+                       removed: 削除した件数の合計
+                       memory_removed: メモリ層から削除した件数
+                       file_removed: ファイル層のインデックスから削除した件数
+                       sweep_removed: 巡回で削除したファイル数
+                       sweep_complete: このpassで巡回が一巡したか
+                       duration: 処理時間(秒)
+        '''
+        start = time.time()
+        deadline = start + self.time_budget
+        if date is None:
+            date = current_time()
+        cache = self.cache
+        metrics = dict(scanned=0, memory_removed=0, file_removed=0,
+                       sweep_removed=0, sweep_complete=False)
+        metrics['memory_removed'] = cache.purge_memory(date, self.memory_budget, deadline)
+        budget = self.io_budget
+        if time.time() < deadline:
+            metrics['file_removed'] = cache.purge_file(date, max_items=budget) or 0
+            budget -= metrics['file_removed']
+        if self.sweep:
+            self._sweep(date, deadline, budget, metrics)
+        metrics['removed'] = (metrics['memory_removed'] + metrics['file_removed'] +
+                              metrics['sweep_removed'])
+        metrics['duration'] = time.time() - start
+        self._record(metrics)
+        return metrics
+
+    def _sweep(self, date, deadline, budget, metrics):
+        '''
+        @summary:
+            前回の続きからディレクトリを巡回し、ファイルのヘッダを確認します
+        '''
+        storage = self.cache.storage
+        check_file = getattr(storage, 'check_file', None)
+        if check_file is None:
+            return
+        if storage is not self._storage:
+            # 名前空間が切り替わった場合は最初から巡回します
+            self._storage = storage
+            self._paths = None
+            self._next_sweep = 0.0
+        if self._paths is None:
+            if time.time() < self._next_sweep:
+                return
+            self._paths = storage.layout.iter_paths(storage.cache_dir)
+        while budget > 0 and time.time() < deadline:
+            try:
+                path = next(self._paths)
+            except StopIteration:
+                self._paths = None
+                self._next_sweep = time.time() + self.sweep_interval
+                metrics['sweep_complete'] = True
+                break
+            budget -= 1
+            metrics['scanned'] += 1
+            if check_file(path, date):
+                metrics['sweep_removed'] += 1
+
+    def _record(self, metrics):
+        self.passes += 1
+        self.last_pass = metrics
+        totals = self.totals
+        for name in ('scanned', 'removed', 'memory_removed', 'file_removed', 'duration'):
+            totals[name] += metrics[name]
+        if metrics['sweep_complete']:
+            totals['sweeps'] += 1
+        if self.on_pass is not None:
+            self.on_pass(metrics)
+
+    def stats(self):
+        '''
+        @summary:
+            pass数、直前のpassの集計値、累計をdictで返します
+        '''
+        return dict(passes=self.passes, last_pass=self.last_pass,
+                    totals=dict(self.totals))
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import os
+import sys
+import errno
+import urllib
+from hashlib import sha1
+from Lamia.util import build_path
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+'''
+@summary:
+    キャッシュファイルの配置方法(レイアウト)を提供するモジュール
+    flat: 名前空間のディレクトリ直下にキーをそのままファイル名として配置します
+    sharded: キーのハッシュの先頭からディレクトリを切り、
+             エンコードしたキーをファイル名として配置します
+'''
+
+__all__ = ("FlatLayout", "ShardedLayout", "make_layout", "migrate",
+           "encode_key", "decode_key", "iter_dir", "INTERNAL_PREFIX", "EXPIRY_JOURNAL")
+
+join = os.path.join
+
+# Lamiaが名前空間内に作成する管理用ファイルの接頭辞 (キャッシュファイルとして扱わない)
+INTERNAL_PREFIX = ".lamia-"
+
+# ファイル層の有効期限のジャーナル (キャッシュファイルの相対パスを記録します)
+EXPIRY_JOURNAL = INTERNAL_PREFIX + "expiry"
+
+# ファイル名の長さの上限 (多くのファイルシステムで255bytes)
+_max_name_length = 200
+
+def encode_key(key):
+    '''
+    @summary:
+        任意のキーをファイル名として安全な文字列に変換します
+        '/'や先頭の'.'を含む全ての記号をエスケープします
+        長すぎる場合は末尾をハッシュで置き換えます(この場合decode_keyできません)
+    '''
+    if isinstance(key, unicode):
+        key = key.encode('utf8')
+    name = urllib.quote(key, safe='-_')
+    if name.startswith('.'):
+        name = '%2E' + name[1:]
+    if len(name) > _max_name_length:
+        name = "%s~%s" % (name[:_max_name_length - 41], sha1(key).hexdigest())
+    return name
+
+def decode_key(name):
+    '''
+    @summary:
+        encode_keyで変換したファイル名をキーに戻します
+        ハッシュで切り詰めたファイル名の場合はNoneを返します
+    '''
+    if '~' in name:
+        return None
+    return urllib.unquote(name)
+
+def _is_cache_file(name):
+    return not name.startswith(INTERNAL_PREFIX)
+
+def iter_dir(path):
+    '''
+    @summary:
+        ディレクトリ内の(名前, パス, ディレクトリか)を列挙します
+        os.scandir(またはscandirパッケージ)が使える場合は、
+        ディレクトリ全体の名前のリストを作らずに少しずつ読み込みます
+        ディレクトリが存在しない場合は直ちにOSErrorを送出します
+    '''
+    if _scandir is not None:
+        return ((entry.name, entry.path, entry.is_dir()) for entry in _scandir(path))
+    return ((name, join(path, name), os.path.isdir(join(path, name)))
+            for name in os.listdir(path))
+
+class FlatLayout(object):
+    '''
+    @summary:
+        名前空間のディレクトリ直下にキーをそのままファイル名として配置するレイアウト
+    '''
+    name = 'flat'
+
+    def build_path(self, cache_dir, key):
+        '''
+        @summary:
+            キーに対応するファイルパスを返します
+            管理用ファイルと同じ接頭辞のキーは、管理用ファイルを上書きし、
+            期限切れの削除の対象にもならないためValueError
+        '''
+        if key.startswith(INTERNAL_PREFIX):
+            raise ValueError("Key '%s' is reserved for internal files." % key)
+        return build_path(cache_dir, key)
+
+    def ensure_dir(self, path, mode):
+        '''
+        @summary:
+            ファイルを書き出す前に親ディレクトリを用意します
+        '''
+        pass
+
+    def iter_paths(self, cache_dir):
+        '''
+        @summary:
+            名前空間内のキャッシュファイルのパスを列挙します
+        '''
+        try:
+            entries = iter_dir(cache_dir)
+        except OSError:
+            return
+        for name, path, is_dir in entries:
+            if not is_dir and _is_cache_file(name):
+                yield path
+
+    def key_from_path(self, cache_dir, path):
+        '''
+        @summary:
+            ファイルパスからキーを返します
+        '''
+        return os.path.basename(path)
+
+class ShardedLayout(object):
+    '''
+    @summary:
+        キーのSHA-1の先頭から階層ディレクトリを作成して配置するレイアウト
+        levels=2, width=2の場合、<cache_dir>/ab/cd/<encoded key>となり、
+        1ディレクトリあたりのファイル数を1/65536に抑えます
+    '''
+    name = 'sharded'
+
+    def __init__(self, levels=2, width=2):
+        '''
+        @param levels: int: ディレクトリの階層数
+        @param width: int: 1階層あたりのハッシュの文字数
+        '''
+        if levels < 1 or width < 1 or levels * width > 40:
+            raise ValueError("Invalid sharding: levels=%r, width=%r" % (levels, width))
+        self.levels = levels
+        self.width = width
+        # 作成済みのディレクトリ (書き込み毎のstatを避けるため)
+        self._known_dirs = set()
+
+    def _shards(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf8')
+        digest = sha1(key).hexdigest()
+        w = self.width
+        return [digest[i * w:(i + 1) * w] for i in xrange(self.levels)]
+
+    def build_path(self, cache_dir, key):
+        return join(cache_dir, *(self._shards(key) + [encode_key(key)]))
+
+    def ensure_dir(self, path, mode):
+        dirname = os.path.dirname(path)
+        if dirname in self._known_dirs:
+            return
+        try:
+            os.makedirs(dirname, mode)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+        self._known_dirs.add(dirname)
+
+    def _iter_dirs(self, cache_dir, level):
+        if level == self.levels:
+            yield cache_dir
+            return
+        try:
+            entries = iter_dir(cache_dir)
+        except OSError:
+            return
+        for name, path, is_dir in entries:
+            if len(name) != self.width or not _is_cache_file(name):
+                continue
+            if is_dir:
+                for sub in self._iter_dirs(path, level + 1):
+                    yield sub
+
+    def iter_paths(self, cache_dir):
+        for dirname in self._iter_dirs(cache_dir, 0):
+            try:
+                entries = iter_dir(dirname)
+            except OSError:
+                continue
+            for name, path, is_dir in entries:
+                if not is_dir and _is_cache_file(name):
+                    yield path
+
+    def key_from_path(self, cache_dir, path):
+        return decode_key(os.path.basename(path))
+
+    def remove_empty_dirs(self, cache_dir):
+        '''
+        @summary:
+            空になったシャードディレクトリを削除します
+        '''
+        for dirname in list(self._iter_dirs(cache_dir, 0)):
+            while dirname != cache_dir:
+                try:
+                    os.rmdir(dirname)
+                except OSError:
+                    break
+                self._known_dirs.discard(dirname)
+                dirname = os.path.dirname(dirname)
+
+def make_layout(layout):
+    '''
+    @summary:
+        レイアウト名(またはインスタンス)からレイアウトを返します
+    @param layout: str: 'flat'または'sharded'
+    '''
+    if not isinstance(layout, basestring):
+        return layout
+    if layout == 'flat':
+        return FlatLayout()
+    if layout == 'sharded':
+        return ShardedLayout()
+    raise ValueError("Unknown layout '%s'." % layout)
+
+def migrate(cache_dir, src, dst, mode=0700):
+    '''
+    @summary:
+        名前空間のキャッシュファイルをsrcのレイアウトからdstのレイアウトへ移動します
+        同一ファイルシステム内のrenameのみで行うため、ファイルの内容は読み書きしません
+    @return: (int, int): (移動した件数, キーを復元できずに残した件数)
+    '''
+    src, dst = make_layout(src), make_layout(dst)
+    moved = skipped = 0
+    for path in list(src.iter_paths(cache_dir)):
+        key = src.key_from_path(cache_dir, path)
+        if key is None:
+            skipped += 1
+            continue
+        new_path = dst.build_path(cache_dir, key)
+        if new_path == path:
+            continue
+        dst.ensure_dir(new_path, mode)
+        os.rename(path, new_path)
+        moved += 1
+    if isinstance(src, ShardedLayout):
+        src.remove_empty_dirs(cache_dir)
+    if moved:
+        # 有効期限のジャーナルは移動前のパスを指すため、次回のpurgeで作り直させます
+        try:
+            os.remove(join(cache_dir, EXPIRY_JOURNAL))
+        except OSError:
+            pass
+    return moved, skipped
+
+def main(argv=None):
+    '''
+    @summary:
+        python -m Lamia.layout <cache_dir> [flat|sharded] [flat|sharded]
+        既存の名前空間のレイアウトを変換します
+    '''
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 3:
+        sys.stderr.write("usage: python -m Lamia.layout <cache_dir> <from> <to>\n")
+        return 2
+    cache_dir, src, dst = argv
+    moved, skipped = migrate(cache_dir, src, dst)
+    sys.stdout.write("moved: %d, skipped: %d\n" % (moved, skipped))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import sys
+import thread
+import threading
+'''
+@summary:
+    スレッド間の排他制御をサポートするモジュール
+'''
+
+__all__ = ("NullLock", "StripedLock", "SingleFlight")
+
+class NullLock(object):
+    '''
+    @summary:
+        何もしないロック (スレッドセーフでないモードで使用します)
+    '''
+    def acquire(self, blocking=True):
+        return True
+
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_lock = NullLock()
+
+class StripedLock(object):
+    '''
+    @summary:
+        キー空間をstripes個に分割したロック
+        異なるストライプのキー同士は互いにブロックしません
+    '''
+    def __init__(self, stripes=64):
+        '''
+        @param stripes: int: ロックの数(2の累乗に切り上げます)
+        '''
+        n = 1
+        while n < stripes:
+            n <<= 1
+        self._mask = n - 1
+        self._locks = [threading.RLock() for _ in xrange(n)]
+
+    def __call__(self, key):
+        '''
+        @summary:
+            キーに対応するロックを返します
+        '''
+        return self._locks[hash(key) & self._mask]
+
+    def __len__(self):
+        return len(self._locks)
+
+class _Call(object):
+    '''
+    @summary:
+        SingleFlightで実行中の呼び出し
+    '''
+    __slots__ = ('event', 'result', 'exc_info', 'owner')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+        self.owner = thread.get_ident()
+
+class SingleFlight(object):
+    '''
+    @summary:
+        同じキーに対する同時呼び出しを1回の実行にまとめます
+        最初の呼び出し元のみが関数を実行し、他の呼び出し元はその結果(または例外)を受け取ります
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kw):
+        '''
+        @summary:
+            キーに対して実行中の呼び出しがあればその結果を待ち、
+            無ければfunc(*args, **kw)を実行します
+        '''
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if call.owner == thread.get_ident():
+                # 同じスレッドからの再帰呼び出しは待たずに実行します
+                return func(*args, **kw)
+            call.event.wait()
+            if call.exc_info is not None:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result
+        try:
+            call.result = func(*args, **kw)
+            return call.result
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def __len__(self):
+        return len(self._calls)
+
+def null_lock(key=None):
+    '''
+    @summary:
+        常に何もしないロックを返します (StripedLockの代わり)
+    '''
+    return _null_lock
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import os
+import re
+import mmap
+import errno
+import fcntl
+import struct
+import zlib
+import tempfile
+import threading
+from Lamia.util import current_time
+from Lamia.layout import INTERNAL_PREFIX
+from Lamia.expiry import ExpirationIndex
+from Lamia.serialize import encode, decode, decode_mapped, verify, open_stream, \
+                            write_chunks, pack_raw_header, STREAM_CHUNK, \
+                            DumpError, LoadError
+'''
+@summary:
+    追記型のセグメントファイルにキャッシュを格納するファイル層の格納方式
+    全てのレコードはアクティブなセグメントの末尾に追記され、
+    メモリ上のインデックス(key => セグメント, オフセット, 長さ, 有効期限)から読み出します
+    上書きや期限切れで不要になったレコードはコンパクションで回収します
+    (purgeの後、またはcompact_intervalの間隔で、有効なレコードの割合が
+    compact_ratio未満になったセグメントを回収します)
+    起動時はセグメントを古い順に再生してインデックスを復元します
+    インデックスはプロセス毎に持つため、名前空間のディレクトリは1つのLogStorageのみが
+    開けます(ロックファイルのflockで他のプロセスからの同時利用を拒否します)
+
+    format for record:
+        <header><key><data>
+        header: magic(4s), kind(B), key length(H), data length(I), crc32 of key(I)
+        data: Lamia.serializeの形式(有効期限、変換方式、ペイロードのCRCを含む)
+'''
+
+__all__ = ("LogStorage",)
+
+_segment_prefix = INTERNAL_PREFIX + "segment-"
+_segment_pattern = re.compile(r"^%s(\d{8})$" % re.escape(_segment_prefix))
+_owner_name = INTERNAL_PREFIX + "log-lock"
+_stream_prefix = INTERNAL_PREFIX + "stream-"
+
+_RECORD_MAGIC = "LMLG"
+_PUT = 0
+_DELETE = 1
+_header = struct.Struct(">4sBHII")
+# レコードのデータの長さの上限 (ヘッダのdata lengthはI)
+_max_record = 0xffffffff
+# セグメント毎に保持するmmapの数の上限 (超えた場合はファイル全体をmmapし直します)
+_max_maps = 16
+
+class _Entry(object):
+    '''
+    @summary:
+        インデックスの要素: キーの最新のレコードの位置
+    '''
+    __slots__ = ('segment', 'offset', 'length', 'expiration_date', 'size')
+
+    def __init__(self, segment, offset, length, expiration_date, size):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.expiration_date = expiration_date
+        self.size = size
+
+class _Segment(object):
+    '''
+    @summary:
+        セグメントファイルの管理情報
+    '''
+    __slots__ = ('id', 'path', 'size', 'live', 'keys', 'dead', 'reader', 'maps')
+
+    def __init__(self, id, path):
+        self.id = id
+        self.path = path
+        # ファイルサイズ、有効なレコードの合計サイズ
+        self.size = 0
+        self.live = 0
+        # このセグメントに最新のレコードがあるキー
+        self.keys = set()
+        # このセグメントで削除、または期限切れになったキー
+        # (より古いセグメントのレコードが復活しないよう、回収時に削除レコードを引き継ぎます)
+        self.dead = set()
+        self.reader = None
+        # (先頭のオフセット, mmap)のリスト
+        self.maps = []
+
+    def close(self):
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        # 読み込み側がビューを保持している可能性があるため、mmapは明示的に閉じずに
+        # 参照を外すだけにします (ビューが解放された時点でunmapされます)
+        self.maps = []
+
+    def mapped(self, offset, end):
+        '''
+        @summary:
+            offsetからendまでを含む(mmap, mmapの先頭のオフセット)を返します
+            追記で伸びたセグメントは、offsetを含むページ以降の末尾のみを新たにmmapします
+            mmapが_max_maps個になった場合はファイル全体をmmapし直して1つにまとめます
+        '''
+        for start, mm in reversed(self.maps):
+            if start <= offset and end <= start + len(mm):
+                return mm, start
+        with open(self.path, 'rb') as f:
+            if len(self.maps) >= _max_maps:
+                self.maps = []
+                start = 0
+            else:
+                start = offset - offset % mmap.ALLOCATIONGRANULARITY
+            size = os.fstat(f.fileno()).st_size
+            mm = mmap.mmap(f.fileno(), size - start, access=mmap.ACCESS_READ, offset=start)
+        self.maps.append((start, mm))
+        return mm, start
+
+def _pack(kind, key, record, length=None):
+    if length is None:
+        length = len(record)
+    return _header.pack(_RECORD_MAGIC, kind, len(key), length,
+                        zlib.crc32(key) & 0xffffffff) + key + record
+
+class LogStorage(object):
+    '''
+    @summary:
+        追記型のセグメントファイルによるファイル層の格納方式
+    '''
+    name = 'log'
+    # Lamia.stats.NamespaceStats: 指定した場合は読み書きしたbytes数を記録します
+    stats = None
+    # 有効期限のインデックスに残せる古い要素の数
+    _expiry_slack = 1024
+
+    def __init__(self, cache_dir, mode=0700, codec='pickle', compressor=None,
+                 segment_size=64 * 1024 * 1024, compact_ratio=0.5,
+                 compact_interval=None, fsync=False):
+        '''
+        @param cache_dir: str: 名前空間のディレクトリ
+        @param codec: str: 値の変換方式 'raw', 'pickle', 'marshal', 'json'
+        @param compressor: Lamia.compress.Compressor: 値の圧縮方式
+        @param segment_size: int: セグメントを切り替えるサイズ
+        @param compact_ratio: float: 有効なレコードの割合がこれ未満のセグメントを回収します
+        @param compact_interval: float: 指定した場合はその間隔でバックグラウンドでコンパクションします
+        @param fsync: bool: 書き込み毎にfsyncする場合は真
+        '''
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.codec = codec
+        self.compressor = compressor
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._index = {}
+        self._segments = {}
+        self._expiry = ExpirationIndex()
+        self._expiry_limit = self._expiry_slack
+        self._writer = None
+        self._active = None
+        self._owner = self._acquire_owner()
+        self._recover()
+        self._compactor = None
+        if compact_interval is not None:
+            self._start_compactor(compact_interval)
+
+    # --- segment files ---
+    def _acquire_owner(self):
+        '''
+        @summary:
+            名前空間のディレクトリのロックファイルに排他ロックを取ります
+            既に他のLogStorageが開いている場合はValueError
+        '''
+        f = open(os.path.join(self.cache_dir, _owner_name), 'a')
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, err:
+            f.close()
+            if err.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            raise ValueError("'%s' is already opened by another LogStorage." % self.cache_dir)
+        return f
+
+    def _segment_path(self, segment_id):
+        return os.path.join(self.cache_dir, "%s%08d" % (_segment_prefix, segment_id))
+
+    def _list_segments(self):
+        ids = []
+        for name in os.listdir(self.cache_dir):
+            m = _segment_pattern.match(name)
+            if m:
+                ids.append(int(m.group(1)))
+        return sorted(ids)
+
+    def _open_segment(self, segment_id):
+        '''
+        @summary:
+            アクティブなセグメントを切り替えます(存在しない場合は作成します)
+        '''
+        if self._writer is not None:
+            self._writer.close()
+        segment = self._segments.get(segment_id)
+        if segment is None:
+            segment = _Segment(segment_id, self._segment_path(segment_id))
+        self._writer = open(segment.path, 'ab')
+        segment.size = self._writer.tell()
+        self._segments[segment_id] = segment
+        self._active = segment
+
+    def _reader(self, segment):
+        if segment.reader is None:
+            segment.reader = open(segment.path, 'rb')
+        return segment.reader
+
+    # --- recovery ---
+    def _recover(self):
+        '''
+        @summary:
+            セグメントを古い順に再生してインデックスを復元します
+            末尾の書きかけのレコードは切り捨てます
+        '''
+        ids = self._list_segments()
+        for segment_id in ids:
+            segment = _Segment(segment_id, self._segment_path(segment_id))
+            self._segments[segment_id] = segment
+            valid = self._replay(segment)
+            if valid < segment.size:
+                # 書き込み途中でクラッシュしたレコード
+                with open(segment.path, 'r+b') as f:
+                    f.truncate(valid)
+                segment.size = valid
+        self._open_segment(ids[-1] if ids else 1)
+
+    def _replay(self, segment):
+        '''
+        @summary:
+            セグメントのレコードを読み込んでインデックスに反映します
+        @return: int: 正常に読み込めたレコードの末尾のオフセット
+        '''
+        now = current_time()
+        offset = 0
+        with open(segment.path, 'rb') as f:
+            segment.size = os.fstat(f.fileno()).st_size
+            while True:
+                header = f.read(_header.size)
+                if len(header) < _header.size:
+                    break
+                magic, kind, klen, rlen, crc = _header.unpack(header)
+                if magic != _RECORD_MAGIC:
+                    break
+                key = f.read(klen)
+                if len(key) < klen or zlib.crc32(key) & 0xffffffff != crc:
+                    break
+                expiration_date = 0.0
+                if kind == _PUT:
+                    try:
+                        expiration_date = verify(f.read(rlen))
+                    except LoadError:
+                        break
+                size = _header.size + klen + rlen
+                if kind == _PUT and expiration_date > now:
+                    self._set_entry(key, _Entry(segment.id, offset + _header.size + klen,
+                                                rlen, expiration_date, size))
+                else:
+                    self._drop_entry(key)
+                    segment.dead.add(key)
+                offset += size
+        return offset
+
+    # --- index ---
+    def _set_entry(self, key, entry):
+        self._drop_entry(key)
+        self._index[key] = entry
+        segment = self._segments[entry.segment]
+        segment.live += entry.size
+        segment.keys.add(key)
+        self._expiry.push(key, entry.expiration_date)
+        if len(self._expiry) > self._expiry_limit:
+            # 上書き、削除されたキーの古い要素を取り除きます
+            self._expiry.rebuild((k, e.expiration_date) for k, e in self._index.iteritems())
+            self._expiry_limit = 2 * len(self._expiry) + self._expiry_slack
+
+    def _drop_entry(self, key):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            segment = self._segments[entry.segment]
+            segment.live -= entry.size
+            segment.keys.discard(key)
+        return entry
+
+    def _append(self, kind, key, data="", tail=None, tail_length=0):
+        '''
+        @summary:
+            アクティブなセグメントにレコードを追記し、(オフセット, サイズ)を返します
+        @param tail: file: 指定した場合はdataに続けてファイルの内容をtail_length分、
+                           断片毎に書き出します
+        '''
+        if self._active.size >= self.segment_size:
+            self._open_segment(self._active.id + 1)
+        record = _pack(kind, key, data, len(data) + tail_length)
+        offset = self._active.size
+        self._writer.write(record)
+        if tail is not None:
+            tail.seek(0)
+            for chunk in iter(lambda: tail.read(STREAM_CHUNK), ""):
+                self._writer.write(chunk)
+            record_size = len(record) + tail_length
+        else:
+            record_size = len(record)
+        self._writer.flush()
+        if self.fsync:
+            os.fsync(self._writer.fileno())
+        self._active.size += record_size
+        return offset, record_size
+
+    def _encode_key(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf8')
+        return key
+
+    # --- storage interface ---
+    def load(self, key, mmap_threshold=None):
+        '''
+        @summary:
+            キーに対応するデータを読み込みます
+            mmap_thresholdを指定した場合、それ以上のサイズの'raw'の値は
+            mmapしたセグメントへのビューとして返します
+            ロックはレコードの位置とmmapの取得のみに使い、読み込みはロックの外で行います
+            (コンパクションでファイルが削除されても、取得済みのmmapは読めます)
+        '''
+        key = self._encode_key(key)
+        with self._lock:
+            entry = self._index[key]
+            mm, start = self._segments[entry.segment].mapped(entry.offset,
+                                                             entry.offset + entry.length)
+            if self.stats is not None:
+                self.stats.record_read(entry.length)
+        offset = entry.offset - start
+        if mmap_threshold is not None and entry.length >= mmap_threshold:
+            return decode_mapped(mm, offset, entry.length, mmap_threshold, self.compressor)
+        return decode(mm[offset:offset + entry.length], self.compressor)
+
+    def dump(self, key, data):
+        '''
+        @summary:
+            キーとデータをレコードとして追記します
+        '''
+        key = self._encode_key(key)
+        record = encode(data, self.codec, self.compressor)
+        if self.stats is not None:
+            self.stats.record_write(len(record))
+        self._put(key, record, data.expiration_date)
+
+    def _put(self, key, record, expiration_date):
+        with self._lock:
+            offset, size = self._append(_PUT, key, record)
+            self._set_entry(key, _Entry(self._active.id, offset + _header.size + len(key),
+                                        len(record), expiration_date, size))
+
+    def dump_stream(self, key, chunks, expiration_date):
+        '''
+        @summary:
+            strの断片を'raw'の値のレコードとして追記します
+            断片は一時ファイルに書き出して長さとCRCを求めてから、ロックを取って
+            セグメントに断片毎に書き写すため、使用するメモリは値のサイズによらず一定です
+        '''
+        key = self._encode_key(key)
+        with tempfile.TemporaryFile(prefix=_stream_prefix, dir=self.cache_dir) as f:
+            length, crc = write_chunks(f, chunks)
+            header = pack_raw_header(expiration_date, length, crc)
+            if len(header) + length > _max_record:
+                raise DumpError("Stream is too large (over %d bytes)." % _max_record)
+            if self.stats is not None:
+                self.stats.record_write(len(header) + length)
+            with self._lock:
+                offset, size = self._append(_PUT, key, header, f, length)
+                self._set_entry(key, _Entry(self._active.id, offset + _header.size + len(key),
+                                            len(header) + length, expiration_date, size))
+
+    def open_stream(self, key):
+        '''
+        @summary:
+            キーに対応するレコードの値を読み込むStreamReaderを返します
+            セグメントのファイルを開いたまま読むため、コンパクションで削除されても読めます
+        '''
+        key = self._encode_key(key)
+        with self._lock:
+            entry = self._index[key]
+            reader = open_stream(self._segments[entry.segment].path, self.compressor,
+                                 entry.offset, entry.length)
+        if self.stats is not None:
+            self.stats.record_read(reader.length)
+        return reader
+
+    def delete(self, key):
+        '''
+        @summary:
+            キーの削除レコードを追記します
+        '''
+        key = self._encode_key(key)
+        with self._lock:
+            if self._drop_entry(key) is None:
+                raise KeyError(key)
+            self._append(_DELETE, key)
+            self._active.dead.add(key)
+
+    def purge(self, date, max_items=None):
+        '''
+        @summary:
+            期限切れのキーを有効期限の早い順にインデックスから削除し、削除レコードを追記します
+            その後、有効なレコードの割合がcompact_ratio未満になったセグメントを回収します
+        @param max_items: int: 指定した場合は有効期限のインデックスからその件数を
+                               取り出した時点で中断します(上書き済みの要素を含みます)
+        @return: int: 削除した件数
+        '''
+        with self._lock:
+            removed = self._purge(date, max_items)
+            self._compact_segments()
+        return removed
+
+    def _purge(self, date, max_items=None):
+        removed = 0
+        for key, expiration_date in self._expiry.pop_expired(date, max_items):
+            entry = self._index.get(key)
+            if entry is None or entry.expiration_date != expiration_date:
+                # 削除、上書き済み
+                continue
+            self._drop_entry(key)
+            # 再生時に古いレコードが復活しないよう削除レコードを追記します
+            self._append(_DELETE, key)
+            self._active.dead.add(key)
+            removed += 1
+        return removed
+
+    def clear(self):
+        '''
+        @summary:
+            全てのセグメントを削除します
+        '''
+        with self._lock:
+            next_id = self._active.id + 1
+            self._writer.close()
+            self._writer = None
+            for segment in self._segments.itervalues():
+                segment.close()
+                os.remove(segment.path)
+            self._segments.clear()
+            self._index.clear()
+            self._expiry.clear()
+            self._expiry_limit = self._expiry_slack
+            self._open_segment(next_id)
+
+    def compact(self):
+        '''
+        @summary:
+            有効なレコードの割合がcompact_ratio未満のセグメントを回収します
+            有効なレコードはアクティブなセグメントに書き直し、元のファイルを削除します
+        @return: int: 回収したセグメント数
+        '''
+        with self._lock:
+            self._purge(current_time())
+            return self._compact_segments()
+
+    def _compact_segments(self):
+        oldest = min(self._segments)
+        targets = [segment for segment in sorted(self._segments.itervalues(),
+                                                 key=lambda s: s.id)
+                   if segment is not self._active and
+                   segment.live < segment.size * self.compact_ratio]
+        for segment in targets:
+            self._compact_segment(segment, segment.id == oldest)
+            oldest = min(self._segments)
+        return len(targets)
+
+    def _compact_segment(self, segment, is_oldest):
+        f = self._reader(segment)
+        for key in list(segment.keys):
+            entry = self._index[key]
+            f.seek(entry.offset)
+            self._put(key, f.read(entry.length), entry.expiration_date)
+        if not is_oldest:
+            # より古いセグメントのレコードが復活しないよう削除レコードを引き継ぐ
+            for key in segment.dead:
+                if key not in self._index:
+                    self._append(_DELETE, key)
+                    self._active.dead.add(key)
+        segment.close()
+        os.remove(segment.path)
+        del self._segments[segment.id]
+
+    def _start_compactor(self, interval):
+        stopped = threading.Event()
+        def run():
+            while not stopped.wait(interval):
+                self.compact()
+        thread = threading.Thread(target=run, name="lamia-compactor")
+        thread.daemon = True
+        thread.start()
+        self._compactor = stopped
+
+    def close(self):
+        '''
+        @summary:
+            バックグラウンドのコンパクションを止め、ファイルを閉じます
+        '''
+        if self._compactor is not None:
+            self._compactor.set()
+            self._compactor = None
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for segment in self._segments.itervalues():
+                segment.close()
+            if self._owner is not None:
+                self._owner.close()
+                self._owner = None
+
+    def keys(self):
+        with self._lock:
+            return list(self._index)
+
+    def __contains__(self, key):
+        return self._encode_key(key) in self._index
+
+    def __len__(self):
+        return len(self._index)
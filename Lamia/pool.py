@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import sys
+import time
+import atexit
+import weakref
+import threading
+import Queue
+'''
+@summary:
+    バックグラウンドで処理を実行するワーカースレッドのプールを提供するモジュール
+'''
+
+__all__ = ("Future", "ThreadPool", "TimeoutError")
+
+# ワーカースレッドが起動しているプール
+_live_pools = weakref.WeakSet()
+# インタプリタの終了時にワーカースレッドの終了を待つ時間の上限(秒)
+_exit_timeout = 1.0
+
+def _shutdown_pools():
+    '''
+    @summary:
+        インタプリタの終了時に、モジュールが破棄される前にワーカースレッドを終了させます
+        待ち行列に残った処理は実行せずに破棄し、実行中の処理は全体で_exit_timeout秒まで待ちます
+    '''
+    deadline = time.time() + _exit_timeout
+    for pool in list(_live_pools):
+        pool.shutdown(cancel=True, timeout=max(0.0, deadline - time.time()))
+atexit.register(_shutdown_pools)
+
+class TimeoutError(Exception):
+    '''
+    @summary:
+        Future.resultの待ち時間を過ぎた場合に発生する例外クラスです
+    '''
+    pass
+
+class Future(object):
+    '''
+    @summary:
+        ワーカースレッドで実行される処理の結果を保持するクラス
+    '''
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def set_result(self, result):
+        '''
+        @summary:
+            結果を格納し、待っているスレッドとコールバックに通知します
+        '''
+        with self._cond:
+            self._result = result
+            self._done = True
+            self._cond.notify_all()
+        self._invoke_callbacks()
+
+    def set_exception(self, exc_info):
+        '''
+        @param exc_info: tuple: sys.exc_info()の戻り値
+        '''
+        with self._cond:
+            self._exc_info = exc_info
+            self._done = True
+            self._cond.notify_all()
+        self._invoke_callbacks()
+
+    def _wait(self, timeout):
+        with self._cond:
+            if not self._done:
+                self._cond.wait(timeout)
+            if not self._done:
+                raise TimeoutError("TimeoutError")
+
+    def result(self, timeout=None):
+        '''
+        @summary:
+            処理の終了を待って結果を返します
+            処理で例外が発生した場合は同じ例外を送出します
+        '''
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        '''
+        @summary:
+            処理の終了を待って発生した例外を返します。発生していない場合はNone
+        '''
+        self._wait(timeout)
+        if self._exc_info is None:
+            return None
+        return self._exc_info[1]
+
+    def add_done_callback(self, func):
+        '''
+        @summary:
+            処理の終了時にfunc(future)を呼び出します
+            既に終了している場合は直ちに呼び出します
+        '''
+        with self._cond:
+            if not self._done:
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _invoke_callbacks(self):
+        with self._cond:
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:
+                pass
+
+class ThreadPool(object):
+    '''
+    @summary:
+        固定数のワーカースレッドで処理を実行するプール
+        スレッドは最初の投入時に起動し、デーモンスレッドとして動作します
+        max_queueを指定した場合、待ち行列が一杯になるとsubmitはブロックし、
+        try_submitは処理を投入せずにNoneを返します
+    '''
+    def __init__(self, workers=1, max_queue=0, name="lamia-worker"):
+        '''
+        @param workers: int: ワーカースレッドの数
+        @param max_queue: int: 待ち行列の上限 0の場合は無制限
+        @param name: str: スレッド名の接頭辞
+        '''
+        if workers < 1:
+            raise ValueError("You must specify positive number for 'workers'.")
+        self.workers = workers
+        self.name = name
+        self._queue = Queue.Queue(max_queue)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, func, *args, **kw):
+        '''
+        @summary:
+            func(*args, **kw)を投入し、Futureを返します
+        '''
+        return self._submit(True, func, args, kw)
+
+    def try_submit(self, func, *args, **kw):
+        '''
+        @summary:
+            待ち行列に空きがあればfunc(*args, **kw)を投入してFutureを返し、
+            空きが無ければNoneを返します
+        '''
+        try:
+            return self._submit(False, func, args, kw)
+        except Queue.Full:
+            return None
+
+    def _submit(self, block, func, args, kw):
+        if self._shutdown:
+            raise RuntimeError("ThreadPool is already shut down.")
+        self._start()
+        future = Future()
+        self._queue.put((future, func, args, kw), block)
+        return future
+
+    def _start(self):
+        if len(self._threads) >= self.workers:
+            return
+        with self._lock:
+            _live_pools.add(self)
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._run,
+                        name="%s-%d" % (self.name, len(self._threads)))
+                t.daemon = True
+                t.start()
+                self._threads.append(t)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            future, func, args, kw = item
+            try:
+                future.set_result(func(*args, **kw))
+            except:
+                future.set_exception(sys.exc_info())
+            finally:
+                self._queue.task_done()
+
+    def shutdown(self, wait=True, cancel=False, timeout=None):
+        '''
+        @summary:
+            投入済みの処理を実行した後、ワーカースレッドを終了します
+        @param wait: bool: 真の場合、ワーカースレッドの終了を待ちます
+        @param cancel: bool: 真の場合、待ち行列に残った処理を実行せずに破棄します
+                             (破棄した処理のFutureはRuntimeErrorで終了します)
+        @param timeout: float: waitの場合に待つ時間の上限(秒)
+        '''
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            threads = list(self._threads)
+        if cancel:
+            self._cancel_pending()
+        for _ in threads:
+            self._queue.put(None)
+        if wait:
+            deadline = None if timeout is None else time.time() + timeout
+            for t in threads:
+                if deadline is None:
+                    t.join()
+                else:
+                    t.join(max(0.0, deadline - time.time()))
+
+    def _cancel_pending(self):
+        try:
+            raise RuntimeError("ThreadPool was shut down before running the task.")
+        except RuntimeError:
+            exc_info = sys.exc_info()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                if item is not None:
+                    item[0].set_exception(exc_info)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        '''
+        @summary:
+            投入済みの処理が全て終了するまで待ちます
+        '''
+        self._queue.join()
+
+    def __len__(self):
+        '''
+        @summary:
+            待ち行列にある処理の数
+        '''
+        return self._queue.qsize()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import struct
+'''
+@summary:
+    Lamiaのキャッシュサーバのバイナリプロトコルを定義するモジュール
+    要求: REQUEST_HEADER(opcode, 要求ID, 名前空間の長さ, 本体の長さ) + 名前空間 + 本体
+    応答: RESPONSE_HEADER(status, 要求ID, 本体の長さ) + 本体
+    サーバは1つの接続の要求を順に処理し、同じ順序で応答するため、
+    クライアントは応答を待たずに複数の要求を送信できます(パイプライン)
+    値はクライアントが変換したbytesのまま格納し、サーバは値を復元しません
+'''
+
+__all__ = ("REQUEST_HEADER", "RESPONSE_HEADER", "MAX_FRAME",
+           "GET", "SET", "DELETE", "GET_MULTI", "PURGE", "PING",
+           "OK", "NOT_FOUND", "ERROR", "ProtocolError",
+           "pack_request", "pack_response", "pack_set", "unpack_set",
+           "pack_keys", "unpack_keys", "pack_values", "unpack_values",
+           "pack_count", "unpack_count")
+
+# opcode(B), 要求ID(I), 名前空間の長さ(H), 本体の長さ(I)
+REQUEST_HEADER = struct.Struct(">BIHI")
+# status(B), 要求ID(I), 本体の長さ(I)
+RESPONSE_HEADER = struct.Struct(">BII")
+# 1つの要求、応答の本体の上限
+MAX_FRAME = 64 * 1024 * 1024
+
+# opcodes
+GET = 1
+SET = 2
+DELETE = 3
+GET_MULTI = 4
+PURGE = 5
+PING = 6
+
+# status
+OK = 0
+NOT_FOUND = 1
+ERROR = 2
+
+# SETの本体: 有効期限(d 負数はデフォルト), ファイルに書き出すか(B), キーの長さ(I)
+_set = struct.Struct(">dBI")
+_length = struct.Struct(">I")
+# GET_MULTIの応答の値の長さ (-1は見つからない)
+_value_length = struct.Struct(">i")
+
+class ProtocolError(Exception):
+    '''
+    @summary:
+        不正なフレームを受け取った場合に発生する例外クラスです
+    '''
+    pass
+
+def pack_request(opcode, request_id, namespace, body=""):
+    return REQUEST_HEADER.pack(opcode, request_id, len(namespace), len(body)) + \
+        namespace + body
+
+def pack_response(status, request_id, body=""):
+    return RESPONSE_HEADER.pack(status, request_id, len(body)) + body
+
+def pack_set(key, value, expires=None, is_store_file=True):
+    if expires is None:
+        expires = -1.0
+    return _set.pack(expires, 1 if is_store_file else 0, len(key)) + key + value
+
+def unpack_set(body):
+    '''
+    @return: tuple: (key, value, expires(デフォルトの場合はNone), is_store_file)
+    '''
+    if len(body) < _set.size:
+        raise ProtocolError("SET body is truncated.")
+    expires, is_store_file, key_length = _set.unpack_from(body)
+    start = _set.size + key_length
+    if len(body) < start:
+        raise ProtocolError("SET key is truncated.")
+    if expires < 0:
+        expires = None
+    return body[_set.size:start], body[start:], expires, bool(is_store_file)
+
+def pack_keys(keys):
+    return "".join(_length.pack(len(key)) + key for key in keys)
+
+def unpack_keys(body):
+    keys = []
+    offset = 0
+    size = len(body)
+    while offset < size:
+        if offset + _length.size > size:
+            raise ProtocolError("Key list is truncated.")
+        length, = _length.unpack_from(body, offset)
+        offset += _length.size
+        if offset + length > size:
+            raise ProtocolError("Key list is truncated.")
+        keys.append(body[offset:offset + length])
+        offset += length
+    return keys
+
+def pack_values(values):
+    '''
+    @param values: list: 値のbytes、見つからない場合はNone
+    '''
+    return "".join(_value_length.pack(-1) if value is None else
+                   _value_length.pack(len(value)) + value
+                   for value in values)
+
+def unpack_values(body):
+    values = []
+    offset = 0
+    size = len(body)
+    while offset < size:
+        if offset + _value_length.size > size:
+            raise ProtocolError("Value list is truncated.")
+        length, = _value_length.unpack_from(body, offset)
+        offset += _value_length.size
+        if length < 0:
+            values.append(None)
+            continue
+        if offset + length > size:
+            raise ProtocolError("Value list is truncated.")
+        values.append(body[offset:offset + length])
+        offset += length
+    return values
+
+def pack_count(count):
+    return _length.pack(count)
+
+def unpack_count(body):
+    return _length.unpack(body)[0]
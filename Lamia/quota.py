@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import threading
+from collections import OrderedDict
+from Lamia.expiry import ExpirationIndex
+'''
+@summary:
+    ファイル層の使用量(bytes数)を名前空間毎に管理し、上限を超えた場合に
+    削除するファイルを選ぶモジュール
+    使用量は書き出し、削除と有効期限のジャーナルのレコードから求めるため、
+    ディレクトリを走査する必要はありません
+'''
+
+__all__ = ("DiskQuota", "POLICIES")
+
+POLICIES = ('lru', 'expiry')
+
+class DiskQuota(object):
+    '''
+    @summary:
+        名前空間のファイルの相対パスとbytes数を保持し、合計がmax_bytesを超えた場合に
+        policyの順でファイルを選びます
+        'lru': 最も長く読み書きされていないファイル
+        'expiry': 最も早く期限切れになるファイル
+        各操作はファイル数によらず一定の時間(expiryはlog n)で行います
+    '''
+    # ヒープに残す古い要素の許容数
+    _slack = 1024
+
+    def __init__(self, max_bytes, policy='lru'):
+        '''
+        @param max_bytes: int: 名前空間の使用量の上限(bytes)
+        @param policy: str: 削除するファイルの選び方 'lru', 'expiry'
+        '''
+        if policy not in POLICIES:
+            raise ValueError("Unknown disk eviction policy '%s'." % policy)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.total = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        # relpath -> (bytes数, 有効期限) 'lru'では古く使われた順に並びます
+        self._entries = OrderedDict()
+        self._index = ExpirationIndex() if policy == 'expiry' else None
+        self._lock = threading.Lock()
+
+    def add(self, relpath, size, expiration_date):
+        '''
+        @summary:
+            ファイルの書き出しを記録します。同じファイルの以前の記録は置き換えます
+        '''
+        with self._lock:
+            entry = self._entries.pop(relpath, None)
+            if entry is not None:
+                self.total -= entry[0]
+            self._entries[relpath] = (size, expiration_date)
+            self.total += size
+            if self._index is not None:
+                self._index.push(relpath, expiration_date)
+                if len(self._index) > 2 * len(self._entries) + self._slack:
+                    self._index.rebuild((path, date) for path, (_, date)
+                                        in self._entries.iteritems())
+
+    def touch(self, relpath):
+        '''
+        @summary:
+            ファイルの読み込みを記録します('lru'のみ)
+        '''
+        if self._index is not None:
+            return
+        with self._lock:
+            entry = self._entries.pop(relpath, None)
+            if entry is not None:
+                self._entries[relpath] = entry
+
+    def discard(self, relpath):
+        '''
+        @summary:
+            ファイルの削除を記録します
+        '''
+        with self._lock:
+            entry = self._entries.pop(relpath, None)
+            if entry is not None:
+                self.total -= entry[0]
+
+    def exceeded(self):
+        return self.total > self.max_bytes
+
+    def pop_victim(self):
+        '''
+        @summary:
+            使用量が上限を超えている場合、削除するファイルの相対パスを取り除いて返します
+            上限以下、または記録が無い場合はNone
+        '''
+        with self._lock:
+            if self.total <= self.max_bytes or not self._entries:
+                return None
+            if self._index is None:
+                relpath, (size, _) = self._entries.popitem(last=False)
+            else:
+                for relpath, expiration_date in self._index.pop_expired(float('inf')):
+                    entry = self._entries.get(relpath)
+                    if entry is not None and entry[1] == expiration_date:
+                        break
+                else:
+                    return None
+                size = self._entries.pop(relpath)[0]
+            self.total -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+            return relpath
+
+    def reset(self, items):
+        '''
+        @summary:
+            (相対パス, 有効期限, bytes数)の列で作り直します
+        '''
+        with self._lock:
+            entries = OrderedDict()
+            for relpath, expiration_date, size in sorted(items, key=lambda item: item[1]):
+                entries[relpath] = (size, expiration_date)
+            self._entries = entries
+            self.total = sum(size for size, _ in entries.itervalues())
+            if self._index is not None:
+                self._index.rebuild((relpath, date) for relpath, (_, date)
+                                    in entries.iteritems())
+
+    def snapshot(self):
+        '''
+        @summary:
+            使用量をdictで返します
+        '''
+        return dict(max_bytes=self.max_bytes,
+                    used_bytes=self.total,
+                    files=len(self._entries),
+                    policy=self.policy,
+                    evictions=self.evictions,
+                    evicted_bytes=self.evicted_bytes)
+
+    def __len__(self):
+        return len(self._entries)
@@ -2,47 +2,444 @@
 # Lamia
 # Copyright 2011-2012 Jun Kimura
 # LICENSE MIT
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import os
+import json
+import mmap
+import marshal
+import struct
+import zlib
+import thread
+from cStringIO import StringIO
+from itertools import count
 from Lamia.util import _CacheData, logger
+from Lamia.compress import COMPRESS_NONE, COMPRESS_MASK, decompress
+from Lamia.layout import INTERNAL_PREFIX
 '''
-@summary: 
-    serialize系のメソッドをサポートするモジュール    
+@summary:
+    serialize系のメソッドをサポートするモジュール
+    format for serialize_data:
+        <header><payload>
+        header: magic(4s), version(B), codec(B), flags(B),
+                expiration_date(d), payload length(I), crc32 of payload(I)
+        flags: 下位4bitは圧縮方式(Lamia.compress)
+    ヘッダは固定長のため、有効期限は1回の読み込みで取得できます
+    CRCは格納したペイロード(圧縮後)に対して計算します
+    ファイルは一時ファイルに書き出してからrenameで置き換えるため、
+    読み込み中(mmap中)のファイルの内容が書き換わることはありません
+    dump_stream, open_streamは'raw'の値を一定サイズの断片毎に読み書きし、
+    値の全体をメモリ上に持ちません
 '''
 
-def dump(data, path):
+__all__ = ("dump", "load", "load_header", "load_mapped", "encode", "decode",
+           "decode_mapped", "verify", "dump_stream", "open_stream", "StreamReader",
+           "iter_chunks", "write_chunks", "pack_raw_header",
+           "register_codec", "get_codec", "DumpError", "LoadError")
+
+MAGIC = "LMIA"
+VERSION = 1
+HEADER = struct.Struct(">4sBBBdII")
+HEADER_SIZE = HEADER.size
+
+CODEC_RAW = 0
+CODEC_PICKLE = 1
+CODEC_MARSHAL = 2
+CODEC_JSON = 3
+
+# ペイロードの長さの上限 (ヘッダのpayload lengthはI)
+MAX_PAYLOAD = 0xffffffff
+# ストリームを読み書きする断片のサイズ
+STREAM_CHUNK = 64 * 1024
+
+# codec id => (name, encode, decode), name => codec id
+_codecs = {}
+_codec_ids = {}
+
+def register_codec(codec_id, name, encode, decode):
     '''
-    @summary: 
+    @summary:
+        値の変換方式を登録します
+    @param codec_id: int: ファイルに記録する識別子(0-255)
+    @param encode: function: 値をstrに変換する関数
+    @param decode: function: strを値に戻す関数
+    '''
+    if not 0 <= codec_id <= 255:
+        raise ValueError("codec id must be in 0-255: %r" % codec_id)
+    _codecs[codec_id] = (name, encode, decode)
+    _codec_ids[name] = codec_id
+
+def get_codec(codec):
+    '''
+    @summary:
+        名前または識別子に対応する(codec id, encode, decode)を返します
+    '''
+    codec_id = _codec_ids.get(codec, codec)
+    try:
+        _, encode, decode = _codecs[codec_id]
+    except (KeyError, TypeError):
+        raise ValueError("Unknown codec '%s'." % (codec,))
+    return codec_id, encode, decode
+
+def _encode_raw(val):
+    if isinstance(val, (bytearray, buffer)):
+        return str(val)
+    if not isinstance(val, str):
+        raise DumpError("raw codec accepts only str, not %s" % type(val).__name__)
+    return val
+
+register_codec(CODEC_RAW, 'raw', _encode_raw, str)
+register_codec(CODEC_PICKLE, 'pickle',
+               lambda val: pickle.dumps(val, pickle.HIGHEST_PROTOCOL), pickle.loads)
+register_codec(CODEC_MARSHAL, 'marshal', marshal.dumps, marshal.loads)
+register_codec(CODEC_JSON, 'json', json.dumps, json.loads)
+
+def _crc(payload):
+    return zlib.crc32(payload) & 0xffffffff
+
+def encode(data, codec='pickle', compressor=None):
+    '''
+    @summary:
+        _CacheDataをヘッダ付きのstrに変換します
+    @param compressor: Lamia.compress.Compressor: 指定した場合は値を圧縮します
+    '''
+    codec_id, encode_val, _ = get_codec(codec)
+    try:
+        payload = encode_val(data.val)
+    except DumpError:
+        raise
+    except Exception, err:
+        raise DumpError("Failed to encode value: %s" % err)
+    flags = COMPRESS_NONE
+    if compressor is not None:
+        flags, payload = compressor.compress(payload)
+    return HEADER.pack(MAGIC, VERSION, codec_id, flags, data.expiration_date,
+                       len(payload), _crc(payload)) + payload
+
+def unpack_header(header):
+    '''
+    @summary:
+        ヘッダを解析して(codec id, flags, expiration_date, payload length, crc)を返します
+    '''
+    if len(header) < HEADER_SIZE:
+        raise LoadError("Header is truncated.")
+    magic, version, codec_id, flags, expiration_date, length, crc = \
+        HEADER.unpack(header[:HEADER_SIZE])
+    if magic != MAGIC:
+        raise LoadError("Bad magic number.")
+    if version != VERSION:
+        raise LoadError("Unsupported version: %d" % version)
+    return codec_id, flags, expiration_date, length, crc
+
+def _decode_payload(codec_id, flags, expiration_date, payload, length, crc,
+                    compressor=None):
+    if len(payload) != length:
+        raise LoadError("Payload is truncated.")
+    if _crc(payload) != crc:
+        raise LoadError("CRC mismatch.")
+    try:
+        compress_id = flags & COMPRESS_MASK
+        if compress_id != COMPRESS_NONE:
+            if compressor is not None:
+                payload = compressor.decompress(compress_id, payload)
+            else:
+                payload = decompress(compress_id, payload)
+        _, _, decode_val = get_codec(codec_id)
+        val = decode_val(payload)
+    except Exception, err:
+        raise LoadError("Failed to decode value: %s" % err)
+    return _CacheData(val=val, expiration_date=expiration_date)
+
+def verify(record):
+    '''
+    @summary:
+        値を復元せずにヘッダと長さ、CRCを検証し、有効期限を返します
+    '''
+    codec_id, _, expiration_date, length, crc = unpack_header(record)
+    payload = record[HEADER_SIZE:HEADER_SIZE + length + 1]
+    if len(payload) != length:
+        raise LoadError("Payload is truncated.")
+    if _crc(payload) != crc:
+        raise LoadError("CRC mismatch.")
+    return expiration_date
+
+def decode(record, compressor=None):
+    '''
+    @summary:
+        encodeで変換したstrを_CacheDataに戻します
+    '''
+    codec_id, flags, expiration_date, length, crc = unpack_header(record)
+    return _decode_payload(codec_id, flags, expiration_date,
+                           record[HEADER_SIZE:HEADER_SIZE + length + 1], length, crc,
+                           compressor)
+
+_tmp_counter = count()
+
+def temp_path(path):
+    '''
+    @summary:
+        pathと同じディレクトリに書き込み用の一時ファイルのパスを返します
+    '''
+    return os.path.join(os.path.dirname(path), "%stmp-%d-%d-%d" % (
+        INTERNAL_PREFIX, os.getpid(), thread.get_ident(), next(_tmp_counter)))
+
+def dump(data, path, codec='pickle', compressor=None):
+    '''
+    @summary:
         指定したデータをシリアライズして指定したファイル上に書き込みます
+    @return: int: 書き込んだbytes数
     '''
-    with open(path, 'wb') as f:
-        f.write("%s\n" % str(data.expiration_date))
-        f.write(str(data.val))
+    record = encode(data, codec, compressor)
+    tmp = temp_path(path)
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(record)
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
     #logger.debug("STORE FILE: %s" % path)
+    return len(record)
 
-def load(path):
+def load(path, compressor=None, with_size=False):
     '''
-    @summary: 
+    @summary:
         指定したデータをpythonデータ型に変換したものを返します
-        format for serialize_data:
-            <expiration_date>(enter)
-            <val>
+        ファイルが壊れている場合はLoadError
+    @param with_size: bool: 真の場合は(データ, 読み込んだbytes数)を返します
     '''
     with open(path, 'rb') as f:
-        expiration_date = float(f.readline().strip())
-        val = f.read()
-    return _CacheData(val=val, expiration_date=expiration_date)
+        codec_id, flags, expiration_date, length, crc = unpack_header(f.read(HEADER_SIZE))
+        # 末尾の余分なデータも検出するため1byte多く読み込む
+        payload = f.read(length + 1)
+    data = _decode_payload(codec_id, flags, expiration_date, payload, length, crc,
+                           compressor)
+    if with_size:
+        return data, HEADER_SIZE + length
+    return data
+
+def view(buf, offset, length):
+    '''
+    @summary:
+        bufの一部をコピーせずに参照するオブジェクトを返します
+        (memoryview、またはpython2のmmapではbuffer)
+    '''
+    try:
+        return memoryview(buf)[offset:offset + length]
+    except TypeError:
+        return buffer(buf, offset, length)
+
+def _mappable(codec_id, flags, length, threshold):
+    return (threshold is not None and codec_id == CODEC_RAW and
+            flags & COMPRESS_MASK == COMPRESS_NONE and length >= threshold)
+
+def decode_mapped(mm, offset, size, threshold, compressor=None):
+    '''
+    @summary:
+        mmap上のレコードを_CacheDataに戻します
+        'raw'で圧縮していない、threshold以上の値はコピーせずにmmapへのビューを返します
+        ビューはmmapへの参照を保持するため、ファイルが削除されても読み続けられます
+    '''
+    codec_id, flags, expiration_date, length, crc = \
+        unpack_header(mm[offset:offset + HEADER_SIZE])
+    if size != HEADER_SIZE + length or offset + size > len(mm):
+        raise LoadError("Payload is truncated.")
+    start = offset + HEADER_SIZE
+    if not _mappable(codec_id, flags, length, threshold):
+        return _decode_payload(codec_id, flags, expiration_date,
+                               mm[start:start + length], length, crc, compressor)
+    payload = view(mm, start, length)
+    if _crc(payload) != crc:
+        raise LoadError("CRC mismatch.")
+    return _CacheData(val=payload, expiration_date=expiration_date)
+
+def load_mapped(path, threshold, compressor=None, with_size=False):
+    '''
+    @summary:
+        loadと同様にデータを返しますが、threshold以上の'raw'の値は
+        ファイルをmmapしてコピーせずに参照するビューを返します
+    '''
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        codec_id, flags, expiration_date, length, crc = unpack_header(header)
+        if not _mappable(codec_id, flags, length, threshold):
+            payload = f.read(length + 1)
+            data = _decode_payload(codec_id, flags, expiration_date, payload, length,
+                                   crc, compressor)
+        else:
+            size = os.fstat(f.fileno()).st_size
+            if size != HEADER_SIZE + length:
+                raise LoadError("Payload is truncated.")
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = decode_mapped(mm, 0, size, threshold, compressor)
+    if with_size:
+        return data, HEADER_SIZE + length
+    return data
+
+def iter_chunks(source, chunk_size=STREAM_CHUNK):
+    '''
+    @summary:
+        strの断片のiterable、またはreadを持つファイルオブジェクトから断片を順に返します
+    '''
+    read = getattr(source, 'read', None)
+    if read is None:
+        return iter(source)
+    return iter(lambda: read(chunk_size), "")
+
+def pack_raw_header(expiration_date, length=0, crc=0):
+    '''
+    @summary:
+        圧縮していない'raw'の値のヘッダを返します
+    '''
+    return HEADER.pack(MAGIC, VERSION, CODEC_RAW, COMPRESS_NONE, expiration_date, length, crc)
+
+def write_chunks(f, chunks):
+    '''
+    @summary:
+        strの断片をファイルに順に書き出し、ペイロードの(長さ, CRC)を返します
+    @param chunks: iterable: str(またはbytearray, buffer, memoryview)の断片
+    '''
+    length = 0
+    crc = 0
+    for chunk in chunks:
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        elif not isinstance(chunk, (str, bytearray, buffer)):
+            raise DumpError("stream accepts only str chunks, not %s" %
+                            type(chunk).__name__)
+        length += len(chunk)
+        if length > MAX_PAYLOAD:
+            raise DumpError("Stream is too large (over %d bytes)." % MAX_PAYLOAD)
+        f.write(chunk)
+        crc = zlib.crc32(chunk, crc)
+    return length, crc & 0xffffffff
+
+def dump_stream(chunks, path, expiration_date):
+    '''
+    @summary:
+        strの断片を'raw'の値として一時ファイルに順に書き出し、renameで置き換えます
+        ペイロードの長さとCRCは書き出しながら求め、最後にヘッダを書き直します
+    @param chunks: iterable: str(またはbytearray, buffer, memoryview)の断片
+    @return: int: 書き込んだbytes数
+    '''
+    tmp = temp_path(path)
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(pack_raw_header(expiration_date))
+            length, crc = write_chunks(f, chunks)
+            f.seek(0)
+            f.write(pack_raw_header(expiration_date, length, crc))
+        os.rename(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return HEADER_SIZE + length
+
+class StreamReader(object):
+    '''
+    @summary:
+        キャッシュファイルのペイロードを読み込むファイルライクなオブジェクト
+        ヘッダの直後に位置し、ペイロードの終端で読み込みを終えます
+        CRCは読み込みながら計算し、終端まで読んだ時点で一致しなければLoadError
+        ファイルを開いたままのため、読み込み中に置き換えられても内容は変わりません
+    '''
+    def __init__(self, f, expiration_date, length, crc=None):
+        '''
+        @param f: file: ヘッダの直後に位置するファイル
+        @param crc: int: Noneの場合は検証しません
+        '''
+        self._file = f
+        self.expiration_date = expiration_date
+        self.length = length
+        self._crc = crc
+        self._computed = 0
+        self._remaining = length
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def tell(self):
+        return self.length - self._remaining
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        if not size:
+            return ""
+        data = self._file.read(size)
+        if len(data) < size:
+            raise LoadError("Payload is truncated.")
+        self._remaining -= size
+        if self._crc is not None:
+            self._computed = zlib.crc32(data, self._computed)
+            if not self._remaining and self._computed & 0xffffffff != self._crc:
+                raise LoadError("CRC mismatch.")
+        return data
+
+    def __iter__(self):
+        return iter(lambda: self.read(STREAM_CHUNK), "")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_stream(path, compressor=None, offset=0, size=None):
+    '''
+    @summary:
+        キャッシュファイルの'raw'の値を読み込むStreamReaderを返します
+        圧縮された値は展開したものを返します(展開のため値の全体をメモリ上に持ちます)
+        'raw'以外の値はTypeError
+    @param offset: int: ファイル内のレコードの位置
+    @param size: int: レコードのサイズ 省略時はoffsetからファイルの末尾まで
+    '''
+    f = open(path, 'rb')
+    try:
+        f.seek(offset)
+        codec_id, flags, expiration_date, length, crc = unpack_header(f.read(HEADER_SIZE))
+        if codec_id != CODEC_RAW:
+            raise TypeError("Cache file '%s' is not a raw value." % path)
+        if size is None:
+            size = os.fstat(f.fileno()).st_size - offset
+        if flags & COMPRESS_MASK == COMPRESS_NONE:
+            if size != HEADER_SIZE + length:
+                raise LoadError("Payload is truncated.")
+            return StreamReader(f, expiration_date, length, crc)
+        data = _decode_payload(codec_id, flags, expiration_date, f.read(length + 1),
+                               length, crc, compressor)
+        f.close()
+        return StreamReader(StringIO(data.val), expiration_date, len(data.val))
+    except:
+        f.close()
+        raise
+
+def load_header(path):
+    '''
+    @summary:
+        ペイロードを読まずに有効期限を返します
+    '''
+    with open(path, 'rb') as f:
+        return unpack_header(f.read(HEADER_SIZE))[2]
 
 class DumpError(Exception):
     '''
-    @summary: 
+    @summary:
         指定したデータのシリアライズに失敗した場合に発生する例外クラス
     '''
     pass
-    
+
 class LoadError(Exception):
     '''
-    @summary: 
+    @summary:
         指定したデータのpython型への変換に失敗した場合に発生する例外クラス
     '''
     pass
-    
-    
\ No newline at end of file
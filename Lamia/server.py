@@ -0,0 +1,615 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import os
+import sys
+import errno
+import fcntl
+import select
+import signal
+import socket
+import argparse
+from collections import deque
+from functools import partial
+from Lamia.cache import Cache
+from Lamia.protocol import REQUEST_HEADER, MAX_FRAME, GET, SET, DELETE, GET_MULTI, \
+                           PURGE, PING, OK, NOT_FOUND, ERROR, ProtocolError, \
+                           pack_response, unpack_set, unpack_keys, pack_values, pack_count
+from Lamia.util import logger, ExpiredError
+from Lamia.pool import ThreadPool
+from Lamia.layout import INTERNAL_PREFIX
+'''
+@summary:
+    複数のプロセスでキャッシュを共有するためのキャッシュサーバ
+    1つのプロセスで名前空間毎のCacheを保持し、Unixドメインソケット、またはTCPで
+    Lamia.protocolの要求を処理します
+    接続はepoll(無い場合はpoll、select)によるイベントループの1スレッドで扱い、
+    ファイルの読み書きを伴う要求はワーカースレッドで処理します
+'''
+
+__all__ = ("CacheServer", "check_name", "main")
+
+_again = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+def check_name(name, kind='key'):
+    '''
+    @summary:
+        名前空間、キーがディレクトリの外を指さないことを確認し、そのまま返します
+        空、'.', '..'、パスの区切り文字やNULを含む名前、
+        管理用ファイルの接頭辞(INTERNAL_PREFIX)で始まる名前はValueError
+        ('flat'の配置ではキーがそのままファイル名になるため、要求の全てのキーを確認します)
+    '''
+    if (not name or name in ('.', '..') or os.sep in name or
+            (os.altsep and os.altsep in name) or '\0' in name or
+            name.startswith(INTERNAL_PREFIX)):
+        raise ValueError("Invalid %s '%s'." % (kind, name))
+    return name
+
+class _EpollPoller(object):
+    def __init__(self):
+        self._epoll = select.epoll()
+
+    def register(self, fd, write=False):
+        self._epoll.register(fd, self._events(write, True))
+
+    def modify(self, fd, write, read=True):
+        self._epoll.modify(fd, self._events(write, read))
+
+    def unregister(self, fd):
+        self._epoll.unregister(fd)
+
+    def _events(self, write, read):
+        events = select.EPOLLIN if read else 0
+        if write:
+            events |= select.EPOLLOUT
+        return events
+
+    def poll(self, timeout):
+        try:
+            events = self._epoll.poll(timeout)
+        except IOError, err:
+            if err.errno == errno.EINTR:
+                return []
+            raise
+        error = select.EPOLLERR | select.EPOLLHUP
+        return [(fd, bool(mask & (select.EPOLLIN | error)), bool(mask & select.EPOLLOUT))
+                for fd, mask in events]
+
+    def close(self):
+        self._epoll.close()
+
+class _PollPoller(object):
+    def __init__(self):
+        self._poll = select.poll()
+
+    def register(self, fd, write=False):
+        self._poll.register(fd, self._events(write, True))
+
+    def modify(self, fd, write, read=True):
+        self._poll.modify(fd, self._events(write, read))
+
+    def unregister(self, fd):
+        self._poll.unregister(fd)
+
+    def _events(self, write, read):
+        events = select.POLLIN if read else 0
+        if write:
+            events |= select.POLLOUT
+        return events
+
+    def poll(self, timeout):
+        try:
+            events = self._poll.poll(timeout * 1000)
+        except select.error, err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+        error = select.POLLERR | select.POLLHUP | select.POLLNVAL
+        return [(fd, bool(mask & (select.POLLIN | error)), bool(mask & select.POLLOUT))
+                for fd, mask in events]
+
+    def close(self):
+        pass
+
+class _SelectPoller(object):
+    def __init__(self):
+        self._readers = set()
+        self._writers = set()
+
+    def register(self, fd, write=False):
+        self.modify(fd, write)
+
+    def modify(self, fd, write, read=True):
+        if read:
+            self._readers.add(fd)
+        else:
+            self._readers.discard(fd)
+        if write:
+            self._writers.add(fd)
+        else:
+            self._writers.discard(fd)
+
+    def unregister(self, fd):
+        self._readers.discard(fd)
+        self._writers.discard(fd)
+
+    def poll(self, timeout):
+        try:
+            readable, writable, _ = select.select(self._readers, self._writers, [], timeout)
+        except select.error, err:
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+        writable = set(writable)
+        events = [(fd, True, fd in writable) for fd in readable]
+        events.extend((fd, False, True) for fd in writable.difference(readable))
+        return events
+
+    def close(self):
+        pass
+
+def _make_poller():
+    if hasattr(select, 'epoll'):
+        return _EpollPoller()
+    if hasattr(select, 'poll'):
+        return _PollPoller()
+    return _SelectPoller()
+
+class _Connection(object):
+    '''
+    @summary:
+        クライアントとの接続毎の受信、送信バッファ
+        送信バッファは応答のフレームの列で、先頭のフレームの送信済みの位置をoutposに、
+        未送信のbytes数の合計をpendingに持ちます
+    '''
+    __slots__ = ('sock', 'fd', 'inbuf', 'outbuf', 'outpos', 'pending', 'interest', 'busy')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.inbuf = bytearray()
+        self.outbuf = deque()
+        self.outpos = 0
+        self.pending = 0
+        # pollerに登録している(書き込み, 読み込み)
+        self.interest = (False, True)
+        # ワーカースレッドで処理中の要求があるか
+        self.busy = False
+
+class CacheServer(object):
+    '''
+    @summary:
+        名前空間毎のCacheを保持し、Lamia.protocolの要求を処理するサーバ
+        メモリ上で完結する要求(PING、メモリ上で見つかったGET、メモリのみのSET)は
+        イベントループのスレッドで処理し、ファイルの読み書きを伴う要求
+        (ファイルからのGET、SET、DELETE、GET_MULTI、PURGE)はワーカースレッドで処理して、
+        応答をwakeupのパイプでイベントループに戻します
+        接続毎の応答の順序を保つため、ワーカースレッドで処理中の要求がある接続は
+        その応答を返すまで後続の要求を処理しません(他の接続の処理は止まりません)
+        名前空間のCacheは最初の要求で作成し、値はクライアントが変換したbytesのまま
+        codec='raw'、thread_safe=Trueで格納します
+        応答を読まずに要求を送り続ける接続は、未送信の応答がmax_pendingを超えた時点で
+        読み込みを止めます
+    '''
+    # 接続毎の未送信の応答の上限(bytes)
+    max_pending = 4 * 1024 * 1024
+    # 1回のsendにまとめる小さな応答の合計の上限(bytes)
+    _coalesce = 256 * 1024
+
+    def __init__(self, cache_root, address, default_expires=3600, backlog=1024,
+                 cache_options=None, workers=4):
+        '''
+        @param cache_root: str: キャッシュファイルの格納ディレクトリのrootパス
+        @param address: str or tuple: Unixドメインソケットのパス、または(host, port)
+        @param default_expires: float: 有効期限を指定しない要求のデフォルトの有効期限
+        @param backlog: int: listenの待ち行列の長さ
+        @param cache_options: dict: 名前空間毎のCacheに渡すオプション
+        @param workers: int: ファイルの読み書きを伴う要求を処理するワーカースレッドの数
+        '''
+        self.cache_root = cache_root
+        self.default_expires = default_expires
+        self.cache_options = dict(cache_options or {})
+        self.caches = {}
+        self._connections = {}
+        self._running = True
+        self._pool = ThreadPool(workers, name="lamia-server")
+        # ワーカースレッドが処理を終えた(接続, 応答)
+        self._completed = deque()
+        self._poller = _make_poller()
+        self._init_listener(address, backlog)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._set_nonblocking(self._wakeup_r)
+        self._poller.register(self._wakeup_r)
+
+    def _init_listener(self, address, backlog):
+        '''
+        @summary:
+            init self.listener: 接続を受け付けるソケット
+            init self.address: 実際に使用するアドレス(ポート0を指定した場合も決定済み)
+        '''
+        if isinstance(address, basestring):
+            if os.path.exists(address):
+                os.remove(address)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(backlog)
+        sock.setblocking(False)
+        self.listener = sock
+        self.address = sock.getsockname()
+        self._unix = isinstance(address, basestring)
+        self._poller.register(sock.fileno())
+
+    def _set_nonblocking(self, fd):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def cache(self, namespace):
+        '''
+        @summary:
+            名前空間のCacheを返します。無い場合は作成します
+        '''
+        try:
+            return self.caches[namespace]
+        except KeyError:
+            pass
+        check_name(namespace, 'namespace')
+        options = dict(self.cache_options)
+        options['codec'] = 'raw'
+        options['thread_safe'] = True
+        cache = Cache(self.cache_root, self.default_expires, cache=dict(),
+                      namespace=namespace, **options)
+        self.caches[namespace] = cache
+        return cache
+
+    # --- event loop ---
+    def serve_forever(self, poll_interval=1.0):
+        '''
+        @summary:
+            shutdown()が呼ばれるまで要求を処理します
+        '''
+        listen_fd = self.listener.fileno()
+        wakeup_fd = self._wakeup_r
+        connections = self._connections
+        while self._running:
+            for fd, readable, writable in self._poller.poll(poll_interval):
+                if fd == listen_fd:
+                    self._accept()
+                elif fd == wakeup_fd:
+                    self._drain_wakeup()
+                    self._finish_jobs()
+                else:
+                    conn = connections.get(fd)
+                    if conn is None:
+                        continue
+                    if writable:
+                        self._write(conn)
+                    if readable and fd in connections:
+                        self._read(conn)
+
+    def shutdown(self):
+        '''
+        @summary:
+            serve_foreverを終了させます。他のスレッド、シグナルハンドラから呼べます
+        '''
+        self._running = False
+        try:
+            os.write(self._wakeup_w, 'x')
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except OSError:
+            pass
+
+    def _finish_jobs(self):
+        '''
+        @summary:
+            ワーカースレッドが処理を終えた要求の応答を送信バッファに追加し、
+            その接続で止めていた後続の要求の処理を再開します
+        '''
+        completed = self._completed
+        while completed:
+            conn, response = completed.popleft()
+            if self._connections.get(conn.fd) is not conn:
+                # 処理中に閉じた接続
+                continue
+            conn.busy = False
+            conn.outbuf.append(response)
+            conn.pending += len(response)
+            if self._process(conn):
+                self._write(conn)
+
+    def _run_job(self, conn, job, request_id):
+        '''
+        @summary:
+            ワーカースレッドで要求を処理し、応答をイベントループに戻します
+        '''
+        try:
+            response = job()
+        except Exception, err:
+            response = pack_response(ERROR, request_id, "%s: %s" % (type(err).__name__, err))
+        self._completed.append((conn, response))
+        try:
+            os.write(self._wakeup_w, 'x')
+        except OSError:
+            pass
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except socket.error, err:
+                if err.args[0] in _again or err.args[0] == errno.ECONNABORTED:
+                    return
+                if err.args[0] in (errno.EMFILE, errno.ENFILE):
+                    logger.warning("Too many open files; connection deferred.")
+                    return
+                raise
+            sock.setblocking(False)
+            if not self._unix:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = _Connection(sock)
+            self._connections[sock.fileno()] = conn
+            self._poller.register(sock.fileno())
+
+    def _close_connection(self, conn):
+        fd = conn.fd
+        if self._connections.get(fd) is conn:
+            del self._connections[fd]
+        try:
+            self._poller.unregister(fd)
+        except (KeyError, IOError, OSError, ValueError):
+            pass
+        conn.sock.close()
+
+    def _read(self, conn):
+        try:
+            data = conn.sock.recv(256 * 1024)
+        except socket.error, err:
+            if err.args[0] in _again:
+                return
+            self._close_connection(conn)
+            return
+        if not data:
+            self._close_connection(conn)
+            return
+        conn.inbuf.extend(data)
+        if self._process(conn):
+            self._write(conn)
+
+    def _write(self, conn):
+        '''
+        @summary:
+            送信バッファを送れるだけ送信します
+            送信済みの部分は位置を進めるのみで、残りをコピーし直しません
+            未送信の応答がmax_pendingを下回った場合は、止めていた要求の処理を再開します
+        '''
+        out = conn.outbuf
+        while out:
+            head = out[0]
+            if len(out) > 1 and len(head) - conn.outpos < self._coalesce:
+                # 小さな応答は上限までまとめて1回で送信します
+                chunks = [head[conn.outpos:]]
+                size = len(chunks[0])
+                out.popleft()
+                while out and size + len(out[0]) <= self._coalesce:
+                    size += len(out[0])
+                    chunks.append(out.popleft())
+                head = "".join(chunks)
+                out.appendleft(head)
+                conn.outpos = 0
+            try:
+                sent = conn.sock.send(buffer(head, conn.outpos))
+            except socket.error, err:
+                if err.args[0] not in _again:
+                    self._close_connection(conn)
+                    return
+                break
+            conn.outpos += sent
+            conn.pending -= sent
+            if conn.outpos < len(head):
+                break
+            out.popleft()
+            conn.outpos = 0
+        if conn.inbuf and conn.pending < self.max_pending and not conn.busy:
+            # 止めていた要求の処理を再開します (応答は次の書き込み可能なイベントで送信します)
+            if not self._process(conn):
+                return
+        self._update_interest(conn)
+
+    def _update_interest(self, conn):
+        '''
+        @summary:
+            未送信の応答があれば書き込みを、max_pending未満であれば読み込みを待ちます
+        '''
+        interest = (bool(conn.outbuf), conn.pending < self.max_pending)
+        if interest != conn.interest:
+            conn.interest = interest
+            self._poller.modify(conn.fd, *interest)
+
+    def _process(self, conn):
+        '''
+        @summary:
+            受信バッファ内の完全な要求を処理し、応答を送信バッファに追加します
+        未送信の応答がmax_pendingを超えた時点、ワーカースレッドに要求を渡した時点で
+        処理を止め、残りは受信バッファに残します
+        @return: bool: 不正な要求で接続を閉じた場合は偽
+        '''
+        try:
+            self._process_requests(conn)
+        except ProtocolError, err:
+            logger.warning("Closing connection: %s" % err)
+            self._close_connection(conn)
+            return False
+        return True
+
+    def _process_requests(self, conn):
+        buf = conn.inbuf
+        size = len(buf)
+        header_size = REQUEST_HEADER.size
+        offset = 0
+        while (size - offset >= header_size and conn.pending < self.max_pending and
+               not conn.busy):
+            opcode, request_id, namespace_length, body_length = \
+                REQUEST_HEADER.unpack_from(buffer(buf), offset)
+            if body_length > MAX_FRAME:
+                raise ProtocolError("Frame is too large: %d" % body_length)
+            start = offset + header_size
+            end = start + namespace_length + body_length
+            if size < end:
+                break
+            namespace = str(buf[start:start + namespace_length])
+            body = str(buf[start + namespace_length:end])
+            offset = end
+            response, job = self._dispatch(opcode, request_id, namespace, body)
+            if job is not None:
+                conn.busy = True
+                self._pool.submit(self._run_job, conn, job, request_id)
+                break
+            conn.outbuf.append(response)
+            conn.pending += len(response)
+        if offset:
+            del buf[:offset]
+
+    def _dispatch(self, opcode, request_id, namespace, body):
+        '''
+        @summary:
+            イベントループのスレッドで処理できる要求は(応答, None)を、
+            ファイルの読み書きを伴う要求は(None, ワーカースレッドで応答を返す関数)を返します
+        '''
+        try:
+            if opcode == PING:
+                return pack_response(OK, request_id), None
+            cache = self.cache(namespace)
+            if opcode == GET:
+                key = check_name(body)
+                try:
+                    return pack_response(OK, request_id, cache._fetch_cache_memory(key)), None
+                except (KeyError, ExpiredError):
+                    return None, partial(self._fetch_file, cache, request_id, key)
+            if opcode == SET:
+                key, value, expires, is_store_file = unpack_set(body)
+                if not is_store_file:
+                    cache.store(check_name(key), value, expires, False)
+                    return pack_response(OK, request_id), None
+        except ProtocolError:
+            raise
+        except Exception, err:
+            return pack_response(ERROR, request_id, "%s: %s" % (type(err).__name__, err)), None
+        return None, partial(self.handle, opcode, request_id, namespace, body)
+
+    def _fetch_file(self, cache, request_id, key):
+        try:
+            return pack_response(OK, request_id, cache._fetch_cache_file(key))
+        except (KeyError, ExpiredError):
+            return pack_response(NOT_FOUND, request_id)
+
+    def handle(self, opcode, request_id, namespace, body):
+        '''
+        @summary:
+            1つの要求を処理して応答のフレームを返します
+            処理中の例外はERRORの応答として返します
+        '''
+        try:
+            if opcode == PING:
+                return pack_response(OK, request_id)
+            cache = self.cache(namespace)
+            if opcode == GET:
+                try:
+                    return pack_response(OK, request_id, cache.fetch(check_name(body)))
+                except KeyError:
+                    return pack_response(NOT_FOUND, request_id)
+            if opcode == SET:
+                key, value, expires, is_store_file = unpack_set(body)
+                cache.store(check_name(key), value, expires, is_store_file)
+                return pack_response(OK, request_id)
+            if opcode == DELETE:
+                if cache.delete_many([check_name(body)]):
+                    return pack_response(OK, request_id)
+                return pack_response(NOT_FOUND, request_id)
+            if opcode == GET_MULTI:
+                keys = [check_name(key) for key in unpack_keys(body)]
+                found = cache.get_many(keys)
+                return pack_response(OK, request_id,
+                                     pack_values([found.get(key) for key in keys]))
+            if opcode == PURGE:
+                removed = (cache.purge_file() or 0) + cache.purge_memory()
+                return pack_response(OK, request_id, pack_count(removed))
+            return pack_response(ERROR, request_id, "Unknown opcode %d." % opcode)
+        except ProtocolError:
+            raise
+        except Exception, err:
+            return pack_response(ERROR, request_id, "%s: %s" % (type(err).__name__, err))
+
+    def close(self):
+        '''
+        @summary:
+            全ての接続とソケットを閉じ、処理中の要求を待って名前空間のCacheを閉じます
+        '''
+        self._pool.shutdown()
+        for conn in self._connections.values():
+            self._close_connection(conn)
+        try:
+            self._poller.unregister(self.listener.fileno())
+        except (KeyError, IOError, OSError, ValueError):
+            pass
+        self.listener.close()
+        if self._unix and os.path.exists(self.address):
+            os.remove(self.address)
+        self._poller.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+        for cache in self.caches.values():
+            cache.close()
+        self.caches = {}
+
+def main(argv=None):
+    '''
+    @summary:
+        lamia-serverコマンド
+    '''
+    parser = argparse.ArgumentParser(prog="lamia-server",
+                                     description="Lamia cache server")
+    parser.add_argument('--cache-root', default="/tmp/lamia")
+    parser.add_argument('--unix', help="Unix domain socket path")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=11311)
+    parser.add_argument('--expires', type=float, default=3600,
+                        help="default expires (seconds)")
+    parser.add_argument('--max-entries', type=int, default=None,
+                        help="memory tier entries per namespace")
+    parser.add_argument('--max-bytes', type=int, default=None,
+                        help="memory tier bytes per namespace")
+    parser.add_argument('--eviction', default='lru')
+    parser.add_argument('--storage', default='file', help="'file' or 'log'")
+    parser.add_argument('--layout', default='flat', help="'flat' or 'sharded'")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="threads for requests that read or write files")
+    parser.add_argument('--janitor', action='store_true',
+                        help="purge expired entries in the background")
+    args = parser.parse_args(argv)
+    address = args.unix or (args.host, args.port)
+    options = dict(max_entries=args.max_entries, max_bytes=args.max_bytes,
+                   eviction=args.eviction, storage=args.storage, layout=args.layout,
+                   janitor=args.janitor or None)
+    server = CacheServer(args.cache_root, address, args.expires, cache_options=options,
+                         workers=args.workers)
+    def _stop(signum, frame):
+        server.shutdown()
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        server.serve_forever()
+    finally:
+        server.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import os
+import mmap
+import stat
+import errno
+import fcntl
+import struct
+import tempfile
+import threading
+from hashlib import md5
+from Lamia.util import current_time, _CacheData
+'''
+@summary:
+    複数のプロセスで共有するメモリ上のキャッシュを提供するモジュール
+    mmapしたファイル上の固定容量のハッシュテーブルで、Cacheのcacheに指定して使います
+        cache = Cache(..., cache=SharedMemoryStore("/dev/shm/lamia-app"))
+    共有ファイルのキーと値はpickleで復元するため、ファイルは実行ユーザーの所有で、
+    modeで許可していないユーザーが書き込めないものに限ります
+'''
+
+__all__ = ("SharedMemoryStore",)
+
+# ファイルのヘッダ: magic, version, capacity, slot_size, ways
+_FILE_HEADER = struct.Struct("<4sIIII")
+_MAGIC = "LMSH"
+_VERSION = 1
+# ヘッダ領域のサイズ (スロットはこの位置から始まります)
+_PAGE = 4096
+
+# スロットのヘッダ: seq, hash, key kind, key length, value length, expiration date
+# hashが0のスロットは空きです
+_SLOT = struct.Struct("<IQBHId")
+_SEQ = struct.Struct("<I")
+
+_KEY_STR = 0
+_KEY_UNICODE = 1
+_KEY_PICKLE = 2
+
+# seqlockの読み込みを再試行する回数 (超えた場合は書き込み中のプロセスの異常終了を疑います)
+_SPIN = 1000
+
+def _encode_key(key):
+    if isinstance(key, str):
+        return _KEY_STR, key
+    if isinstance(key, unicode):
+        return _KEY_UNICODE, key.encode('utf8')
+    return _KEY_PICKLE, pickle.dumps(key, 2)
+
+def _decode_key(kind, data):
+    if kind == _KEY_STR:
+        return data
+    if kind == _KEY_UNICODE:
+        return data.decode('utf8')
+    return pickle.loads(data)
+
+def _hash(kind, data):
+    # プロセス間で同じ値になるハッシュ (0は空きスロットを表すため使いません)
+    return struct.unpack("<Q", md5(chr(kind) + data).digest()[:8])[0] | 1
+
+def default_path(name="lamia-shm"):
+    '''
+    @summary:
+        /dev/shmがあればその下、無ければ一時ディレクトリの下のパスを返します
+        ファイル名には実行ユーザーのIDを含めます
+    '''
+    name = "%s-%d" % (name, os.getuid())
+    if os.path.isdir("/dev/shm"):
+        return os.path.join("/dev/shm", name)
+    return os.path.join(tempfile.gettempdir(), name)
+
+def _open_owned(path, mode):
+    '''
+    @summary:
+        共有ファイルを開きます(無い場合は作成します)
+        シンボリックリンク、通常のファイル以外、他のユーザーが所有するファイル、
+        modeで許可していない書き込み権限を持つファイルはValueError
+    '''
+    flags = os.O_RDWR | getattr(os, 'O_NOFOLLOW', 0)
+    try:
+        fd = os.open(path, flags | os.O_CREAT | os.O_EXCL, mode)
+    except OSError, err:
+        if err.errno != errno.EEXIST:
+            raise
+        try:
+            fd = os.open(path, flags)
+        except OSError, err:
+            if err.errno == errno.ELOOP:
+                raise ValueError("'%s' is a symbolic link." % path)
+            raise
+    st = os.fstat(fd)
+    if not stat.S_ISREG(st.st_mode) or st.st_uid != os.getuid() or \
+            st.st_mode & 0022 & ~mode:
+        os.close(fd)
+        raise ValueError("'%s' is not owned by this user or is writable by others." % path)
+    return fd
+
+class SharedMemoryStore(object):
+    '''
+    @summary:
+        mmapしたファイル上の固定容量のハッシュテーブル
+        同じファイルを開いた全てのプロセス、スレッドで1つのメモリ上のキャッシュを共有します
+        テーブルはways個のスロットからなるバケットに分かれ、キーはハッシュで決まる
+        バケット内のいずれかのスロットに格納されます(セットアソシアティブ)
+        読み込みはスロット毎のseqlockで整合性を確認するため、ロックもシステムコールも使いません
+        書き込みはバケット毎にスレッドのロックとfcntlのレコードロックを取ります
+        バケットが一杯の場合は期限切れ、または最も有効期限の近いエントリを上書きします
+        slot_sizeに収まらない値は格納せず、oversizeとして数えます
+    '''
+    # 内部でスレッド間の排他を行うため、Cacheはロックを取りません
+    lock_free = True
+    # キーはstrまたはunicodeのみです
+    string_keys = True
+
+    def __init__(self, path=None, capacity=65536, slot_size=512, ways=8,
+                 mode=0600):
+        '''
+        @param path: str: 共有するファイルのパス 省略時は/dev/shm/lamia-shm-<uid>
+        @param capacity: int: スロット数(waysの倍数に切り上げます)
+        @param slot_size: int: 1スロットのサイズ(bytes) キーと値の合計がこれに収まる必要があります
+        @param ways: int: 1バケットあたりのスロット数
+        @param mode: int: ファイルの作成パーミッション
+                          他のユーザーのプロセスと共有する場合のみ、グループなどの権限を与えます
+        '''
+        if ways < 1 or capacity < ways:
+            raise ValueError("Invalid capacity=%r, ways=%r" % (capacity, ways))
+        if slot_size <= _SLOT.size:
+            raise ValueError("slot_size must be larger than %d." % _SLOT.size)
+        self.path = path or default_path()
+        self.ways = ways
+        self.slot_size = slot_size
+        self.buckets = (capacity + ways - 1) // ways
+        self.capacity = self.buckets * ways
+        self.oversize = 0
+        self.evictions = 0
+        self._fd = _open_owned(self.path, mode)
+        try:
+            self._mm = self._open()
+        except:
+            os.close(self._fd)
+            raise
+        self._thread_locks = [threading.Lock() for _ in xrange(64)]
+
+    def _open(self):
+        '''
+        @summary:
+            ファイルを初期化(または既存のヘッダを確認)してmmapします
+        '''
+        size = _PAGE + self.capacity * self.slot_size
+        header = _FILE_HEADER.pack(_MAGIC, _VERSION, self.capacity,
+                                   self.slot_size, self.ways)
+        # 初期化はバイト0のレコードロックで他のプロセスと排他します
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                os.ftruncate(self._fd, size)
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                os.write(self._fd, header)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                existing = os.read(self._fd, _FILE_HEADER.size)
+                if existing != header:
+                    raise ValueError("'%s' is not a shared cache with the same settings." %
+                                     self.path)
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+        return mmap.mmap(self._fd, size)
+
+    def _bucket_offset(self, bucket):
+        return _PAGE + bucket * self.ways * self.slot_size
+
+    def _lock(self, bucket):
+        lock = self._thread_locks[bucket % len(self._thread_locks)]
+        lock.acquire()
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 1 + bucket)
+        except:
+            lock.release()
+            raise
+
+    def _unlock(self, bucket):
+        try:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + bucket)
+        finally:
+            self._thread_locks[bucket % len(self._thread_locks)].release()
+
+    def _read_slot(self, offset, bucket, locked=False):
+        '''
+        @summary:
+            seqlockでスロットを読み込み、(hash, kind, key, value, expiration_date)を返します
+            空きスロットの場合はNone
+        @param locked: bool: 呼び出し元がバケットのロックを取っているか
+        '''
+        mm = self._mm
+        for _ in xrange(_SPIN):
+            seq, h, kind, key_len, val_len, expiration_date = _SLOT.unpack_from(mm, offset)
+            if seq & 1:
+                continue
+            if h == 0:
+                slot = None
+            else:
+                start = offset + _SLOT.size
+                slot = (h, kind, mm[start:start + key_len],
+                        mm[start + key_len:start + key_len + val_len], expiration_date)
+            if _SEQ.unpack_from(mm, offset)[0] == seq:
+                return slot
+        # 書き込み中のプロセスが異常終了した可能性があるため、ロックを取って修復します
+        if not locked:
+            self._lock(bucket)
+        try:
+            seq = _SEQ.unpack_from(mm, offset)[0]
+            if seq & 1:
+                self._write_slot(offset, seq - 1, 0, 0, "", "", 0.0)
+        finally:
+            if not locked:
+                self._unlock(bucket)
+        return self._read_slot(offset, bucket, locked)
+
+    def _write_slot(self, offset, seq, h, kind, key, val, expiration_date):
+        '''
+        @summary:
+            ロックを取った状態でスロットを書き換えます
+            書き込み中はseqを奇数にし、読み込み側に再試行させます
+        '''
+        mm = self._mm
+        writing = (seq + 1) & 0xffffffff
+        _SEQ.pack_into(mm, offset, writing)
+        start = offset + _SLOT.size
+        mm[start:start + len(key) + len(val)] = key + val
+        _SLOT.pack_into(mm, offset, writing, h, kind, len(key), len(val), expiration_date)
+        _SEQ.pack_into(mm, offset, (seq + 2) & 0xffffffff)
+
+    def _locate(self, key):
+        kind, data = _encode_key(key)
+        h = _hash(kind, data)
+        return kind, data, h, (h >> 1) % self.buckets
+
+    def _find(self, kind, data, h, bucket, locked=False):
+        '''
+        @summary:
+            バケット内でキーが格納されているスロットの(offset, value, expiration_date)を返します
+        '''
+        base = self._bucket_offset(bucket)
+        for i in xrange(self.ways):
+            offset = base + i * self.slot_size
+            slot = self._read_slot(offset, bucket, locked)
+            if slot is not None and slot[0] == h and slot[1] == kind and slot[2] == data:
+                return offset, slot[3], slot[4]
+        return None
+
+    def __getitem__(self, key):
+        found = self._find(*self._locate(key))
+        if found is None:
+            raise KeyError(key)
+        return _CacheData(val=pickle.loads(found[1]), expiration_date=found[2])
+
+    peek = __getitem__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self._find(*self._locate(key)) is not None
+
+    def __setitem__(self, key, data):
+        kind, key_data, h, bucket = self._locate(key)
+        val = pickle.dumps(data.val, 2)
+        if _SLOT.size + len(key_data) + len(val) > self.slot_size:
+            # 格納できない値は古い値が残らないように削除します
+            self.oversize += 1
+            self.pop(key, None)
+            return
+        base = self._bucket_offset(bucket)
+        now = current_time()
+        self._lock(bucket)
+        try:
+            mm = self._mm
+            target = victim = None
+            for i in xrange(self.ways):
+                offset = base + i * self.slot_size
+                seq, sh, skind, key_len, _, expiration_date = _SLOT.unpack_from(mm, offset)
+                start = offset + _SLOT.size
+                if sh == h and skind == kind and mm[start:start + key_len] == key_data:
+                    target = offset
+                    break
+                if target is None and (sh == 0 or expiration_date <= now):
+                    target = offset
+                elif victim is None or expiration_date < victim[1]:
+                    victim = (offset, expiration_date)
+            if target is None:
+                target = victim[0]
+                self.evictions += 1
+            seq = _SEQ.unpack_from(mm, target)[0]
+            self._write_slot(target, seq & ~1, h, kind, key_data, val,
+                             data.expiration_date)
+        finally:
+            self._unlock(bucket)
+
+    def __delitem__(self, key):
+        kind, data, h, bucket = self._locate(key)
+        self._lock(bucket)
+        try:
+            found = self._find(kind, data, h, bucket, locked=True)
+            if found is None:
+                raise KeyError(key)
+            offset = found[0]
+            seq = _SEQ.unpack_from(self._mm, offset)[0]
+            self._write_slot(offset, seq & ~1, 0, 0, "", "", 0.0)
+        finally:
+            self._unlock(bucket)
+
+    def pop(self, key, *default):
+        try:
+            data = self[key]
+            del self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        return data
+
+    def iteritems(self):
+        '''
+        @summary:
+            格納されている(key, _CacheData)を列挙します (他のプロセスの更新と並行して走査します)
+        '''
+        for bucket in xrange(self.buckets):
+            base = self._bucket_offset(bucket)
+            for i in xrange(self.ways):
+                slot = self._read_slot(base + i * self.slot_size, bucket)
+                if slot is not None:
+                    yield _decode_key(slot[1], slot[2]), \
+                          _CacheData(val=pickle.loads(slot[3]), expiration_date=slot[4])
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return [key for key, _ in self.iteritems()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def update(self, other):
+        for key, data in other.items():
+            self[key] = data
+
+    def clear(self):
+        '''
+        @summary:
+            全てのスロットを空にします (他のプロセスにも反映されます)
+        '''
+        mm = self._mm
+        for bucket in xrange(self.buckets):
+            base = self._bucket_offset(bucket)
+            self._lock(bucket)
+            try:
+                for i in xrange(self.ways):
+                    offset = base + i * self.slot_size
+                    seq, h = _SLOT.unpack_from(mm, offset)[:2]
+                    if h != 0:
+                        self._write_slot(offset, seq & ~1, 0, 0, "", "", 0.0)
+            finally:
+                self._unlock(bucket)
+
+    def __len__(self):
+        mm = self._mm
+        count = 0
+        for slot in xrange(self.capacity):
+            if _SLOT.unpack_from(mm, _PAGE + slot * self.slot_size)[1] != 0:
+                count += 1
+        return count
+
+    def stats(self):
+        '''
+        @summary:
+            容量、使用中のスロット数、このプロセスでの追い出し数などをdictで返します
+        '''
+        return dict(capacity=self.capacity, slot_size=self.slot_size, ways=self.ways,
+                    used=len(self), evictions=self.evictions, oversize=self.oversize)
+
+    def close(self):
+        '''
+        @summary:
+            mmapとファイルを閉じます (共有ファイルは削除しません)
+        '''
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+            os.close(self._fd)
+
+    def unlink(self):
+        '''
+        @summary:
+            共有ファイルを削除します (開いているプロセスは引き続き利用できます)
+        '''
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
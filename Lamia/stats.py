@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+from Lamia.util import logger
+'''
+@summary:
+    キャッシュの階層(メモリ、ファイル)毎のヒット数、ミス数、処理時間などを集計するモジュール
+    集計は名前空間毎に行い、StatsObserverを登録すると各イベントを外部に通知します
+'''
+
+__all__ = ("Histogram", "NamespaceStats", "CacheStats", "StatsObserver",
+           "LoggingObserver")
+
+class Histogram(object):
+    '''
+    @summary:
+        処理時間のヒストグラム
+        バケットiは[2**(i-1), 2**i)マイクロ秒の範囲です(バケット0は1マイクロ秒未満)
+        記録はリストの要素の加算のみで、パーセンタイルはバケットの上限で近似します
+    '''
+    buckets = 32
+
+    def __init__(self):
+        self.counts = [0] * self.buckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        i = int(seconds * 1000000).bit_length()
+        if i >= self.buckets:
+            i = self.buckets - 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        '''
+        @summary:
+            p(0-100)パーセンタイルの処理時間(秒)を返します
+        '''
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min((1 << i) / 1000000.0, self.max)
+        return self.max
+
+    def snapshot(self):
+        '''
+        @summary:
+            集計値をdictで返します
+        '''
+        return dict(count=self.count,
+                    total=self.total,
+                    mean=self.total / self.count if self.count else 0.0,
+                    max=self.max,
+                    p50=self.percentile(50),
+                    p90=self.percentile(90),
+                    p99=self.percentile(99),
+                    buckets=list(self.counts))
+
+class StatsObserver(object):
+    '''
+    @summary:
+        集計のイベントを受け取るクラス
+        必要なメソッドのみを上書きして、Cache.add_observerで登録します
+        各メソッドは処理を行ったスレッドで同期的に呼ばれるため、重い処理は避けてください
+        tierは'memory'または'file'です(on_fetchのミスはNone)
+    '''
+    def on_fetch(self, namespace, tier, key, seconds):
+        pass
+
+    def on_store(self, namespace, tier, key, seconds):
+        pass
+
+    def on_expire(self, namespace, tier, key):
+        pass
+
+    def on_evict(self, namespace, key):
+        pass
+
+    def on_purge(self, namespace, tier, removed, seconds):
+        pass
+
+    def on_io(self, namespace, direction, size):
+        '''
+        @param direction: str: 'read'または'write'
+        @param size: int: ファイル層で読み書きしたbytes数
+        '''
+        pass
+
+class LoggingObserver(StatsObserver):
+    '''
+    @summary:
+        イベントをLamiaのloggerにDEBUGレベルで出力します
+    '''
+    def __init__(self, log=None):
+        self.log = log or logger
+
+    def on_fetch(self, namespace, tier, key, seconds):
+        self.log.debug("FETCH %s: %s %s (%.6fs)", tier or "MISS", namespace, key, seconds)
+
+    def on_store(self, namespace, tier, key, seconds):
+        self.log.debug("STORE %s: %s %s (%.6fs)", tier, namespace, key, seconds)
+
+    def on_expire(self, namespace, tier, key):
+        self.log.debug("EXPIRE %s: %s %s", tier, namespace, key)
+
+    def on_evict(self, namespace, key):
+        self.log.debug("EVICT: %s %s", namespace, key)
+
+    def on_purge(self, namespace, tier, removed, seconds):
+        self.log.debug("PURGE %s: %s %d (%.6fs)", tier, namespace, removed, seconds)
+
+class NamespaceStats(object):
+    '''
+    @summary:
+        1つの名前空間の集計値
+        カウンタはロックを取らずに加算するため、複数のスレッドから同時に
+        更新した場合はわずかに少なく数えることがあります
+    '''
+    counters = ('memory_hits', 'file_hits', 'misses', 'memory_expirations',
+                'file_expirations', 'evictions', 'file_evictions', 'memory_stores',
+                'file_stores',
+                'memory_purged', 'file_purged', 'promotions', 'bytes_read',
+                'bytes_written')
+
+    def __init__(self, namespace, observers):
+        '''
+        @param namespace: str: 名前空間
+        @param observers: list: StatsObserverのリスト(CacheStatsと共有します)
+        '''
+        self.namespace = namespace
+        self.observers = observers
+        self.reset()
+
+    def reset(self):
+        for name in self.counters:
+            setattr(self, name, 0)
+        self.latency = dict(((op, tier), Histogram())
+                            for op, tiers in (('fetch', ('memory', 'file', 'miss')),
+                                              ('store', ('memory', 'file')),
+                                              ('purge', ('memory', 'file')))
+                            for tier in tiers)
+
+    def _notify(self, event, *args):
+        for observer in self.observers:
+            try:
+                getattr(observer, event)(self.namespace, *args)
+            except Exception:
+                # 通知の失敗でキャッシュの処理は止めません
+                logger.exception("Observer %r failed on %s." % (observer, event))
+
+    def record_fetch(self, tier, key, seconds):
+        if tier == 'memory':
+            self.memory_hits += 1
+        elif tier == 'file':
+            self.file_hits += 1
+        else:
+            self.misses += 1
+        self.latency['fetch', tier or 'miss'].record(seconds)
+        if self.observers:
+            self._notify('on_fetch', tier, key, seconds)
+
+    def record_store(self, tier, key, seconds):
+        if tier == 'memory':
+            self.memory_stores += 1
+        else:
+            self.file_stores += 1
+        self.latency['store', tier].record(seconds)
+        if self.observers:
+            self._notify('on_store', tier, key, seconds)
+
+    def record_expire(self, tier, key):
+        if tier == 'memory':
+            self.memory_expirations += 1
+        else:
+            self.file_expirations += 1
+        if self.observers:
+            self._notify('on_expire', tier, key)
+
+    def record_evict(self, key, tier='memory'):
+        '''
+        @param tier: str: 'memory'(メモリ上の上限)または'file'(ファイル層の使用量の上限)
+        '''
+        if tier == 'memory':
+            self.evictions += 1
+        else:
+            self.file_evictions += 1
+        if self.observers:
+            self._notify('on_evict', key)
+
+    def record_purge(self, tier, removed, seconds):
+        if tier == 'memory':
+            self.memory_purged += removed
+        else:
+            self.file_purged += removed
+        self.latency['purge', tier].record(seconds)
+        if self.observers:
+            self._notify('on_purge', tier, removed, seconds)
+
+    def record_read(self, size):
+        self.bytes_read += size
+        if self.observers:
+            self._notify('on_io', 'read', size)
+
+    def record_write(self, size):
+        self.bytes_written += size
+        if self.observers:
+            self._notify('on_io', 'write', size)
+
+    @property
+    def hit_ratio(self):
+        '''
+        @summary:
+            メモリ層とファイル層を合わせたヒット率
+        '''
+        hits = self.memory_hits + self.file_hits
+        total = hits + self.misses
+        if not total:
+            return 0.0
+        return float(hits) / total
+
+    def snapshot(self):
+        '''
+        @summary:
+            集計値をdictで返します
+            latencyは'fetch.memory'などの名前で処理時間のヒストグラムを持ちます
+        '''
+        result = dict((name, getattr(self, name)) for name in self.counters)
+        result['hit_ratio'] = self.hit_ratio
+        result['latency'] = dict(("%s.%s" % name, histogram.snapshot())
+                                 for name, histogram in self.latency.iteritems())
+        return result
+
+class CacheStats(object):
+    '''
+    @summary:
+        名前空間毎のNamespaceStatsと、登録されたStatsObserverを保持するクラス
+    '''
+    def __init__(self, observers=None):
+        self.observers = list(observers or [])
+        self._namespaces = {}
+
+    def get(self, namespace):
+        '''
+        @summary:
+            名前空間の集計値を返します。無い場合は作成します
+        '''
+        try:
+            return self._namespaces[namespace]
+        except KeyError:
+            return self._namespaces.setdefault(
+                namespace, NamespaceStats(namespace, self.observers))
+
+    def add_observer(self, observer):
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    def remove_observer(self, observer):
+        try:
+            self.observers.remove(observer)
+        except ValueError:
+            pass
+
+    def namespaces(self):
+        return self._namespaces.keys()
+
+    def reset(self):
+        for stats in self._namespaces.values():
+            stats.reset()
+
+    def snapshot(self, namespace=None):
+        '''
+        @summary:
+            名前空間を指定した場合はその集計値を、省略した場合は
+            名前空間をキーとする全ての集計値のdictを返します
+        '''
+        if namespace is not None:
+            return self.get(namespace).snapshot()
+        return dict((name, stats.snapshot())
+                    for name, stats in self._namespaces.items())
@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import os
+import time
+import threading
+from Lamia.serialize import dump, load, load_header, load_mapped, LoadError, \
+                            dump_stream, open_stream
+from Lamia.layout import make_layout
+from Lamia.expiry import FileExpiryIndex
+from Lamia.bloom import CountingBloomFilter
+from Lamia.quota import DiskQuota
+'''
+@summary:
+    ファイル上のキャッシュ(ファイル層)の格納方式を提供するモジュール
+    格納方式はいずれも以下のインターフェースを持ちます
+        load(key, mmap_threshold=None) => _CacheData: 存在しない場合はKeyError
+        dump(key, data)
+        delete(key)
+        purge(date, max_items=None) => int: 削除した件数
+        clear()
+        close()
+    FileStorageは大きな値を断片毎に読み書きする以下のメソッドも持ちます
+        dump_stream(key, chunks, expiration_date)
+        open_stream(key) => Lamia.serialize.StreamReader: 存在しない場合はKeyError
+'''
+
+__all__ = ("FileStorage", "make_storage")
+
+class FileStorage(object):
+    '''
+    @summary:
+        1キーにつき1ファイルとして名前空間のディレクトリに格納する方式
+    '''
+    name = 'file'
+
+    # 存在しないと判定する前に、他のプロセスの書き込みを確認する間隔(秒)
+    filter_refresh = 1.0
+    # 使用量に他のプロセスの書き込み、削除を反映する間隔(秒)
+    quota_refresh = 1.0
+    # Lamia.stats.NamespaceStats: 指定した場合は読み書きしたbytes数を記録します
+    stats = None
+
+    def __init__(self, cache_dir, layout='flat', mode=0700, codec='pickle',
+                 compressor=None, negative_filter=None, max_disk_bytes=None,
+                 disk_eviction='lru'):
+        '''
+        @param cache_dir: str: 名前空間のディレクトリ
+        @param layout: str: キャッシュファイルの配置 'flat', 'sharded'
+        @param mode: int: ディレクトリの作成パーミッション
+        @param codec: str: 値の変換方式 'raw', 'pickle', 'marshal', 'json'
+        @param compressor: Lamia.compress.Compressor: 値の圧縮方式
+        @param negative_filter: bool or int: 真の場合、ファイルの存在をメモリ上の
+                                Bloom filterで判定し、確実に存在しないキーはファイルを開きません
+                                intの場合は想定するファイル数です
+        @param max_disk_bytes: int: 名前空間のファイルの合計サイズの上限(bytes)
+                               超えた場合はdisk_evictionの順にファイルを削除します
+        @param disk_eviction: str: 削除するファイルの選び方
+                              'lru'(最も長く読み書きされていないファイル),
+                              'expiry'(最も早く期限切れになるファイル)
+        '''
+        self.cache_dir = cache_dir
+        self.layout = make_layout(layout)
+        self.mode = mode
+        self.codec = codec
+        self.compressor = compressor
+        self.expiry_index = FileExpiryIndex(cache_dir)
+        if self.expiry_index.needs_rebuild:
+            # キャッシュファイルが無ければ作り直す必要はありません
+            for _ in self.layout.iter_paths(cache_dir):
+                break
+            else:
+                self.expiry_index.needs_rebuild = False
+        self.negative_filter = None
+        self._init_quota(max_disk_bytes, disk_eviction)
+        self._init_negative_filter(negative_filter)
+
+    def _init_quota(self, max_disk_bytes, disk_eviction):
+        '''
+        @summary:
+            init self.quota: 名前空間の使用量 (上限が無い場合はNone)
+            起動時に有効期限のジャーナルから作成し(ジャーナルが無い場合のみ全ファイルを走査します)、
+            以降は書き込み、削除とジャーナルに追記された他のプロセスの書き込み、削除で更新します
+        '''
+        self.quota = None
+        if not max_disk_bytes:
+            return
+        self.quota = DiskQuota(max_disk_bytes, disk_eviction)
+        self._quota_synced = time.time()
+        if self.expiry_index.needs_rebuild:
+            self.rebuild_expiry_index()
+        else:
+            self.expiry_index.sync()
+            self.quota.reset(self.expiry_index.items())
+        self.expiry_index.on_record = self._on_record
+        self._evict()
+
+    def _init_negative_filter(self, negative_filter):
+        '''
+        @summary:
+            init self.negative_filter: 名前空間内のファイルの相対パスのBloom filter
+            起動時にディレクトリを走査して作成し、以降は書き込み、削除と
+            有効期限のジャーナルに追記された他のプロセスの書き込みで更新します
+        '''
+        if not negative_filter:
+            return
+        self._filter_lock = threading.Lock()
+        self._filter_synced = time.time()
+        # ジャーナルの既存のレコードは走査の結果に含まれるため、先に読み込んでおきます
+        self.expiry_index.sync()
+        relpaths = [self._relpath(path) for path in self.layout.iter_paths(self.cache_dir)]
+        if negative_filter is True:
+            capacity = max(100000, 2 * len(relpaths))
+        else:
+            capacity = max(int(negative_filter), 2 * len(relpaths))
+        self.negative_filter = CountingBloomFilter(capacity)
+        for relpath in relpaths:
+            self.negative_filter.add(relpath)
+        self.expiry_index.on_record = self._on_record
+
+    def _filter_add(self, relpath):
+        with self._filter_lock:
+            self.negative_filter.add(relpath)
+
+    def _on_record(self, relpath, expiration_date, size, known):
+        '''
+        @summary:
+            他のインスタンスやプロセスの書き込み、削除をfilterと使用量に反映します
+            既にインデックスにあったファイルの上書きはfilterに追加し直しません
+        '''
+        if expiration_date is None:
+            if self.quota is not None:
+                self.quota.discard(relpath)
+            return
+        if self.negative_filter is not None and not known:
+            self._filter_add(relpath)
+        if self.quota is not None:
+            self.quota.add(relpath, size, expiration_date)
+
+    def _may_exist(self, path):
+        '''
+        @summary:
+            ファイルが存在する可能性があれば真を返します
+            偽の場合でも、前回の確認からfilter_refresh秒以上経っていれば
+            他のプロセスの書き込みを読み込んで判定し直します
+        '''
+        relpath = self._relpath(path)
+        if relpath in self.negative_filter:
+            return True
+        now = time.time()
+        if now - self._filter_synced < self.filter_refresh:
+            return False
+        self._filter_synced = now
+        self.expiry_index.sync()
+        return relpath in self.negative_filter
+
+    def build_path(self, key, create=False):
+        '''
+        @summary:
+            キーに対応するキャッシュファイルのパスを返します
+            createが真の場合は親ディレクトリを用意します
+        '''
+        path = self.layout.build_path(self.cache_dir, key)
+        if create:
+            self.layout.ensure_dir(path, self.mode)
+        return path
+
+    def load(self, key, mmap_threshold=None):
+        '''
+        @summary:
+            キーに対応するデータを読み込みます
+            mmap_thresholdを指定した場合、それ以上のサイズの'raw'の値は
+            mmapしたファイルへのビューとして返します
+        '''
+        path = self.build_path(key)
+        if self.negative_filter is not None and not self._may_exist(path):
+            raise KeyError(key)
+        try:
+            if mmap_threshold is not None:
+                data, size = load_mapped(path, mmap_threshold, self.compressor, True)
+            else:
+                data, size = load(path, self.compressor, True)
+        except (IOError, OSError):
+            # if not exists file
+            raise KeyError(key)
+        if self.stats is not None:
+            self.stats.record_read(size)
+        if self.quota is not None:
+            self.quota.touch(self._relpath(path))
+        return data
+
+    def dump(self, key, data):
+        '''
+        @summary:
+            キーに対応するファイルにデータを書き出します
+        '''
+        path = self.build_path(key, create=True)
+        existed = self._existed(path)
+        size = dump(data, path, self.codec, self.compressor)
+        self._written(path, size, data.expiration_date, existed)
+
+    def dump_stream(self, key, chunks, expiration_date):
+        '''
+        @summary:
+            strの断片を順にキーに対応するファイルに書き出します
+            値は圧縮せず'raw'として格納します
+        '''
+        path = self.build_path(key, create=True)
+        existed = self._existed(path)
+        size = dump_stream(chunks, path, expiration_date)
+        self._written(path, size, expiration_date, existed)
+
+    def open_stream(self, key):
+        '''
+        @summary:
+            キーに対応するファイルの値を読み込むStreamReaderを返します
+        '''
+        path = self.build_path(key)
+        if self.negative_filter is not None and not self._may_exist(path):
+            raise KeyError(key)
+        try:
+            reader = open_stream(path, self.compressor)
+        except (IOError, OSError):
+            raise KeyError(key)
+        if self.stats is not None:
+            self.stats.record_read(reader.length)
+        if self.quota is not None:
+            self.quota.touch(self._relpath(path))
+        return reader
+
+    def _existed(self, path):
+        '''
+        @summary:
+            Bloom filterを使う場合、書き出す前にファイルが存在するかを返します
+            (上書きしたファイルをfilterに重ねて追加し、カウンタが飽和しないようにします)
+        '''
+        return self.negative_filter is not None and os.path.exists(path)
+
+    def _written(self, path, size, expiration_date, existed=False):
+        '''
+        @summary:
+            書き出したファイルを集計、Bloom filter、有効期限のインデックスと使用量に反映します
+        @param existed: bool: 既存のファイルを上書きした場合は真 (filterには追加済みです)
+        '''
+        if self.stats is not None:
+            self.stats.record_write(size)
+        relpath = self._relpath(path)
+        if self.negative_filter is not None and not existed:
+            self._filter_add(relpath)
+        self.expiry_index.add(relpath, expiration_date, size)
+        if self.quota is not None:
+            now = time.time()
+            if now - self._quota_synced >= self.quota_refresh:
+                self._quota_synced = now
+                self.expiry_index.sync()
+            self.quota.add(relpath, size, expiration_date)
+            self._evict()
+
+    def _evict(self):
+        '''
+        @summary:
+            使用量が上限以下になるまで、quotaが選んだファイルを削除します
+            他のプロセスが削除済みのファイルは使用量から除くのみです
+        @return: int: 削除したファイル数
+        '''
+        evicted = 0
+        while True:
+            relpath = self.quota.pop_victim()
+            if relpath is None:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, relpath))
+            except OSError:
+                continue
+            evicted += 1
+            self._forget(relpath)
+            if self.stats is not None:
+                self.stats.record_evict(relpath, 'file')
+        return evicted
+
+    def disk_usage(self):
+        '''
+        @summary:
+            名前空間の使用量をdictで返します。上限が無い場合はNone
+        '''
+        if self.quota is None:
+            return None
+        return self.quota.snapshot()
+
+    def _relpath(self, path):
+        return path[len(self.cache_dir):].lstrip(os.sep)
+
+    def delete(self, key):
+        '''
+        @summary:
+            キーに対応するファイルを削除します
+        '''
+        if not self._remove(self.build_path(key), synced=False):
+            raise KeyError(key)
+
+    def _check_dir(self):
+        if not os.path.isdir(self.cache_dir):
+            raise IOError("%s is not directory." % self.cache_dir)
+
+    def purge(self, date, max_items=None):
+        '''
+        @summary:
+            期限切れのキャッシュファイルを削除します
+            有効期限のインデックスから期限切れのファイルのみを取り出し、
+            削除の直前にヘッダを確認します
+            インデックスが無い既存の名前空間では、初回のみ全ファイルから作り直します
+        @param max_items: int: 指定した場合はその件数を確認した時点で中断します
+        @return: int: 削除した件数
+        '''
+        self._check_dir()
+        if self.expiry_index.needs_rebuild:
+            self.rebuild_expiry_index()
+        removed = 0
+        for relpath, _ in self.expiry_index.pop_expired(date, max_items):
+            path = os.path.join(self.cache_dir, relpath)
+            try:
+                expiration_date = load_header(path)
+            except (IOError, OSError):
+                # 削除済み
+                continue
+            except LoadError:
+                expiration_date = None
+            if expiration_date is not None and expiration_date > date:
+                self.expiry_index.add(relpath, expiration_date, os.path.getsize(path))
+            elif self._remove(path):
+                removed += 1
+                #logger.debug("PURGE FILE: %s" % path)
+        return removed
+
+    def _remove(self, path, synced=True):
+        '''
+        @summary:
+            ファイルを削除し、Bloom filterと使用量から取り除きます
+        @param synced: bool: 有効期限のジャーナルを読み込み済みか
+                             (他のプロセスが書き出したファイルをfilterや使用量に
+                             追加する前に取り除かないようにします)
+        '''
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        if not synced and (self.negative_filter is not None or self.quota is not None):
+            self.expiry_index.sync()
+        self._forget(self._relpath(path))
+        return True
+
+    def _forget(self, relpath):
+        '''
+        @summary:
+            削除したファイルをBloom filterと使用量から取り除きます
+            使用量を管理している場合は、他のプロセスのために削除をジャーナルに記録します
+        '''
+        if self.negative_filter is not None:
+            with self._filter_lock:
+                self.negative_filter.discard(relpath)
+        if self.quota is not None:
+            self.quota.discard(relpath)
+            self.expiry_index.remove(relpath)
+
+    def check_file(self, path, date):
+        '''
+        @summary:
+            キャッシュファイルのヘッダを確認し、期限切れまたは不正なスタイルの場合は削除します
+            インデックスを経由しない掃除(Lamia.janitor)に使用します
+        @return: bool: 削除した場合は真
+        '''
+        try:
+            if load_header(path) > date:
+                return False
+        except (IOError, OSError):
+            return False
+        except LoadError:
+            pass
+        return self._remove(path, synced=False)
+
+    def rebuild_expiry_index(self):
+        '''
+        @summary:
+            全てのキャッシュファイルのヘッダから有効期限のインデックスを作り直します
+            不正なスタイルのキャッシュファイルは削除します
+        @return: int: インデックスに登録したファイル数
+        '''
+        self._check_dir()
+        items = []
+        for path in self.layout.iter_paths(self.cache_dir):
+            try:
+                items.append((self._relpath(path), load_header(path),
+                              os.path.getsize(path)))
+            except (IOError, OSError):
+                continue
+            except LoadError:
+                self._remove(path, synced=False)
+                #logger.debug("PURGE FILE: %s" % path)
+        self.expiry_index.reset(items)
+        if self.quota is not None:
+            self.quota.reset(items)
+        return len(items)
+
+    def clear(self):
+        '''
+        @summary:
+            名前空間のキャッシュファイルを全て削除します
+        '''
+        self._check_dir()
+        for path in list(self.layout.iter_paths(self.cache_dir)):
+            os.remove(path)
+        self.expiry_index.reset([])
+        if self.quota is not None:
+            self.quota.reset([])
+        if self.negative_filter is not None:
+            with self._filter_lock:
+                self.negative_filter.clear()
+
+    def close(self):
+        self.expiry_index.close()
+
+def make_storage(storage, cache_dir, layout='flat', mode=0700, codec='pickle',
+                 compressor=None, **options):
+    '''
+    @summary:
+        格納方式の名前からファイル層の格納方式を作成します
+    @param storage: str: 'file'(1キー1ファイル)または'log'(追記型のセグメントファイル)
+    '''
+    if storage == 'file':
+        return FileStorage(cache_dir, layout, mode, codec, compressor, **options)
+    if storage == 'log':
+        from Lamia.logstore import LogStorage
+        return LogStorage(cache_dir, mode=mode, codec=codec, compressor=compressor,
+                          **options)
+    raise ValueError("Unknown storage '%s'." % storage)
@@ -10,18 +10,20 @@ from hashlib import sha1
 import inspect
 import time
 import os
+import stat
 import logging
 import os.path as _op
 
 logger = None
 def set_logger():
+    '''
+    @summary:
+        Lamiaのloggerを用意します
+        ライブラリとしてroot loggerの設定は変更せず、出力先はアプリケーションが設定します
+    '''
     global logger
-    logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s %(levelname)s (%(threadName)-2s) %(message)s',
-                    #filename='/tmp/lamia.log',
-                    #filemode='w'
-                    )
-    logger = logging.getLogger("server")
+    logger = logging.getLogger("Lamia")
+    logger.addHandler(logging.NullHandler())
     
 def setup():
     if logger is None:
@@ -73,13 +75,33 @@ def make_cache_dir(cache_root, namespace, mode):
     @summary: 
         ディレクトリが存在しない場合はキャッシュディレクトリを作成し、
         ディレクトリパスを返します
+        キャッシュファイルはpickleなどで復元するため、他のユーザーが所有する、
+        またはmodeで許可していないユーザーが書き込めるディレクトリはOSError
     '''
     path = _op.join(cache_root, namespace)
     if not _op.isdir(path):
         if _op.exists(path):
             raise OSError("%s is not directory." % path)
         os.makedirs(path, mode)
+    _check_dir_owner(cache_root, mode, True)
+    _check_dir_owner(path, mode, False)
     return path
+
+def _check_dir_owner(path, mode, is_root):
+    '''
+    @summary:
+        ディレクトリが実行ユーザーの所有で、modeで許可していない書き込み権限を持たないことを確認します
+        rootのディレクトリ(cache_root)はrootユーザーの所有も許可し、
+        sticky bitがある場合は他のユーザーの書き込み権限も許可します
+        (他のユーザーが名前空間のディレクトリを置き換えられないため)
+    '''
+    st = os.stat(path)
+    owners = (os.getuid(), 0) if is_root else (os.getuid(),)
+    writable = st.st_mode & 0022 & ~mode
+    if is_root and st.st_mode & stat.S_ISVTX:
+        writable = 0
+    if st.st_uid not in owners or writable:
+        raise OSError("%s is owned by another user or writable by others." % path)
     
 def get_abs_dir_path(dir):
     ''' 
@@ -92,36 +114,93 @@ def get_abs_dir_path(dir):
         raise OSError("%s is not directory." % path)
     return path
 
-_key_func_tpl = "%(module_name)s::%(func_name)s(%(arguments)s)"
+def get_func_prefix(func):
+    '''
+    @summary: 
+        関数のキーの接頭辞("モジュールのファイル名::関数名")を返します
+        cache_decoratorはデコレート時に1回だけ計算します
+    '''
+    return "%s::%s" % (_op.basename(inspect.getfile(func)), func.func_name)
 
 def get_func_key(func, *args, **kw):
     '''
     @summary: 
         指定した関数と引数からキーを生成します
+        キーワード引数は名前順に並べるため、指定した順序に依りません
     '''
-    try:
-        arguments = sha1("%s%s" % (str(args), str(kw))).hexdigest()
-        module_name = _op.basename(inspect.getfile(func))
-    except Exception:
-        # pickle error
-        raise
-    else:
-        return _key_func_tpl % dict(
-                    module_name=module_name,     
-                    func_name=func.func_name,
-                    arguments=arguments
-                )
+    return FuncKey(get_func_prefix(func), args,
+                   tuple(sorted(kw.iteritems())) if kw else ()).file_key()
 
-class _CacheData():
+def make_file_key(key):
+    '''
+    @summary: 
+        ファイル層(とキャッシュサーバ)で使用する文字列のキーを返します
+        cache_decoratorのFuncKeyは書き出し、読み込みの時点で初めて文字列にします
+        それ以外の文字列でないキーはreprのハッシュ値にします
+    '''
+    if isinstance(key, basestring):
+        return key
+    if isinstance(key, FuncKey):
+        return key.file_key()
+    return "key::%s" % sha1(repr(key)).hexdigest()
+
+def _type_key(values):
+    '''
+    @summary:
+        値の型のtupleを返します (tupleの値は要素の型を再帰的に含めます)
+    '''
+    types = tuple(map(type, values))
+    if tuple in types:
+        types = tuple(_type_key(value) if t is tuple else t
+                      for value, t in zip(values, types))
+    return types
+
+class FuncKey(tuple):
+    '''
+    @summary:
+        cache_decoratorがメモリ上のキャッシュに使用するキー
+        (接頭辞, 位置引数, 名前順のキーワード引数, 引数の型)のtupleで、引数がhash可能な場合は
+        文字列に変換せずにそのままメモリ上のキーにします
+        1 == 1.0 == Trueのように等しい値でもファイル上のキーは異なるため、
+        引数の型を含めてメモリ上のキーとファイル上のキーを一致させます
+        ファイル上のキャッシュにはfile_key()の文字列を使用します
+    '''
+    __slots__ = ()
+
+    def __new__(cls, prefix, args, kw_items):
+        types = _type_key(args)
+        if kw_items:
+            types += _type_key([val for _, val in kw_items])
+        return tuple.__new__(cls, (prefix, args, kw_items, types))
+
+    def file_key(self):
+        '''
+        @summary:
+            get_func_keyと同じ形式の文字列のキーを返します
+            キーワード引数はstr(dict)と同じ形式で名前順に並べます
+        '''
+        prefix, args, kw_items = self[:3]
+        kw = "{%s}" % ", ".join("%r: %r" % item for item in kw_items)
+        return "%s(%s)" % (prefix, sha1("%s%s" % (str(args), kw)).hexdigest())
+
+class _CacheData(object):
     '''
     @summary:
         メモリ上のキャッシュクラス
+        新スタイルのクラスのため__slots__が有効で、インスタンス毎のdictを持ちません
     '''
     __slots__ = ['val', 'expiration_date']
     
     def __init__(self, val, expiration_date):
         self.val = val
         self.expiration_date = expiration_date
+    
+    def __getstate__(self):
+        # __slots__のみのクラスを全てのpickleのプロトコルで変換できるようにします
+        return (self.val, self.expiration_date)
+    
+    def __setstate__(self, state):
+        self.val, self.expiration_date = state
 
 class ExpiredError(Exception):
     '''
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+'''
+@summary:
+    Lamiaの主要な処理の性能を計測するベンチマーク
+    python -m benchmarks run -o result.json
+    python -m benchmarks compare base.json result.json
+'''
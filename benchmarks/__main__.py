@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import sys
+import argparse
+from benchmarks.runner import run, compare, load_result, save_result
+from benchmarks.workloads import WORKLOADS
+'''
+@summary:
+    python -m benchmarks run [-o result.json] [options]
+    python -m benchmarks compare base.json new.json [--threshold 0.1]
+    python -m benchmarks list
+'''
+
+def _sizes(value):
+    return [int(n) for n in value.split(',') if n]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks",
+                                     description="Lamia benchmark suite")
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('run', help="run workloads")
+    p.add_argument('patterns', nargs='*', help="run only workloads whose name contains one of these")
+    p.add_argument('-o', '--output', help="write the result as JSON")
+    p.add_argument('-n', '--count', type=int, default=10000, help="operations per measurement")
+    p.add_argument('-r', '--repeat', type=int, default=3)
+    p.add_argument('--key-size', default="16", help="'64', '16-256' or 'lognormal:MEDIAN:SIGMA'")
+    p.add_argument('--value-size', default="128", help="'64', '16-256' or 'lognormal:MEDIAN:SIGMA'")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--purge-sizes', type=_sizes, default=[10000],
+                   help="comma separated file counts, e.g. 10000,100000,1000000")
+    p.add_argument('--save-sizes', type=_sizes, default=[100000],
+                   help="comma separated memory tier sizes")
+    p.add_argument('--expired-ratio', type=float, default=0.1)
+    p.add_argument('--layout', default=None, help="cache layout ('flat', 'sharded')")
+    p.add_argument('--storage', default=None, help="file tier storage ('file', 'log')")
+    p.add_argument('--root', default=None, help="cache root (a temporary directory by default)")
+    p.add_argument('--quick', action='store_true', help="small sizes for a smoke run")
+
+    p = commands.add_parser('compare', help="compare two results")
+    p.add_argument('base')
+    p.add_argument('new')
+    p.add_argument('-t', '--threshold', type=float, default=0.1,
+                   help="relative slowdown reported as a regression")
+
+    commands.add_parser('list', help="list workloads")
+
+    args = parser.parse_args(argv)
+    if args.command == 'list':
+        for name in WORKLOADS:
+            print name
+        return 0
+    if args.command == 'compare':
+        rows = compare(load_result(args.base), load_result(args.new), args.threshold)
+        print "%-20s %12s %12s %8s" % ("workload", "base us/op", "new us/op", "ratio")
+        for name, before, after, ratio, status in rows:
+            print "%-20s %12.3f %12.3f %8.3f %s" % (
+                name, before, after, ratio, '' if status == 'ok' else status.upper())
+        return 1 if any(row[4] == 'regression' for row in rows) else 0
+
+    if args.quick:
+        args.count = min(args.count, 1000)
+        args.purge_sizes = [min(n, 1000) for n in args.purge_sizes]
+        args.save_sizes = [min(n, 1000) for n in args.save_sizes]
+    cache_options = {}
+    if args.layout:
+        cache_options['layout'] = args.layout
+    if args.storage:
+        cache_options['storage'] = args.storage
+    result = run(args.patterns, args.count, args.repeat, args.key_size, args.value_size,
+                 args.seed, args.purge_sizes, args.save_sizes, args.expired_ratio,
+                 args.root, cache_options, out=sys.stdout)
+    if args.output:
+        save_result(result, args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
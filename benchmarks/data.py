@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import math
+import random
+import string
+'''
+@summary:
+    ベンチマークで使用するキーと値を生成するモジュール
+    同じseedからは常に同じキーと値を生成します
+'''
+
+__all__ = ("SizeDistribution", "DataGenerator")
+
+_alphabet = string.ascii_letters + string.digits
+
+class SizeDistribution(object):
+    '''
+    @summary:
+        キーや値のサイズ(bytes)の分布
+        以下の形式の文字列から作成します
+            "64": 固定
+            "16-256": 一様分布
+            "lognormal:1024:1.0": 中央値1024、sigma 1.0の対数正規分布
+    '''
+    def __init__(self, spec):
+        self.spec = spec
+        spec = str(spec)
+        try:
+            if spec.startswith('lognormal:'):
+                _, median, sigma = spec.split(':')
+                self.kind = 'lognormal'
+                self.params = (math.log(float(median)), float(sigma))
+            elif '-' in spec:
+                low, high = spec.split('-')
+                self.kind = 'uniform'
+                self.params = (int(low), int(high))
+            else:
+                self.kind = 'fixed'
+                self.params = (int(spec),)
+        except ValueError:
+            raise ValueError("Invalid size distribution '%s'." % spec)
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return rng.randint(*self.params)
+        return max(1, int(rng.lognormvariate(*self.params)))
+
+    def __repr__(self):
+        return "SizeDistribution(%r)" % self.spec
+
+class DataGenerator(object):
+    '''
+    @summary:
+        キーと値の組を生成するクラス
+        キーはファイル名に使える英数字のみで構成します
+    '''
+    def __init__(self, key_size="16", value_size="128", seed=0):
+        '''
+        @param key_size: str: キーのサイズの分布
+        @param value_size: str: 値のサイズの分布
+        @param seed: int: 乱数のseed
+        '''
+        self.key_size = SizeDistribution(key_size)
+        self.value_size = SizeDistribution(value_size)
+        self.seed = seed
+        rng = random.Random(seed)
+        # 値は乱数の文字列の一部を切り出して作ります
+        self._blob = ''.join(rng.choice(_alphabet) for _ in xrange(64 * 1024))
+
+    def _value(self, rng, size):
+        blob = self._blob
+        if size <= len(blob):
+            start = rng.randint(0, len(blob) - size)
+            return blob[start:start + size]
+        return (blob * (size // len(blob) + 1))[:size]
+
+    def items(self, count, prefix=''):
+        '''
+        @summary:
+            count個の(key, value)のリストを返します
+            キーは重複しません
+        '''
+        rng = random.Random("%s:%s" % (self.seed, prefix))
+        items = []
+        for i in xrange(count):
+            size = max(1, self.key_size.sample(rng))
+            # 連番の前に区切りを入れて重複を避けます
+            suffix = "_%s%x" % (prefix, i)
+            key = ''.join(rng.choice(_alphabet) for _ in xrange(max(0, size - len(suffix))))
+            items.append((key + suffix, self._value(rng, self.value_size.sample(rng))))
+        return items
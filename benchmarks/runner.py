@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from Lamia.cache import Cache
+from benchmarks.data import DataGenerator
+from benchmarks.workloads import select
+'''
+@summary:
+    workloadを実行して結果をJSONで記録し、2つの結果を比較するモジュール
+'''
+
+__all__ = ("Context", "run", "compare", "load_result", "save_result")
+
+class Context(object):
+    '''
+    @summary:
+        workloadに渡す設定と、作成したキャッシュの後片付けを行うクラス
+        キャッシュは一時ディレクトリの下に作成します
+    '''
+    def __init__(self, root, generator, count=10000, expired_ratio=0.1,
+                 cache_options=None):
+        self.root = root
+        self.generator = generator
+        self.count = count
+        self.expired_ratio = expired_ratio
+        self.cache_options = cache_options or {}
+        self._caches = []
+
+    def make_cache(self, **options):
+        kw = dict(self.cache_options)
+        kw.update(options)
+        cache = Cache(cache_root=self.root, default_expires=3600,
+                      namespace="bench-%d" % len(self._caches), cache=dict(), **kw)
+        self._caches.append(cache)
+        return cache
+
+    def items(self, count=None, prefix=''):
+        return self.generator.items(self.count if count is None else count, prefix)
+
+    def cleanup(self):
+        for cache in self._caches:
+            cache.close()
+            shutil.rmtree(cache.cache_dir, ignore_errors=True)
+        self._caches = []
+
+def _median(values):
+    values = sorted(values)
+    n = len(values)
+    if n % 2:
+        return values[n // 2]
+    return (values[n // 2 - 1] + values[n // 2]) / 2.0
+
+def measure(factory, ctx, repeat=3):
+    '''
+    @summary:
+        workloadをrepeat回計測し、件数と各回の処理時間を返します
+        計測中はGCを止めます
+    '''
+    bench = factory(ctx)
+    if isinstance(bench, tuple):
+        before, run = bench
+    else:
+        before, run = None, bench
+    times = []
+    ops = 0
+    for _ in xrange(repeat):
+        if before is not None:
+            before()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.time()
+            ops = run()
+            times.append(time.time() - start)
+        finally:
+            gc.enable()
+    return ops, times
+
+def _git_revision():
+    try:
+        devnull = open(os.devnull, 'w')
+        try:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+        finally:
+            devnull.close()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(patterns=None, count=10000, repeat=3, key_size="16", value_size="128",
+        seed=0, purge_sizes=(10000,), save_sizes=(100000,), expired_ratio=0.1,
+        root=None, cache_options=None, out=None):
+    '''
+    @summary:
+        workloadを実行して結果のdictを返します
+    @param patterns: list: 指定した場合は名前にいずれかを含むworkloadのみ実行します
+    @param count: int: 1回の計測で処理する件数
+    @param key_size: str: キーのサイズの分布 (benchmarks.data.SizeDistribution)
+    @param value_size: str: 値のサイズの分布
+    @param purge_sizes: list: purge_fileを計測するファイル数
+    @param save_sizes: list: saveを計測するメモリ上のエントリ数
+    @param out: file: 指定した場合は各workloadの結果を出力します
+    '''
+    generator = DataGenerator(key_size, value_size, seed)
+    own_root = root is None
+    if own_root:
+        root = tempfile.mkdtemp(prefix="lamia-bench-")
+    results = {}
+    try:
+        for name, factory in select(patterns, purge_sizes, save_sizes):
+            ctx = Context(root, generator, count, expired_ratio, cache_options)
+            try:
+                ops, times = measure(factory, ctx, repeat)
+            finally:
+                ctx.cleanup()
+            median = _median(times)
+            results[name] = dict(ops=ops, times=times, best=min(times), median=median,
+                                 us_per_op=median / ops * 1e6 if ops else 0.0,
+                                 ops_per_sec=ops / median if median else 0.0)
+            if out is not None:
+                out.write("%-20s %10d ops %12.3f us/op %14.1f ops/s\n" % (
+                    name, ops, results[name]['us_per_op'], results[name]['ops_per_sec']))
+                out.flush()
+    finally:
+        if own_root:
+            shutil.rmtree(root, ignore_errors=True)
+    meta = dict(time=time.time(),
+                python=sys.version.split()[0],
+                implementation=platform.python_implementation(),
+                platform=platform.platform(),
+                revision=_git_revision(),
+                options=dict(count=count, repeat=repeat, key_size=key_size,
+                             value_size=value_size, seed=seed,
+                             purge_sizes=list(purge_sizes), save_sizes=list(save_sizes),
+                             expired_ratio=expired_ratio,
+                             cache_options=cache_options or {}))
+    return dict(meta=meta, results=results)
+
+def save_result(result, path):
+    with open(path, 'w') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+def load_result(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare(base, new, threshold=0.1):
+    '''
+    @summary:
+        2つの結果の1件あたりの処理時間(中央値)を比較します
+        newがbaseより(1 + threshold)倍以上遅いworkloadを'regression'、
+        1 / (1 + threshold)倍以下の場合を'improvement'とします
+    @return: list: (名前, baseのus/op, newのus/op, 比率, 判定)のリスト
+    '''
+    rows = []
+    base_results = base['results']
+    new_results = new['results']
+    for name in sorted(set(base_results) & set(new_results)):
+        before = base_results[name]['us_per_op']
+        after = new_results[name]['us_per_op']
+        ratio = after / before if before else 1.0
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 / (1 + threshold):
+            status = 'improvement'
+        else:
+            status = 'ok'
+        rows.append((name, before, after, ratio, status))
+    return rows
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+# Lamia
+# Copyright 2011-2012 Jun Kimura
+# LICENSE MIT
+from collections import OrderedDict
+from Lamia.util import get_func_key
+'''
+@summary:
+    ベンチマークの処理(workload)を定義するモジュール
+    各workloadは準備を行い、計測する関数run(またはbefore, runの組)を返します
+    runは処理した件数を返し、beforeは計測の前に毎回呼ばれます
+'''
+
+__all__ = ("WORKLOADS", "workload", "select")
+
+WORKLOADS = OrderedDict()
+
+def workload(name):
+    '''
+    @summary:
+        workloadを登録するデコレータ
+    '''
+    def _register(func):
+        WORKLOADS[name] = func
+        return func
+    return _register
+
+def select(patterns=None, purge_sizes=(), save_sizes=()):
+    '''
+    @summary:
+        実行する(名前, workload)のリストを返します
+        purge_file, saveはファイル数、エントリ数毎に別のworkloadになります
+    @param patterns: list: 指定した場合は名前にいずれかを含むworkloadのみ
+    '''
+    selected = []
+    for name, func in WORKLOADS.items():
+        if name == 'purge_file':
+            selected.extend(("purge_file.%d" % n, _sized(func, n)) for n in purge_sizes)
+        elif name == 'save':
+            selected.extend(("save.%d" % n, _sized(func, n)) for n in save_sizes)
+        else:
+            selected.append((name, func))
+    if patterns:
+        selected = [(name, func) for name, func in selected
+                    if any(pattern in name for pattern in patterns)]
+    return selected
+
+def _sized(func, size):
+    return lambda ctx: func(ctx, size)
+
+@workload('fetch.memory')
+def fetch_memory(ctx):
+    cache = ctx.make_cache()
+    items = ctx.items()
+    for key, val in items:
+        cache.store(key, val, is_store_file=False)
+    keys = [key for key, _ in items]
+    def run():
+        fetch = cache.fetch
+        for key in keys:
+            fetch(key)
+        return len(keys)
+    return run
+
+@workload('fetch.file')
+def fetch_file(ctx):
+    cache = ctx.make_cache()
+    items = ctx.items()
+    for key, val in items:
+        cache.store(key, val)
+    keys = [key for key, _ in items]
+    def run():
+        fetch = cache.fetch
+        for key in keys:
+            fetch(key)
+        return len(keys)
+    # 毎回メモリ上のキャッシュを空にして、ファイルから読み込みます
+    return cache._clear_cache_memory, run
+
+@workload('fetch.miss')
+def fetch_miss(ctx):
+    cache = ctx.make_cache()
+    keys = [key for key, _ in ctx.items()]
+    def run():
+        get = cache.get
+        for key in keys:
+            get(key)
+        return len(keys)
+    return run
+
+@workload('store.memory')
+def store_memory(ctx):
+    cache = ctx.make_cache()
+    items = ctx.items()
+    def run():
+        store = cache.store
+        for key, val in items:
+            store(key, val, is_store_file=False)
+        return len(items)
+    return run
+
+@workload('store.file')
+def store_file(ctx):
+    cache = ctx.make_cache()
+    items = ctx.items()
+    def run():
+        store = cache.store
+        for key, val in items:
+            store(key, val)
+        return len(items)
+    return run
+
+@workload('decorator.hit')
+def decorator_hit(ctx):
+    cache = ctx.make_cache()
+    @cache.cache_decorator(expires=3600)
+    def func(i, name='lamia'):
+        return i
+    args = range(min(ctx.count, 1000))
+    for i in args:
+        func(i)
+    calls = max(1, ctx.count // len(args))
+    def run():
+        for _ in xrange(calls):
+            for i in args:
+                func(i)
+        return calls * len(args)
+    return run
+
+@workload('func_key')
+def func_key(ctx):
+    def func(i, name='lamia'):
+        return i
+    count = ctx.count
+    def run():
+        for i in xrange(count):
+            get_func_key(func, i, name='lamia')
+        return count
+    return run
+
+@workload('purge_file')
+def purge_file(ctx, size):
+    '''
+    @summary:
+        size個のキャッシュファイルのうち、expired_ratioの割合が期限切れの状態で
+        purge_fileを実行します
+    '''
+    cache = ctx.make_cache()
+    items = ctx.items(size, prefix='p')
+    expired = int(size * ctx.expired_ratio)
+    for key, val in items[expired:]:
+        cache.store(key, val, expires=3600)
+    cache._clear_cache_memory()
+    def before():
+        for key, val in items[:expired]:
+            cache.store(key, val, expires=0)
+        cache._clear_cache_memory()
+    def run():
+        cache.purge_file()
+        return size
+    return before, run
+
+@workload('save')
+def save(ctx, size):
+    '''
+    @summary:
+        メモリ上のsize個の未書き出しのエントリをsave()で書き出します
+    '''
+    cache = ctx.make_cache()
+    items = ctx.items(size, prefix='s')
+    def before():
+        for key, val in items:
+            cache.store(key, val, is_store_file=False)
+    def run():
+        cache.save()
+        return size
+    return before, run
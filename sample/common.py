@@ -3,9 +3,11 @@
 from Lamia.cache import Cache
 import time
 
+# 期限切れのキャッシュはバックグラウンドのスレッドが少しずつ削除します
 cache = Cache(cache_root="/tmp/lamia", 
               default_expires=10,
-              namespace="test")
+              namespace="test",
+              janitor=dict(interval=1.0, time_budget=0.05, io_budget=256))
 cached = cache.cache_decorator
 
 # メモリにのみキャッシュします
@@ -25,10 +27,9 @@ def main():
         print get_last_time()
     cache.store("key", "val", expires=100, is_store_file=True)
     print cache["key"]
-    # 名前空間内の有効期限切れのキャッシュファイルを削除します
-    cache.purge_file()
-    # 保持しているメモリ上の有効期限切れのキャッシュを削除します
-    cache.purge_memory()
+    # 直前のjanitorの処理の集計値
+    print cache.janitor.stats()
+    cache.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -8,6 +8,10 @@ setup(name="lamia",
       author="Jun Kimura",
       author_email="jksmphone@gmail.com",
       url="http://github.com/bluele/Lamia",
-      packages = find_packages(),
+      packages = find_packages(exclude=["benchmarks", "benchmarks.*"]),
       keywords= "python cache module",
+      install_requires = ['scandir; python_version < "3.5"'],
+      entry_points = {
+          "console_scripts": ["lamia-server = Lamia.server:main"],
+      },
       zip_safe = True)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-aio"
+
+class TestAsyncIO(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              io_workers=2,
+              io_batch=4)
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_afetch_astore(self):
+        ''' test for async store and fetch through the file tier '''
+        cache = self.cache
+        futures = [cache.astore("key%d" % i, i) for i in xrange(20)]
+        for future in futures:
+            self.assertIsNone(future.result(5), 'error test_afetch_astore')
+        self.assertEqual(cache.afetch("key3").result(5), 3, 'error test_afetch_astore')
+        del cache["key3"]
+        self.assertEqual(cache.afetch("key3").result(5), 3, 'error test_afetch_astore')
+        self.assertIsInstance(cache.afetch("nokey").exception(5), KeyError,
+                              'error test_afetch_astore')
+
+    def test_asave_apurge(self):
+        ''' test for batched async save and purge '''
+        cache = self.cache
+        for i in xrange(10):
+            cache.store("key%d" % i, i, expires=0.2 if i % 2 else 10, is_store_file=False)
+        cache.asave(full=True).result(5)
+        self.assertEqual(len(list(cache.layout.iter_paths(cache.cache_dir))), 10,
+                         'error test_asave_apurge')
+        time.sleep(0.2)
+        cache.apurge().result(5)
+        self.assertEqual(len(list(cache.layout.iter_paths(cache.cache_dir))), 5,
+                         'error test_asave_apurge')
+        self.assertEqual(len(cache.cache), 5, 'error test_asave_apurge')
+
+    def test_async_loop(self):
+        ''' test for async_loop waits for pending writes '''
+        cache = self.cache
+        for i in xrange(10):
+            cache.store("key%d" % i, "val", is_store_file=False)
+        cache.save(is_async=True, full=True)
+        self.assertTrue(cache.async_loop(), 'error test_async_loop')
+        cache.cache.clear()
+        self.assertEqual(cache["key9"], "val", 'error test_async_loop')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestAsyncIO)
+unittest.TextTestRunner(verbosity=2).run(suite)
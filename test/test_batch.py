@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-batch"
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict())
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_store_get_many(self):
+        ''' test for batched store and get across both tiers '''
+        for thread_safe in (False, True):
+            cache = Cache(cache_root=cache_root,
+                  default_expires=default_expires,
+                  namespace=namespace,
+                  cache=dict(),
+                  thread_safe=thread_safe)
+            cache.store_many(dict(("key%d" % i, i) for i in xrange(10)))
+            cache.store_many([("memory", "val")], is_store_file=False)
+            for i in xrange(5):
+                del cache["key%d" % i]
+            values = cache.get_many(["key%d" % i for i in xrange(12)] + ["memory"])
+            expected = dict(("key%d" % i, i) for i in xrange(10))
+            expected["memory"] = "val"
+            self.assertEqual(values, expected, 'error test_store_get_many')
+            cache.clear_cache()
+
+    def test_expires(self):
+        ''' test for batched calls keep the TTL of single-key calls '''
+        cache = self.cache
+        cache.store_many({"a": 1, "b": 2}, expires=0.05)
+        cache.store("c", 3)
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2, "c": 3},
+                         'error test_expires')
+        time.sleep(0.1)
+        del cache["b"]
+        self.assertEqual(cache.get_many(["a", "b", "c"]), {"c": 3}, 'error test_expires')
+        self.assertIsNone(cache.get("b"), 'error test_expires')
+
+    def test_delete_many(self):
+        ''' test for batched deletes from memory and file '''
+        cache = self.cache
+        cache.store_many({"a": 1, "b": 2, "c": 3})
+        cache.store("memory", "val", is_store_file=False)
+        self.assertEqual(cache.delete_many(["a", "b", "memory", "nokey"]), 3,
+                         'error test_delete_many')
+        self.assertEqual(cache.get_many(["a", "b", "c", "memory"]), {"c": 3},
+                         'error test_delete_many')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestBatch)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from benchmarks.data import DataGenerator, SizeDistribution
+from benchmarks.runner import run, compare
+import random
+import unittest
+
+class TestBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.generator = DataGenerator(key_size="8-32", value_size="lognormal:128:0.5", seed=1)
+
+    def test_data(self):
+        ''' test for reproducible keys and values '''
+        items = self.generator.items(500)
+        self.assertEqual(items, DataGenerator("8-32", "lognormal:128:0.5", 1).items(500),
+                         'error test_data')
+        self.assertEqual(len(set(key for key, _ in items)), 500, 'error test_data')
+        rng = random.Random(0)
+        sizes = [SizeDistribution("16-256").sample(rng) for _ in xrange(100)]
+        self.assertTrue(min(sizes) >= 16 and max(sizes) <= 256, 'error test_data')
+        self.assertRaises(ValueError, SizeDistribution, "big")
+
+    def test_run_and_compare(self):
+        ''' test for running workloads and flagging regressions '''
+        base = run(["fetch.memory", "purge_file"], count=50, repeat=1,
+                   purge_sizes=[50], save_sizes=[])
+        self.assertEqual(sorted(base['results']), ["fetch.memory", "purge_file.50"],
+                         'error test_run_and_compare')
+        new = dict(meta=base['meta'], results=dict(
+            (name, dict(result, us_per_op=result['us_per_op'] * 2))
+            for name, result in base['results'].items()))
+        statuses = [row[4] for row in compare(base, new, threshold=0.1)]
+        self.assertEqual(statuses, ['regression', 'regression'], 'error test_run_and_compare')
+        statuses = [row[4] for row in compare(new, base, threshold=0.1)]
+        self.assertEqual(statuses, ['improvement', 'improvement'], 'error test_run_and_compare')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestBenchmarks)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -30,6 +30,25 @@ class TestCacheMethod(unittest.TestCase):
                          'error test_cache_dir'
                          )
 
+    def test_unsafe_cache_dir(self):
+        ''' test for refusing a namespace which others can write '''
+        path = os.path.join(cache_root, namespace + "-unsafe")
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        try:
+            os.chmod(path, 0777)
+            self.assertRaises(OSError, Cache, cache_root=cache_root,
+                              default_expires=default_expires, namespace=namespace + "-unsafe")
+            cache = Cache(cache_root=cache_root, default_expires=default_expires,
+                          namespace=namespace + "-unsafe", mode=0777)
+            self.assertEqual(cache.cache_dir, path, 'error test_unsafe_cache_dir')
+        finally:
+            os.rmdir(path)
+        cache = Cache(cache_root=cache_root, default_expires=default_expires,
+                      namespace=namespace + "-unsafe")
+        self.assertEqual(os.stat(path).st_mode & 0777, 0700, 'error test_unsafe_cache_dir')
+        os.rmdir(path)
+
     def test_store(self):
         '''test for store cache'''
         key = "key"
@@ -69,6 +88,42 @@ class TestCacheMethod(unittest.TestCase):
         del self.cache[key]
         self.assertNotIn(key, self.cache, 'error test_change_namespace')
         
+    def test_purge_memory(self):
+        ''' test for purge_memory removes only expired keys '''
+        import time
+        self.cache.store("old", "val", expires=100, is_store_file=False)
+        self.cache.store("new", "val", expires=1000, is_store_file=False)
+        self.cache.store("old", "val", expires=1000, is_store_file=False)
+        self.cache.store("gone", "val", expires=100, is_store_file=False)
+        removed = self.cache.purge_memory(time.time() + 500)
+        self.assertEqual(removed, 1, 'error test_purge_memory')
+        self.assertIn("old", self.cache, 'error test_purge_memory')
+        self.assertNotIn("gone", self.cache, 'error test_purge_memory')
+        
+    def test_purge_memory_max_items(self):
+        ''' test for incremental purge_memory '''
+        import time
+        for i in xrange(10):
+            self.cache.store("key%d" % i, i, expires=i, is_store_file=False)
+        date = time.time() + 100
+        self.assertEqual(self.cache.purge_memory(date, max_items=4), 4,
+                         'error test_purge_memory_max_items')
+        self.assertEqual(len(self.cache.cache), 6, 'error test_purge_memory_max_items')
+        self.assertEqual(self.cache.purge_memory(date), 6,
+                         'error test_purge_memory_max_items')
+
+    def test_purge_memory_deadline(self):
+        ''' test for purge_memory stops at the deadline '''
+        import time
+        cache = self.cache
+        for i in xrange(cache._purge_batch * 3):
+            cache.store("key%d" % i, i, expires=1, is_store_file=False)
+        date = time.time() + 100
+        removed = cache.purge_memory(date, deadline=time.time() - 1)
+        self.assertEqual(removed, cache._purge_batch, 'error test_purge_memory_deadline')
+        self.assertEqual(cache.purge_memory(date), cache._purge_batch * 2,
+                         'error test_purge_memory_deadline')
+        
 def cleanUp():
     os.removedirs(os.path.join(
               cache_root,
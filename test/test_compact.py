@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.compact import CompactStore
+from Lamia.util import _CacheData
+import pickle
+import random
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-compact"
+
+class TestCompactStore(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.store = CompactStore(inline_max=16)
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.store.clear()
+
+    def test_basic(self):
+        ''' test for the dict-like interface '''
+        store = self.store
+        store["key"] = _CacheData(val="val", expiration_date=100.0)
+        store[("func", (1,), ())] = _CacheData(val={"a": 1}, expiration_date=200.0)
+        store["long"] = _CacheData(val="x" * 100, expiration_date=300.0)
+        store["unicode"] = _CacheData(val=u"あ", expiration_date=400.0)
+        self.assertEqual(store["key"].val, "val", 'error test_basic')
+        self.assertEqual(store["key"].expiration_date, 100.0, 'error test_basic')
+        self.assertEqual(store[("func", (1,), ())].val, {"a": 1}, 'error test_basic')
+        self.assertEqual(store["long"].val, "x" * 100, 'error test_basic')
+        self.assertEqual(store["unicode"].val, u"あ", 'error test_basic')
+        self.assertTrue("key" in store, 'error test_basic')
+        self.assertFalse("missing" in store, 'error test_basic')
+        self.assertRaises(KeyError, store.__getitem__, "missing")
+        store["key"] = _CacheData(val="new", expiration_date=500.0)
+        self.assertEqual(store["key"].val, "new", 'error test_basic')
+        self.assertEqual(len(store), 4, 'error test_basic')
+        del store["key"]
+        self.assertRaises(KeyError, store.__delitem__, "key")
+        self.assertEqual(store.pop("long").val, "x" * 100, 'error test_basic')
+        self.assertEqual(store.pop("long", None), None, 'error test_basic')
+        self.assertEqual(sorted(store.keys()), ["unicode", ("func", (1,), ())], 'error test_basic')
+
+    def test_random(self):
+        ''' test for growing and compacting against a dict '''
+        store = self.store
+        expected = {}
+        rand = random.Random(0)
+        for n in xrange(20000):
+            key = "key%d" % rand.randint(0, 2000)
+            if rand.random() < 0.3:
+                self.assertEqual(store.pop(key, None) is not None, expected.pop(key, None) is not None,
+                                 'error test_random')
+            else:
+                val = "v" * rand.randint(0, 32)
+                store[key] = _CacheData(val=val, expiration_date=float(n))
+                expected[key] = (val, float(n))
+        self.assertEqual(len(store), len(expected), 'error test_random')
+        self.assertEqual(dict((key, (data.val, data.expiration_date))
+                              for key, data in store.items()), expected, 'error test_random')
+        stats = store.stats()
+        self.assertTrue(stats['garbage_bytes'] * 2 <= stats['arena_bytes'] + 4096, 'error test_random')
+
+    def test_overwrite(self):
+        ''' test for compacting on repeated overwrites of one key '''
+        store = self.store
+        for n in xrange(20000):
+            store["key"] = _CacheData(val="v" * 100, expiration_date=float(n))
+        stats = store.stats()
+        self.assertEqual(len(store), 1, 'error test_overwrite')
+        self.assertEqual(store["key"].expiration_date, 19999.0, 'error test_overwrite')
+        self.assertTrue(stats['arena_bytes'] < 8192, 'error test_overwrite')
+        self.assertTrue(len(store._hashes) <= 1026, 'error test_overwrite')
+
+    def test_cache(self):
+        ''' test for using the store as the memory tier of Cache '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=CompactStore(),
+              thread_safe=True)
+        try:
+            @cache.cache_decorator()
+            def double(i):
+                return i * 2
+            self.assertEqual([double(i) for i in xrange(10)], range(0, 20, 2), 'error test_cache')
+            cache.store("short", "val", expires=0.05, is_store_file=False)
+            cache.store("key", "val")
+            self.assertEqual(cache["key"], "val", 'error test_cache')
+            time.sleep(0.1)
+            cache.purge()
+            self.assertFalse("short" in cache.cache, 'error test_cache')
+            self.assertEqual(len(cache.cache), 11, 'error test_cache')
+        finally:
+            cache.clear_cache()
+            cache.close()
+
+    def test_pickle_data(self):
+        ''' test for pickling _CacheData with every protocol '''
+        for protocol in xrange(pickle.HIGHEST_PROTOCOL + 1):
+            data = pickle.loads(pickle.dumps(_CacheData(val="val", expiration_date=1.0), protocol))
+            self.assertEqual((data.val, data.expiration_date), ("val", 1.0), 'error test_pickle_data')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestCompactStore)
+unittest.TextTestRunner(verbosity=2).run(suite)
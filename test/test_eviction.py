@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.eviction import LRUStore, LFUStore, TinyLFUStore, CountMinSketch
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-eviction"
+
+class TestEvictionStore(unittest.TestCase):
+
+    def test_lru(self):
+        ''' test for LRUStore evicts least recently used key '''
+        store = LRUStore(max_entries=2)
+        store["a"] = 1
+        store["b"] = 2
+        store["a"]
+        store["c"] = 3
+        self.assertNotIn("b", store, 'error test_lru')
+        self.assertEqual(sorted(store.keys()), ["a", "c"], 'error test_lru')
+
+    def test_lfu(self):
+        ''' test for LFUStore evicts least frequently used key '''
+        store = LFUStore(max_entries=2)
+        store["a"] = 1
+        store["b"] = 2
+        for _ in xrange(3):
+            store["b"]
+        store["a"]
+        store["c"] = 3
+        self.assertNotIn("a", store, 'error test_lfu')
+        self.assertEqual(store.frequency("b"), 4, 'error test_lfu')
+
+    def test_max_bytes(self):
+        ''' test for byte budget '''
+        store = LRUStore(max_bytes=1000, sizeof=lambda key, val: len(val))
+        for i in xrange(10):
+            store[i] = "x" * 300
+        self.assertEqual(len(store), 3, 'error test_max_bytes')
+        self.assertEqual(store.total_bytes, 900, 'error test_max_bytes')
+        self.assertEqual(store.evictions, 7, 'error test_max_bytes')
+
+    def test_sketch_reset(self):
+        ''' test for halving the sketch counters after sample_size additions '''
+        sketch = CountMinSketch(width=16, sample_size=100)
+        for _ in xrange(15):
+            sketch.increment("hot")
+        self.assertEqual(sketch.frequency("hot"), 15, 'error test_sketch_reset')
+        for i in xrange(1000):
+            additions = sketch._additions
+            sketch.increment(i)
+            if sketch._additions < additions:
+                break
+        self.assertTrue(sketch.frequency("hot") <= 7, 'error test_sketch_reset')
+        self.assertTrue(all(count <= 7 for row in sketch._table for count in row),
+                        'error test_sketch_reset')
+
+    def test_tinylfu_keeps_hot_keys(self):
+        ''' test for TinyLFUStore protects frequently used keys from a scan '''
+        store = TinyLFUStore(max_entries=100)
+        for i in xrange(100):
+            store["hot%d" % i] = i
+        for _ in xrange(3):
+            for i in xrange(100):
+                store.get("hot%d" % i)
+        for i in xrange(1000):
+            store["scan%d" % i] = i
+        hot = sum(1 for i in xrange(100) if "hot%d" % i in store)
+        self.assertTrue(len(store) <= 100, 'error test_tinylfu_keeps_hot_keys')
+        self.assertTrue(hot >= 90, 'error test_tinylfu_keeps_hot_keys')
+
+    def test_sketch_rows(self):
+        ''' test for independent sketch rows '''
+        sketch = CountMinSketch(width=1024)
+        rows = {}
+        for i in xrange(2000):
+            indexes = sketch._indexes(i * 1024)
+            rows.setdefault(indexes[0], []).append(indexes[1:])
+        pairs = same = 0
+        for group in rows.itervalues():
+            for a in xrange(len(group)):
+                for b in xrange(a + 1, len(group)):
+                    pairs += 1
+                    same += group[a] == group[b]
+        self.assertTrue(pairs > 0, 'error test_sketch_rows')
+        self.assertTrue(same < pairs * 0.05, 'error test_sketch_rows')
+
+    def test_tinylfu_overwrite(self):
+        ''' test for TinyLFUStore keeps the main segment within budget after overwrites '''
+        store = TinyLFUStore(max_bytes=10000, sizeof=lambda key, val: len(val))
+        for i in xrange(100):
+            store["key%d" % i] = "x" * 90
+        for i in xrange(100):
+            if "key%d" % i in store:
+                store["key%d" % i] = "x" * 500
+        self.assertTrue(store.total_bytes <= 10000, 'error test_tinylfu_overwrite')
+        main = store._main_usage()
+        self.assertTrue(main[1] <= store._limits('main')[1], 'error test_tinylfu_overwrite')
+        self.assertTrue(store._usage['protected'][1] <= store._limits('protected')[1],
+                        'error test_tinylfu_overwrite')
+
+class TestBoundedCache(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              max_entries=10,
+              eviction='lfu')
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_bounded_memory(self):
+        ''' test for memory tier stays within max_entries '''
+        for i in xrange(100):
+            self.cache.store("key%d" % i, i, is_store_file=False)
+        self.assertEqual(len(self.cache.cache), 10, 'error test_bounded_memory')
+        self.assertEqual(self.cache["key99"], 99, 'error test_bounded_memory')
+
+# do unittest
+suite = unittest.TestSuite([
+    unittest.TestLoader().loadTestsFromTestCase(TestEvictionStore),
+    unittest.TestLoader().loadTestsFromTestCase(TestBoundedCache),
+])
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.layout import EXPIRY_JOURNAL
+from Lamia.expiry import FileExpiryIndex
+import Lamia.storage
+import os
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-expiry"
+
+class TestFileExpiryIndex(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = self.make_cache()
+        self.opened = []
+        self._load_header = Lamia.storage.load_header
+        def load_header(path):
+            self.opened.append(os.path.basename(path))
+            return self._load_header(path)
+        Lamia.storage.load_header = load_header
+
+    def tearDown(self):
+        ''' do finalization '''
+        Lamia.storage.load_header = self._load_header
+        self.cache.clear_cache()
+
+    def make_cache(self, layout='flat'):
+        return Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              layout=layout)
+
+    def file_keys(self, cache):
+        return sorted(os.path.basename(path)
+                      for path in cache.layout.iter_paths(cache.cache_dir))
+
+    def test_purge_reads_only_expired(self):
+        ''' test for purge_file opens only expired files '''
+        cache = self.cache
+        for i in xrange(20):
+            cache.store("key%02d" % i, i)
+        cache.store("short", "val", expires=0.05)
+        cache.store("overwritten", "val", expires=0.05)
+        cache.store("overwritten", "val", expires=10)
+        time.sleep(0.1)
+        cache.purge_file()
+        self.assertEqual(self.opened, ["short"], 'error test_purge_reads_only_expired')
+        self.assertFalse("short" in self.file_keys(cache), 'error test_purge_reads_only_expired')
+        self.assertEqual(len(self.file_keys(cache)), 21, 'error test_purge_reads_only_expired')
+
+    def test_cold_start_rebuild(self):
+        ''' test for rebuilding the index of a namespace without a journal '''
+        cache = self.cache
+        cache.store("long", "val")
+        cache.store("short", "val", expires=0.05)
+        cache.storage.close()
+        os.remove(os.path.join(cache.cache_dir, EXPIRY_JOURNAL))
+        cache = self.make_cache()
+        self.assertTrue(cache.storage.expiry_index.needs_rebuild, 'error test_cold_start_rebuild')
+        time.sleep(0.1)
+        cache.purge_file()
+        self.assertEqual(self.file_keys(cache), ["long"], 'error test_cold_start_rebuild')
+        self.assertFalse(cache.storage.expiry_index.needs_rebuild, 'error test_cold_start_rebuild')
+
+    def test_shared_journal(self):
+        ''' test for instances on the same namespace share the journal '''
+        other = self.make_cache()
+        other.store("other", "val", expires=0.05)
+        self.cache.clear_cache()
+        other.store("after_clear", "val", expires=0.05)
+        time.sleep(0.1)
+        self.cache.purge_file()
+        self.assertEqual(self.file_keys(self.cache), [], 'error test_shared_journal')
+        other.storage.close()
+
+    def test_journal_compaction(self):
+        ''' test for rewriting the journal on append and reading it in chunks '''
+        index = self.cache.storage.expiry_index
+        index._slack = 16
+        index._compact_size = index._check_size = 4096
+        for i in xrange(2000):
+            self.cache.store("key%d" % (i % 10), i)
+        path = os.path.join(self.cache.cache_dir, EXPIRY_JOURNAL)
+        self.assertTrue(os.path.getsize(path) < 2 * 4096, 'error test_journal_compaction')
+        other = self.make_cache()
+        other.storage.expiry_index._chunk_size = 7
+        other.storage.expiry_index.sync()
+        self.assertEqual(sorted(relpath for relpath, _, _ in other.storage.expiry_index.items()),
+                         sorted(self.file_keys(self.cache)), 'error test_journal_compaction')
+        other.storage.close()
+
+    def test_concurrent_rewrite(self):
+        ''' test for appends of other processes surviving journal rewrites '''
+        cache_dir = self.cache.cache_dir
+        pids = []
+        for name in ("a", "b", "c"):
+            pid = os.fork()
+            if pid == 0:
+                index = FileExpiryIndex(cache_dir)
+                index._slack = 16
+                index._compact_size = index._check_size = 1024
+                for i in xrange(1000):
+                    index.add("%s%d" % (name, i), time.time() + 60)
+                    for _ in xrange(3):
+                        index.add(name, time.time() + 60)
+                os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+        index = FileExpiryIndex(cache_dir)
+        index.sync()
+        self.assertEqual(len(index), 3003, 'error test_concurrent_rewrite')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestFileExpiryIndex)
+unittest.TextTestRunner(verbosity=2).run(suite)
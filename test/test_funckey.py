@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.util import get_func_key, FuncKey
+from hashlib import sha1
+import os
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-funckey"
+
+def add(a, b=0, c=0):
+    return a + b + c
+
+class TestFuncKey(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict())
+        self.calls = []
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_get_func_key(self):
+        ''' test for keys independent of kwargs order '''
+        self.assertEqual(get_func_key(add, 1, b=2, c=3), get_func_key(add, 1, c=3, b=2),
+                         'error test_get_func_key')
+        self.assertEqual(get_func_key(add, 1, 2),
+                         "test_funckey.py::add(%s)" % sha1("(1, 2){}").hexdigest(),
+                         'error test_get_func_key')
+
+    def test_tuple_key(self):
+        ''' test for tuple keys in memory and file names on write '''
+        cache = self.cache
+        @cache.cache_decorator(is_store_file=True)
+        def func(a, b=0, c=0):
+            self.calls.append(a)
+            return a + b + c
+        self.assertEqual(func(1, b=2, c=3), 6, 'error test_tuple_key')
+        self.assertEqual(func(1, c=3, b=2), 6, 'error test_tuple_key')
+        keys = cache.cache.keys()
+        self.assertEqual(len(keys), 1, 'error test_tuple_key')
+        self.assertTrue(isinstance(keys[0], FuncKey), 'error test_tuple_key')
+        self.assertTrue(os.path.exists(cache.storage.build_path(keys[0].file_key())),
+                        'error test_tuple_key')
+        cache._clear_cache_memory()
+        self.assertEqual(func(1, b=2, c=3), 6, 'error test_tuple_key')
+        self.assertEqual(self.calls, [1], 'error test_tuple_key')
+
+    def test_equal_values_of_other_types(self):
+        ''' test for equal arguments of different types using different keys '''
+        cache = self.cache
+        @cache.cache_decorator(is_store_file=True)
+        def kind(a, b=0):
+            self.calls.append(a)
+            return type(a).__name__
+        args = [1, 1.0, True, (1,), (1.0,)]
+        self.assertEqual([kind(a) for a in args], ["int", "float", "bool", "tuple", "tuple"],
+                         'error test_equal_values_of_other_types')
+        self.assertEqual(kind(b=1.0, a=1), "int", 'error test_equal_values_of_other_types')
+        self.assertNotEqual(FuncKey("f", (1,), (("b", 1),)), FuncKey("f", (1,), (("b", True),)),
+                            'error test_equal_values_of_other_types')
+        self.assertEqual(len(cache.cache), 6, 'error test_equal_values_of_other_types')
+        cache._clear_cache_memory()
+        self.assertEqual([kind(a) for a in args], ["int", "float", "bool", "tuple", "tuple"],
+                         'error test_equal_values_of_other_types')
+        self.assertEqual(len(self.calls), 6, 'error test_equal_values_of_other_types')
+
+    def test_unhashable_and_key_option(self):
+        ''' test for unhashable arguments and key= '''
+        cache = self.cache
+        @cache.cache_decorator()
+        def total(values):
+            self.calls.append(values)
+            return sum(values)
+        @cache.cache_decorator(key=lambda a, b=0: "add:%d:%d" % (a, b))
+        def plus(a, b=0):
+            return a + b
+        self.assertEqual(total([1, 2]), 3, 'error test_unhashable_and_key_option')
+        self.assertEqual(total([1, 2]), 3, 'error test_unhashable_and_key_option')
+        self.assertEqual(len(self.calls), 1, 'error test_unhashable_and_key_option')
+        self.assertEqual(plus(1, b=2), 3, 'error test_unhashable_and_key_option')
+        self.assertEqual(cache["add:1:2"], 3, 'error test_unhashable_and_key_option')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestFuncKey)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.layout import EXPIRY_JOURNAL
+import os
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-janitor"
+
+class TestJanitor(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              janitor=dict(interval=60, io_budget=5, memory_budget=5,
+                           sweep_interval=60))
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.close()
+        self.cache.clear_cache()
+
+    def file_count(self):
+        cache = self.cache
+        return len(list(cache.layout.iter_paths(cache.cache_dir)))
+
+    def test_budgeted_pass(self):
+        ''' test for each pass removes at most the budget '''
+        cache = self.cache
+        for i in xrange(12):
+            cache.store("key%d" % i, i, expires=0.05)
+        time.sleep(0.1)
+        metrics = cache.janitor.run_once()
+        self.assertEqual(metrics['memory_removed'], 5, 'error test_budgeted_pass')
+        self.assertEqual(metrics['file_removed'], 5, 'error test_budgeted_pass')
+        self.assertEqual(self.file_count(), 7, 'error test_budgeted_pass')
+        for _ in xrange(3):
+            cache.janitor.run_once()
+        self.assertEqual(self.file_count(), 0, 'error test_budgeted_pass')
+        self.assertEqual(len(cache.cache), 0, 'error test_budgeted_pass')
+        stats = cache.janitor.stats()
+        self.assertEqual(stats['passes'], 4, 'error test_budgeted_pass')
+        self.assertEqual(stats['totals']['removed'], 24, 'error test_budgeted_pass')
+
+    def test_sweep(self):
+        ''' test for the sweep removes files missing from the index '''
+        cache = self.cache
+        for i in xrange(8):
+            cache.store("key%d" % i, i, expires=0.05 if i % 2 else 10)
+        with open(cache.storage.build_path("corrupt"), 'wb') as f:
+            f.write("garbage")
+        cache.storage.expiry_index.reset([])
+        time.sleep(0.1)
+        scanned = 0
+        for _ in xrange(3):
+            metrics = cache.janitor.run_once()
+            scanned += metrics['scanned']
+            self.assertTrue(metrics['scanned'] <= 5, 'error test_sweep')
+        self.assertEqual(scanned, 9, 'error test_sweep')
+        self.assertEqual(self.file_count(), 4, 'error test_sweep')
+        self.assertEqual(cache.janitor.totals['sweeps'], 1, 'error test_sweep')
+
+    def test_background(self):
+        ''' test for the janitor thread purges without explicit calls '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              janitor=dict(interval=0.05))
+        cache.store("key", "val", expires=0.05)
+        time.sleep(0.3)
+        self.assertEqual(self.file_count(), 0, 'error test_background')
+        self.assertTrue(cache.janitor.passes > 0, 'error test_background')
+        cache.close()
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestJanitor)
+unittest.TextTestRunner(verbosity=2).run(suite)
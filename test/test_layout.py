@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.layout import FlatLayout, ShardedLayout, encode_key, decode_key, migrate
+import os
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-layout"
+
+class TestShardedLayout(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              layout='sharded')
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_encode_key(self):
+        ''' test for filename encoding of arbitrary keys '''
+        for key in ("a/b", ".hidden", "module.py::func(abc)", "../x"):
+            name = encode_key(key)
+            self.assertNotIn("/", name, 'error test_encode_key')
+            self.assertFalse(name.startswith("."), 'error test_encode_key')
+            self.assertEqual(decode_key(name), key, 'error test_encode_key')
+        self.assertIsNone(decode_key(encode_key("k" * 500)), 'error test_encode_key')
+
+    def test_store_file(self):
+        ''' test for store and fetch in sharded layout '''
+        key = "dir/key"
+        self.cache.store(key, "val", is_store_file=True)
+        del self.cache[key]
+        self.assertEqual(self.cache[key], "val", 'error test_store_file')
+        path = self.cache.layout.build_path(self.cache.cache_dir, key)
+        self.assertEqual(len(os.path.relpath(path, self.cache.cache_dir).split(os.sep)), 3,
+                         'error test_store_file')
+
+    def test_purge_file(self):
+        ''' test for purge_file walks shard directories '''
+        self.cache.store("old", "val", expires=1, is_store_file=True)
+        self.cache.store("new", "val", expires=100, is_store_file=True)
+        self.cache.purge_file(time.time() + 10)
+        paths = list(self.cache.layout.iter_paths(self.cache.cache_dir))
+        self.assertEqual(len(paths), 1, 'error test_purge_file')
+
+    def test_reserved_key(self):
+        ''' test for rejecting flat keys which collide with internal files '''
+        flat = Cache(cache_root=cache_root,
+                     default_expires=default_expires,
+                     namespace=namespace)
+        flat.store("short", "val", expires=0.01)
+        self.assertRaises(ValueError, flat.store, ".lamia-expiry", "boom")
+        self.assertRaises(ValueError, flat.store, ".lamia-other", "val")
+        time.sleep(0.02)
+        self.assertEqual(flat.purge_file(), 1, 'error test_reserved_key')
+        # シャードのレイアウトではエスケープされるため格納できます
+        self.cache.store(".lamia-expiry", "val")
+        del self.cache[".lamia-expiry"]
+        self.assertEqual(self.cache[".lamia-expiry"], "val", 'error test_reserved_key')
+
+    def test_migrate(self):
+        ''' test for migration from flat namespace '''
+        flat = Cache(cache_root=cache_root,
+                     default_expires=default_expires,
+                     namespace=namespace)
+        flat.store("key", "val", is_store_file=True)
+        moved, skipped = migrate(self.cache.cache_dir, FlatLayout(), ShardedLayout())
+        self.assertEqual((moved, skipped), (1, 0), 'error test_migrate')
+        del self.cache["key"]
+        self.assertEqual(self.cache["key"], "val", 'error test_migrate')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestShardedLayout)
+unittest.TextTestRunner(verbosity=2).run(suite)
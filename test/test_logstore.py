@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.logstore import LogStorage
+from Lamia.util import _CacheData
+import os
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-logstore"
+
+class TestLogStorage(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              storage='log',
+              storage_options=dict(segment_size=1024))
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+        self.cache.storage.close()
+
+    def reopen(self):
+        self.cache.storage.close()
+        return LogStorage(self.cache.cache_dir, segment_size=1024)
+
+    def test_store_file(self):
+        ''' test for store and fetch through the log '''
+        self.cache.store("key", "val1", is_store_file=True)
+        self.cache.store("key", "val2", is_store_file=True)
+        del self.cache["key"]
+        self.assertEqual(self.cache["key"], "val2", 'error test_store_file')
+
+    def test_recovery(self):
+        ''' test for index rebuild by segment replay '''
+        for i in xrange(100):
+            self.cache.store("key%d" % i, "val%d" % i, is_store_file=True)
+        self.cache._delete_file("key0")
+        storage = self.reopen()
+        self.assertNotIn("key0", storage, 'error test_recovery')
+        self.assertEqual(storage.load("key99").val, "val99", 'error test_recovery')
+        self.assertEqual(len(storage), 99, 'error test_recovery')
+        self.cache.storage = storage
+
+    def test_truncated_tail(self):
+        ''' test for recovery drops a partially written record '''
+        self.cache.store("key", "val", is_store_file=True)
+        storage = self.cache.storage
+        path = storage._active.path
+        with open(path, 'ab') as f:
+            f.write("LMLG\x00\x00")
+        storage = self.reopen()
+        self.assertEqual(storage.load("key").val, "val", 'error test_truncated_tail')
+        self.assertEqual(os.path.getsize(path), storage._active.size, 'error test_truncated_tail')
+        self.cache.storage = storage
+
+    def test_compact(self):
+        ''' test for compaction drops overwritten and expired records '''
+        for _ in xrange(20):
+            for i in xrange(5):
+                self.cache.store("key%d" % i, "x" * 100, is_store_file=True)
+        self.cache.store("old", "val", expires=0.01, is_store_file=True)
+        time.sleep(0.02)
+        storage = self.cache.storage
+        before = len(storage._segments)
+        self.assertTrue(storage.compact() > 0, 'error test_compact')
+        self.assertTrue(len(storage._segments) < before, 'error test_compact')
+        self.assertNotIn("old", storage, 'error test_compact')
+        storage = self.reopen()
+        self.assertEqual(sorted(storage.keys()), ["key%d" % i for i in xrange(5)],
+                         'error test_compact')
+        self.cache.storage = storage
+
+    def test_single_owner(self):
+        ''' test for refusing a second storage on the same directory '''
+        self.assertRaises(ValueError, LogStorage, self.cache.cache_dir)
+        storage = self.reopen()
+        self.assertEqual(len(storage), 0, 'error test_single_owner')
+        self.cache.storage = storage
+
+    def test_purge(self):
+        ''' test for purge takes expired keys in expiration order '''
+        for i in xrange(10):
+            self.cache.store("key%d" % i, "val", expires=0.01 * (i + 1), is_store_file=True)
+        self.cache.store("key0", "val", is_store_file=True)
+        time.sleep(0.11)
+        storage = self.cache.storage
+        self.assertEqual(storage.purge(time.time(), max_items=3), 2, 'error test_purge')
+        self.assertNotIn("key1", storage, 'error test_purge')
+        self.assertIn("key3", storage, 'error test_purge')
+        self.assertEqual(storage.purge(time.time()), 7, 'error test_purge')
+        self.assertEqual(storage.keys(), ["key0"], 'error test_purge')
+
+    def test_purge_record(self):
+        ''' test for purged keys do not come back on replay '''
+        self.cache.store("key", "val", expires=100, is_store_file=True)
+        storage = self.cache.storage
+        self.assertEqual(storage.purge(time.time() + 200), 1, 'error test_purge_record')
+        storage = self.reopen()
+        self.assertNotIn("key", storage, 'error test_purge_record')
+        self.cache.storage = storage
+
+    def test_purge_compact(self):
+        ''' test for purge reclaims segments full of expired records '''
+        for i in xrange(30):
+            self.cache.store("key%d" % i, "x" * 100, expires=0.01, is_store_file=True)
+        storage = self.cache.storage
+        segments = len(storage._segments)
+        self.assertTrue(segments > 2, 'error test_purge_compact')
+        time.sleep(0.02)
+        self.assertEqual(storage.purge(time.time()), 30, 'error test_purge_compact')
+        self.assertTrue(len(storage._segments) < segments, 'error test_purge_compact')
+        self.assertEqual(len(storage), 0, 'error test_purge_compact')
+
+    def test_map_tail(self):
+        ''' test for reading new records maps only the tail of the segment '''
+        storage = self.reopen()
+        self.cache.storage = storage
+        storage.segment_size = 1024 * 1024
+        for i in xrange(200):
+            self.cache.store("key%d" % i, "x" * 1000, is_store_file=True)
+            self.assertEqual(storage.load("key%d" % i).val, "x" * 1000, 'error test_map_tail')
+        maps = storage._active.maps
+        self.assertTrue(maps[-1][0] > 0, 'error test_map_tail')
+        self.assertTrue(len(maps) <= 16, 'error test_map_tail')
+        self.assertEqual(storage.load("key0").val, "x" * 1000, 'error test_map_tail')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestLogStorage)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+import Lamia.storage
+import os
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-negative"
+
+class TestNegativeFilter(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = self.make_cache()
+        self.opened = []
+        self._load = Lamia.storage.load
+        def load(path, *args):
+            self.opened.append(os.path.basename(path))
+            return self._load(path, *args)
+        Lamia.storage.load = load
+
+    def tearDown(self):
+        ''' do finalization '''
+        Lamia.storage.load = self._load
+        self.cache.clear_cache()
+
+    def make_cache(self):
+        return Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              negative_filter=1000)
+
+    def test_miss_skips_file(self):
+        ''' test for a miss does not open the file '''
+        cache = self.cache
+        cache.store("hit", "val")
+        cache._clear_cache_memory()
+        self.assertEqual(cache.get("miss"), None, 'error test_miss_skips_file')
+        self.assertEqual(cache.get("hit"), "val", 'error test_miss_skips_file')
+        self.assertEqual(self.opened, ["hit"], 'error test_miss_skips_file')
+
+    def test_delete_and_purge(self):
+        ''' test for the filter follows delete and purge '''
+        cache = self.cache
+        cache.store("deleted", "val")
+        cache.store("short", "val", expires=0.05)
+        cache.delete_many(["deleted"])
+        time.sleep(0.1)
+        cache.purge_file()
+        storage = cache.storage
+        self.assertEqual(len(storage.negative_filter), 0, 'error test_delete_and_purge')
+        cache.store("deleted", "again")
+        cache._clear_cache_memory()
+        self.assertEqual(cache.get("deleted"), "again", 'error test_delete_and_purge')
+
+    def test_rebuild_and_other_writer(self):
+        ''' test for files on startup and files written by another instance '''
+        cache = self.cache
+        cache.store("before", "val")
+        other = self.make_cache()
+        self.assertTrue(other.storage.negative_filter.__contains__("before"),
+                        'error test_rebuild_and_other_writer')
+        other.store("after", "val")
+        cache._clear_cache_memory()
+        cache.storage._filter_synced = 0
+        self.assertEqual(cache.get("after"), "val", 'error test_rebuild_and_other_writer')
+        other.close()
+
+    def test_overwrite(self):
+        ''' test for overwriting a file does not add it to the filter again '''
+        cache = self.cache
+        other = self.make_cache()
+        for i in xrange(300):
+            cache.store("key", i)
+            other.store("other", i)
+        cache.storage.expiry_index.sync()
+        storage = cache.storage
+        self.assertEqual(len(storage.negative_filter), 2, 'error test_overwrite')
+        cache.delete_many(["key"])
+        self.assertFalse(storage.negative_filter.__contains__("key"), 'error test_overwrite')
+        other.close()
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestNegativeFilter)
+unittest.TextTestRunner(verbosity=2).run(suite)
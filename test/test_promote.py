@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-promote"
+
+class TestPromotion(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.caches = []
+
+    def tearDown(self):
+        ''' do finalization '''
+        for cache in self.caches:
+            cache.clear_cache()
+
+    def make_cache(self, **options):
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              **options)
+        self.caches.append(cache)
+        return cache
+
+    def test_always(self):
+        ''' test for promoting file hits with the file expiry '''
+        cache = self.make_cache(promote='always')
+        cache.store("key", "val", expires=0.2)
+        expiration_date = cache.cache["key"].expiration_date
+        cache._clear_cache_memory()
+        self.assertEqual(cache.get("key"), "val", 'error test_always')
+        self.assertTrue("key" in cache.cache, 'error test_always')
+        self.assertEqual(cache.cache["key"].expiration_date, expiration_date,
+                         'error test_always')
+        self.assertEqual(cache.dirty_keys(), [], 'error test_always')
+        time.sleep(0.25)
+        self.assertEqual(cache.get("key"), None, 'error test_always')
+
+    def test_frequency(self):
+        ''' test for a scan not being promoted '''
+        cache = self.make_cache(promote='frequency', promote_min_hits=2)
+        for i in xrange(50):
+            cache.store("key%d" % i, i)
+        cache._clear_cache_memory()
+        for i in xrange(50):
+            cache.get("key%d" % i)
+        self.assertEqual(len(cache.cache), 0, 'error test_frequency')
+        cache.get("key7")
+        self.assertEqual(cache.cache.keys(), ["key7"], 'error test_frequency')
+
+    def test_get_many(self):
+        ''' test for get_many promoting with the same policy as fetch '''
+        cache = self.make_cache(promote='frequency', promote_min_hits=2)
+        self.assertFalse(cache.thread_safe, 'error test_get_many')
+        keys = ["key%d" % i for i in xrange(10)]
+        for key in keys:
+            cache.store(key, key)
+        cache._clear_cache_memory()
+        self.assertEqual(len(cache.get_many(keys)), 10, 'error test_get_many')
+        self.assertEqual(len(cache.cache), 0, 'error test_get_many')
+        self.assertEqual(len(cache.get_many(keys[:3])), 3, 'error test_get_many')
+        self.assertEqual(sorted(cache.cache.keys()), keys[:3], 'error test_get_many')
+
+    def test_default(self):
+        ''' test for no promotion by default '''
+        cache = self.make_cache()
+        cache.store("key", "val")
+        cache._clear_cache_memory()
+        self.assertEqual(cache.get("key"), "val", 'error test_default')
+        self.assertEqual(len(cache.cache), 0, 'error test_default')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestPromotion)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+import Lamia.layout
+import os
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-quota"
+
+class TestDiskQuota(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.caches = []
+        self.cache = self.make_cache()
+        self.cache.store("probe", "x" * 1000)
+        self.size = os.path.getsize(self.cache.storage.build_path("probe"))
+        self.cache.clear_cache()
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+        for cache in self.caches:
+            cache.close()
+
+    def make_cache(self, max_disk_bytes=10 ** 9, disk_eviction='lru'):
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              max_disk_bytes=max_disk_bytes,
+              disk_eviction=disk_eviction)
+        self.caches.append(cache)
+        return cache
+
+    def file_keys(self, cache):
+        return sorted(os.path.basename(path)
+                      for path in cache.layout.iter_paths(cache.cache_dir))
+
+    def test_lru(self):
+        ''' test for evicting the least recently used files '''
+        cache = self.make_cache(self.size * 3)
+        for i in xrange(3):
+            cache.store("key%d" % i, "x" * 1000)
+        cache._clear_cache_memory()
+        self.assertEqual(cache.get("key0"), "x" * 1000, 'error test_lru')
+        cache.store("key3", "x" * 1000)
+        self.assertEqual(self.file_keys(cache), ["key0", "key2", "key3"], 'error test_lru')
+        usage = cache.disk_usage()
+        self.assertEqual(usage['used_bytes'], self.size * 3, 'error test_lru')
+        self.assertEqual(usage['files'], 3, 'error test_lru')
+        self.assertEqual(usage['evictions'], 1, 'error test_lru')
+
+    def test_expiry(self):
+        ''' test for evicting the files which expire first '''
+        cache = self.make_cache(self.size * 2, 'expiry')
+        cache.store("late", "x" * 1000, expires=100)
+        cache.store("soon", "x" * 1000, expires=5)
+        cache.store("middle", "x" * 1000, expires=50)
+        self.assertEqual(self.file_keys(cache), ["late", "middle"], 'error test_expiry')
+
+    def test_delete_and_overwrite(self):
+        ''' test for the usage follows deletes and overwrites '''
+        cache = self.make_cache(self.size * 3)
+        cache.store("key", "x" * 1000)
+        cache.store("key", "x" * 1000)
+        cache.store("deleted", "x" * 1000)
+        cache.delete_many(["deleted"])
+        self.assertEqual(cache.disk_usage()['used_bytes'], self.size, 'error test_delete_and_overwrite')
+
+    def test_restart_without_walk(self):
+        ''' test for restoring the usage from the journal without walking the directory '''
+        cache = self.make_cache(self.size * 10)
+        for i in xrange(4):
+            cache.store("key%d" % i, "x" * 1000)
+        cache.delete_many(["key0"])
+        walked = []
+        iter_paths = Lamia.layout.FlatLayout.iter_paths
+        def _iter_paths(layout, cache_dir):
+            walked.append(cache_dir)
+            return iter_paths(layout, cache_dir)
+        Lamia.layout.FlatLayout.iter_paths = _iter_paths
+        try:
+            other = self.make_cache(self.size * 10)
+        finally:
+            Lamia.layout.FlatLayout.iter_paths = iter_paths
+        self.assertEqual(walked, [], 'error test_restart_without_walk')
+        self.assertEqual(other.disk_usage()['used_bytes'], self.size * 3, 'error test_restart_without_walk')
+
+    def test_other_writer(self):
+        ''' test for counting the files written by other instances '''
+        cache = self.make_cache(self.size * 3)
+        other = self.make_cache(self.size * 3)
+        for i in xrange(3):
+            other.store("other%d" % i, "x" * 1000)
+        other.delete_many(["other0"])
+        cache.storage._quota_synced = 0
+        cache.store("key", "x" * 1000)
+        self.assertEqual(cache.disk_usage()['used_bytes'], self.size * 3, 'error test_other_writer')
+        cache.store("key2", "x" * 1000)
+        self.assertEqual(self.file_keys(cache), ["key", "key2", "other2"], 'error test_other_writer')
+
+    def test_log_storage(self):
+        ''' test for max_disk_bytes is supported only by the file storage '''
+        self.assertRaises(ValueError, Cache, cache_root, default_expires,
+                          namespace=namespace, storage='log', max_disk_bytes=1000)
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestDiskQuota)
+unittest.TextTestRunner(verbosity=2).run(suite)
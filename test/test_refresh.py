@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.pool import ThreadPool
+import threading
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-refresh"
+
+class TestRefresh(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              thread_safe=True)
+        self.calls = []
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def make_func(self, stale_ttl, fail=False):
+        calls = self.calls
+        @self.cache.cache_decorator(expires=0.1, stale_ttl=stale_ttl)
+        def func(arg):
+            calls.append(arg)
+            if fail and len(calls) > 1:
+                raise ValueError("fail")
+            return len(calls)
+        return func
+
+    def wait_refresh(self, func):
+        func.refresh_pool.join()
+
+    def test_stale_while_revalidate(self):
+        ''' test for stale value is returned and refreshed in background '''
+        func = self.make_func(stale_ttl=5)
+        self.assertEqual(func(1), 1, 'error test_stale_while_revalidate')
+        self.assertEqual(func(1), 1, 'error test_stale_while_revalidate')
+        time.sleep(0.15)
+        self.assertEqual(func(1), 1, 'error test_stale_while_revalidate')
+        self.wait_refresh(func)
+        self.assertEqual(func(1), 2, 'error test_stale_while_revalidate')
+        stats = func.refresh_stats()
+        self.assertEqual(stats['stale_hits'], 1, 'error test_stale_while_revalidate')
+        self.assertEqual(stats['refreshes'], 1, 'error test_stale_while_revalidate')
+        self.assertEqual(stats['failures'], 0, 'error test_stale_while_revalidate')
+
+    def test_failed_refresh(self):
+        ''' test for failed refreshes keep serving stale data up to the limit '''
+        func = self.make_func(stale_ttl=0.3, fail=True)
+        self.assertEqual(func(1), 1, 'error test_failed_refresh')
+        time.sleep(0.15)
+        self.assertEqual(func(1), 1, 'error test_failed_refresh')
+        self.wait_refresh(func)
+        self.assertEqual(func(1), 1, 'error test_failed_refresh')
+        self.wait_refresh(func)
+        self.assertEqual(func.refresh_stats()['failures'], 2, 'error test_failed_refresh')
+        time.sleep(0.3)
+        self.assertRaises(ValueError, func, 1)
+
+    def test_shared_pool(self):
+        ''' test for decorators sharing a refresh pool which close stops '''
+        cache = Cache(cache_root=cache_root, default_expires=default_expires,
+                      namespace=namespace + "-pool")
+        self.assertFalse(cache.thread_safe, 'error test_shared_pool')
+        first = cache.cache_decorator(stale_ttl=5)(lambda arg: arg)
+        second = cache.cache_decorator(stale_ttl=5, refresh_workers=2)(lambda arg: arg)
+        self.assertTrue(cache.thread_safe, 'error test_shared_pool')
+        self.assertTrue(first.refresh_pool is second.refresh_pool, 'error test_shared_pool')
+        self.assertEqual(first.refresh_pool.workers, 2, 'error test_shared_pool')
+        cache.close()
+        self.assertRaises(RuntimeError, first.refresh_pool.submit, len, "")
+        self.assertRaises(RuntimeError, cache.cache_decorator(stale_ttl=5), lambda arg: arg)
+
+    def test_cancel_shutdown(self):
+        ''' test for shutdown dropping queued work with a bounded wait '''
+        pool = ThreadPool(1)
+        started = threading.Event()
+        release = threading.Event()
+        def block():
+            started.set()
+            release.wait()
+        running = pool.submit(block)
+        started.wait(1)
+        queued = pool.submit(len, "")
+        start = time.time()
+        pool.shutdown(cancel=True, timeout=0.1)
+        self.assertTrue(time.time() - start < 1.0, 'error test_cancel_shutdown')
+        self.assertRaises(RuntimeError, queued.result, 1)
+        release.set()
+        running.result(1)
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestRefresh)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.serialize import dump, load, load_header, LoadError, DumpError
+from Lamia.util import _CacheData
+import os
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-serialize"
+
+class TestSerialize(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace)
+        self.path = os.path.join(self.cache.cache_dir, "record")
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_codecs(self):
+        ''' test for typed round-trip of each codec '''
+        values = {
+            'pickle': {"a": [1, 2.5, None], "b": (1, u"あ")},
+            'marshal': {"a": [1, 2.5, None]},
+            'json': {u"a": [1, 2.5, None]},
+            'raw': "\x00bytes\n",
+        }
+        for codec, val in values.iteritems():
+            dump(_CacheData(val=val, expiration_date=123.5), self.path, codec)
+            data = load(self.path)
+            self.assertEqual(data.val, val, 'error test_codecs')
+            self.assertEqual(data.expiration_date, 123.5, 'error test_codecs')
+            self.assertEqual(load_header(self.path), 123.5, 'error test_codecs')
+
+    def test_raw_rejects_objects(self):
+        ''' test for raw codec accepts only str '''
+        self.assertRaises(DumpError, dump,
+                          _CacheData(val=1, expiration_date=0), self.path, 'raw')
+
+    def test_corrupt(self):
+        ''' test for detection of truncated and corrupt files '''
+        dump(_CacheData(val="x" * 100, expiration_date=0), self.path)
+        with open(self.path, 'rb') as f:
+            record = f.read()
+        for broken in (record[:-1], record[:10], record[:-2] + "yy", record + "z",
+                       "legacy\nformat"):
+            with open(self.path, 'wb') as f:
+                f.write(broken)
+            self.assertRaises(LoadError, load, self.path)
+
+    def test_store_file_types(self):
+        ''' test for file tier keeps value types '''
+        self.cache.store("key", {"n": 1}, is_store_file=True)
+        del self.cache["key"]
+        self.assertEqual(self.cache["key"], {"n": 1}, 'error test_store_file_types')
+
+    def test_corrupt_file_is_miss(self):
+        ''' test for corrupt file is treated as a miss and removed '''
+        self.cache.store("key", "val", is_store_file=True)
+        del self.cache["key"]
+        path = self.cache.storage.build_path("key")
+        with open(path, 'wb') as f:
+            f.write("garbage")
+        self.assertIsNone(self.cache.get("key"), 'error test_corrupt_file_is_miss')
+        self.assertFalse(os.path.exists(path), 'error test_corrupt_file_is_miss')
+
+    def test_compression(self):
+        ''' test for compressed values and mixed data read back '''
+        plain = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace)
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              compression='zlib',
+              compress_threshold=100)
+        cache.store("small", "s", is_store_file=True)
+        cache.store("large", "l" * 5000, is_store_file=True)
+        plain.store("plain", "p" * 5000, is_store_file=True)
+        for key in ("small", "large", "plain"):
+            del cache[key]
+        self.assertEqual(cache["large"], "l" * 5000, 'error test_compression')
+        self.assertEqual(cache["plain"], "p" * 5000, 'error test_compression')
+        self.assertEqual(cache["small"], "s", 'error test_compression')
+        self.assertTrue(os.path.getsize(cache.storage.build_path("large")) < 500,
+                        'error test_compression')
+        stats = cache.compression_stats()
+        self.assertEqual(stats['compressed'], 1, 'error test_compression')
+        self.assertEqual(stats['decompressed'], 1, 'error test_compression')
+        self.assertTrue(stats['ratio'] < 0.1, 'error test_compression')
+
+    def test_compression_namespaces(self):
+        ''' test for compression stats kept per namespace '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              compression='zlib',
+              compress_threshold=100)
+        cache.store("large", "l" * 5000, is_store_file=True)
+        cache.change_namespace(namespace + "-other")
+        try:
+            self.assertEqual(cache.compression_stats()['compressed'], 0,
+                             'error test_compression_namespaces')
+            cache.store("large", "m" * 5000, is_store_file=True)
+            cache.store("large2", "n" * 5000, is_store_file=True)
+            self.assertEqual(cache.compression_stats()['compressed'], 2,
+                             'error test_compression_namespaces')
+            self.assertEqual(cache.compression_stats(namespace)['compressed'], 1,
+                             'error test_compression_namespaces')
+            stats = cache.compression_stats(all_namespaces=True)
+            self.assertEqual(sorted(stats), [namespace, namespace + "-other"],
+                             'error test_compression_namespaces')
+        finally:
+            cache.clear_cache()
+            cache.change_namespace(namespace)
+            cache.clear_cache()
+
+    def test_zero_copy(self):
+        ''' test for mmap view of large raw values survives purge '''
+        for storage in ('file', 'log'):
+            cache = Cache(cache_root=cache_root,
+                  default_expires=default_expires,
+                  namespace=namespace,
+                  codec='raw',
+                  storage=storage,
+                  mmap_threshold=1000)
+            cache.store("large", "l" * 5000, is_store_file=True)
+            cache.store("small", "s", is_store_file=True)
+            del cache["large"], cache["small"]
+            val = cache.fetch("large", zero_copy=True)
+            self.assertNotIsInstance(val, str, 'error test_zero_copy')
+            self.assertEqual(len(val), 5000, 'error test_zero_copy')
+            self.assertEqual(cache.get("small", zero_copy=True), "s", 'error test_zero_copy')
+            cache.store("large", "x" * 10, is_store_file=True)
+            cache.clear_cache()
+            self.assertEqual(str(val[:3]), "lll", 'error test_zero_copy')
+            cache.storage.close()
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestSerialize)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.server import CacheServer
+from Lamia.client import CacheClient, Connection, ServerError
+from Lamia.protocol import PING, GET, PURGE, OK
+import os
+import pickle
+import socket
+import threading
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-server"
+address="/tmp/lamia-test-server.sock"
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.server = CacheServer(cache_root, address, default_expires)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.1,))
+        self.thread.start()
+        self.client = CacheClient(address, namespace)
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.client.close()
+        self.server.shutdown()
+        self.thread.join()
+        for cache in self.server.caches.values():
+            cache.clear_cache()
+        self.server.close()
+
+    def test_interface(self):
+        ''' test for the same interface as Cache '''
+        client = self.client
+        client.store("key", {"a": [1, 2]})
+        client[u"ユニコード"] = 1
+        self.assertEqual(client.fetch("key"), {"a": [1, 2]}, 'error test_interface')
+        self.assertEqual(client[u"ユニコード"], 1, 'error test_interface')
+        self.assertEqual(client.get("missing", "default"), "default", 'error test_interface')
+        self.assertRaises(KeyError, client.fetch, "missing")
+        client.store_many({"a": 1, "b": 2}, expires=0.05)
+        self.assertEqual(client.get_many(["a", "b", "c"]), {"a": 1, "b": 2},
+                         'error test_interface')
+        self.assertEqual(client.delete_many(["key", "missing"]), 1, 'error test_interface')
+        self.assertFalse("key" in client, 'error test_interface')
+        time.sleep(0.1)
+        self.assertEqual(client.purge(), 4, 'error test_interface')
+        other = CacheClient(address, namespace + "-other", pool=client.pool)
+        self.assertEqual(other.get(u"ユニコード"), None, 'error test_interface')
+        self.assertRaises(ServerError, CacheClient(address, "..", pool=client.pool).get, "key")
+
+    def test_traversal(self):
+        ''' test for rejecting keys which point outside the namespace '''
+        client = self.client
+        victim = os.path.join(cache_root, "lamia-test-victim")
+        with open(victim, 'w') as f:
+            f.write("victim")
+        try:
+            for key in ["../lamia-test-victim", "../../x", "/tmp/x", "", ".", "..", "a\0b",
+                        ".lamia-expiry", ".lamia-tmp"]:
+                self.assertRaises(ServerError, client.store, key, "val")
+                self.assertRaises(ServerError, client.fetch, key)
+                self.assertRaises(ServerError, client.delete_many, [key])
+                self.assertRaises(ServerError, client.get_many, ["ok", key])
+            self.assertTrue(os.path.exists(victim), 'error test_traversal')
+            self.assertFalse(os.path.exists(os.path.join(cache_root, "x_written")),
+                             'error test_traversal')
+        finally:
+            os.remove(victim)
+
+    def test_backpressure(self):
+        ''' test for bounding the responses of a client which does not read them '''
+        self.server.max_pending = 64 * 1024
+        val = "x" * (1024 * 1024)
+        self.client.store("large", val)
+        conn = Connection(address, timeout=10)
+        try:
+            ids = conn.send([(GET, namespace, "large")] * 20)
+            time.sleep(0.3)
+            pending = max(c.pending for c in self.server._connections.values())
+            self.assertTrue(pending <= self.server.max_pending + 2 * len(val),
+                            'error test_backpressure')
+            for request_id in ids:
+                status, body = conn.receive(request_id)
+                self.assertEqual((status, pickle.loads(body)), (OK, val), 'error test_backpressure')
+        finally:
+            conn.close()
+
+    def test_decorator(self):
+        ''' test for cache_decorator through the server '''
+        calls = []
+        @self.client.cache_decorator(expires=10)
+        def add(a, b=0):
+            calls.append(a)
+            return a + b
+        self.assertEqual(add(1, b=2), 3, 'error test_decorator')
+        self.assertEqual(add(1, b=2), 3, 'error test_decorator')
+        self.assertEqual(calls, [1], 'error test_decorator')
+
+    def test_connections(self):
+        ''' test for many concurrent and pipelined connections '''
+        connections = [Connection(address, timeout=10) for _ in xrange(200)]
+        pending = [(conn, conn.send([(PING, "", "")] * 10)) for conn in connections]
+        for conn, ids in pending:
+            for request_id in ids:
+                self.assertEqual(conn.receive(request_id), (OK, ""), 'error test_connections')
+            conn.close()
+
+    def test_offload(self):
+        ''' test for purging on a worker thread without blocking other connections '''
+        self.client.store("key", 1)
+        cache = self.server.cache(namespace)
+        purge_file = cache.purge_file
+        def slow_purge_file():
+            time.sleep(0.5)
+            return purge_file()
+        cache.purge_file = slow_purge_file
+        conn = Connection(address, timeout=10)
+        ids = conn.send([(PURGE, namespace, ""), (PING, "", "")])
+        time.sleep(0.1)
+        start = time.time()
+        self.assertTrue(self.client.ping(), 'error test_offload')
+        self.assertTrue(time.time() - start < 0.3, 'error test_offload')
+        status, body = conn.receive(ids[0])
+        self.assertEqual(status, OK, 'error test_offload')
+        self.assertEqual(conn.receive(ids[1]), (OK, ""), 'error test_offload')
+        conn.close()
+        self.assertEqual(self.client.get("key"), 1, 'error test_offload')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestServer)
+unittest.TextTestRunner(verbosity=2).run(suite)
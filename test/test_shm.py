@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.shm import SharedMemoryStore, default_path
+from Lamia.util import _CacheData
+import os
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-shm"
+shm_path="/tmp/lamia-test-shm"
+
+class TestSharedMemoryStore(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.store = SharedMemoryStore(shm_path, capacity=64, slot_size=256, ways=4)
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.store.close()
+        self.store.unlink()
+
+    def test_dict_api(self):
+        ''' test for dict-like access of the shared table '''
+        store = self.store
+        store["key"] = _CacheData(val={"a": 1}, expiration_date=10.0)
+        store[u"ユニコード"] = _CacheData(val="u", expiration_date=11.0)
+        store[("tuple", 1)] = _CacheData(val="t", expiration_date=12.0)
+        self.assertEqual(store["key"].val, {"a": 1}, 'error test_dict_api')
+        self.assertEqual(store["key"].expiration_date, 10.0, 'error test_dict_api')
+        self.assertEqual(store[("tuple", 1)].val, "t", 'error test_dict_api')
+        self.assertEqual(len(store), 3, 'error test_dict_api')
+        self.assertEqual(sorted(store.keys()), sorted(["key", u"ユニコード", ("tuple", 1)]),
+                         'error test_dict_api')
+        del store["key"]
+        self.assertFalse("key" in store, 'error test_dict_api')
+        self.assertRaises(KeyError, store.__getitem__, "key")
+        store.clear()
+        self.assertEqual(len(store), 0, 'error test_dict_api')
+
+    def test_eviction_and_oversize(self):
+        ''' test for full buckets and values larger than a slot '''
+        store = self.store
+        for i in xrange(200):
+            store["key%d" % i] = _CacheData(val=i, expiration_date=1e10 + i)
+        self.assertEqual(len(store), 64, 'error test_eviction_and_oversize')
+        self.assertEqual(store["key199"].val, 199, 'error test_eviction_and_oversize')
+        store["big"] = _CacheData(val="x", expiration_date=1.0)
+        store["big"] = _CacheData(val="x" * 1000, expiration_date=1.0)
+        self.assertFalse("big" in store, 'error test_eviction_and_oversize')
+        self.assertEqual(store.oversize, 1, 'error test_eviction_and_oversize')
+
+    def test_store_without_len(self):
+        ''' test for Cache.store does not count the slots of the table '''
+        counted = []
+        class CountingStore(SharedMemoryStore):
+            def __len__(self):
+                counted.append(1)
+                return SharedMemoryStore.__len__(self)
+        self.store.close()
+        self.store = CountingStore(shm_path, capacity=64, slot_size=256, ways=4)
+        cache = Cache(cache_root, default_expires, namespace=namespace, cache=self.store)
+        for i in xrange(100):
+            cache.store("key%d" % i, i, is_store_file=False)
+        self.assertEqual(counted, [], 'error test_store_without_len')
+
+    def test_untrusted_file(self):
+        ''' test for refusing a shared file which others can write '''
+        path = shm_path + "-untrusted"
+        with open(path, 'w'):
+            pass
+        try:
+            os.chmod(path, 0666)
+            self.assertRaises(ValueError, SharedMemoryStore, path, capacity=64)
+            os.remove(path)
+            os.symlink(shm_path, path)
+            self.assertRaises(ValueError, SharedMemoryStore, path, capacity=64)
+        finally:
+            os.remove(path)
+        self.assertEqual(os.stat(shm_path).st_mode & 0777, 0600, 'error test_untrusted_file')
+        self.assertTrue(default_path().endswith("-%d" % os.getuid()), 'error test_untrusted_file')
+
+    def test_cross_process(self):
+        ''' test for entries written by a forked process are visible '''
+        pid = os.fork()
+        if pid == 0:
+            try:
+                store = SharedMemoryStore(shm_path, capacity=64, slot_size=256, ways=4)
+                store["child"] = _CacheData(val=os.getpid(), expiration_date=10.0)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(self.store["child"].val, pid, 'error test_cross_process')
+        self.assertRaises(ValueError, SharedMemoryStore, shm_path, capacity=128)
+
+    def test_cache_backend(self):
+        ''' test for Cache using the shared table as its memory tier '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=self.store,
+              thread_safe=True)
+        other = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=SharedMemoryStore(shm_path, capacity=64, slot_size=256, ways=4))
+        cache.store("key", "val", is_store_file=False)
+        self.assertEqual(other["key"], "val", 'error test_cache_backend')
+        cache.store("short", "val", expires=0, is_store_file=False)
+        self.assertIsNone(other.get("short"), 'error test_cache_backend')
+        self.assertFalse("short" in self.store, 'error test_cache_backend')
+        other.cache.close()
+        cache.clear_cache()
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestSharedMemoryStore)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.stats import Histogram, StatsObserver
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-stats"
+
+class RecordingObserver(StatsObserver):
+
+    def __init__(self):
+        self.events = []
+
+    def on_fetch(self, namespace, tier, key, seconds):
+        self.events.append(('fetch', namespace, tier, key))
+
+    def on_store(self, namespace, tier, key, seconds):
+        self.events.append(('store', namespace, tier, key))
+
+    def on_expire(self, namespace, tier, key):
+        self.events.append(('expire', namespace, tier, key))
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.observer = RecordingObserver()
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              stats=[self.observer])
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+        self.cache.change_namespace(namespace + "-other")
+        self.cache.clear_cache()
+
+    def test_tiers(self):
+        ''' test for counting hits, misses and expirations per tier '''
+        cache = self.cache
+        cache.store("key", "val")
+        cache.store("short", "val", expires=0.05)
+        cache.get("key")
+        cache._clear_cache_memory()
+        cache.get("key")
+        cache.get("missing")
+        time.sleep(0.1)
+        cache.get("short")
+        stats = cache.stats()
+        self.assertEqual(stats['memory_hits'], 1, 'error test_tiers')
+        self.assertEqual(stats['file_hits'], 1, 'error test_tiers')
+        self.assertEqual(stats['misses'], 2, 'error test_tiers')
+        self.assertEqual(stats['file_expirations'], 1, 'error test_tiers')
+        self.assertEqual(stats['memory_stores'], 2, 'error test_tiers')
+        self.assertEqual(stats['file_stores'], 2, 'error test_tiers')
+        self.assertTrue(stats['bytes_written'] > 0, 'error test_tiers')
+        self.assertTrue(stats['bytes_read'] > 0, 'error test_tiers')
+        self.assertEqual(stats['latency']['fetch.miss']['count'], 2, 'error test_tiers')
+        self.assertTrue(('fetch', namespace, 'file', 'key') in self.observer.events,
+                        'error test_tiers')
+        self.assertTrue(('expire', namespace, 'file', 'short') in self.observer.events,
+                        'error test_tiers')
+
+    def test_namespaces(self):
+        ''' test for counting per namespace '''
+        cache = self.cache
+        cache.store("key", "val")
+        cache.change_namespace(namespace + "-other")
+        cache.get("key", zero_copy=True)
+        cache.store("key", "val")
+        cache.purge()
+        stats = cache.stats(all_namespaces=True)
+        self.assertEqual(stats[namespace]['file_stores'], 1, 'error test_namespaces')
+        self.assertEqual(stats[namespace + "-other"]['memory_hits'], 1, 'error test_namespaces')
+        self.assertEqual(stats[namespace + "-other"]['latency']['purge.file']['count'], 1,
+                         'error test_namespaces')
+
+    def test_histogram(self):
+        ''' test for latency percentiles '''
+        histogram = Histogram()
+        for _ in xrange(99):
+            histogram.record(0.000010)
+        histogram.record(0.5)
+        self.assertEqual(histogram.count, 100, 'error test_histogram')
+        self.assertTrue(histogram.percentile(50) <= 0.000016, 'error test_histogram')
+        self.assertEqual(histogram.percentile(100), 0.5, 'error test_histogram')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestStats)
+unittest.TextTestRunner(verbosity=2).run(suite)
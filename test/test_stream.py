@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.serialize import DumpError, LoadError
+from cStringIO import StringIO
+import os
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-stream"
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict())
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_iterable(self):
+        ''' test for storing chunks and reading them back '''
+        cache = self.cache
+        chunks = ["chunk%d;" % i for i in xrange(100)]
+        cache.store_stream("key", iter(chunks))
+        self.assertFalse("key" in cache.cache, 'error test_iterable')
+        with cache.open_stream("key") as reader:
+            self.assertEqual(reader.length, len("".join(chunks)), 'error test_iterable')
+            self.assertEqual(reader.read(7), "chunk0;", 'error test_iterable')
+            self.assertEqual(reader.tell(), 7, 'error test_iterable')
+            self.assertEqual(reader.read(), "".join(chunks[1:]), 'error test_iterable')
+            self.assertEqual(reader.read(), "", 'error test_iterable')
+        self.assertEqual(cache.fetch("key"), "".join(chunks), 'error test_iterable')
+
+    def test_fileobj(self):
+        ''' test for storing a file object larger than a chunk '''
+        cache = self.cache
+        val = os.urandom(300 * 1024)
+        cache.store_stream("key", StringIO(val))
+        reader = cache.open_stream("key")
+        self.assertEqual("".join(reader), val, 'error test_fileobj')
+        reader.close()
+        self.assertTrue(reader.closed, 'error test_fileobj')
+
+    def test_replace_memory(self):
+        ''' test for store_stream drops the entry in memory '''
+        cache = self.cache
+        cache.store("key", "old")
+        cache.store_stream("key", ["new"])
+        self.assertFalse("key" in cache.cache, 'error test_replace_memory')
+        self.assertEqual(cache.fetch("key"), "new", 'error test_replace_memory')
+
+    def test_expired(self):
+        ''' test for an expired stream '''
+        cache = self.cache
+        cache.store_stream("key", ["val"], expires=0.05)
+        time.sleep(0.1)
+        self.assertRaises(KeyError, cache.open_stream, "key")
+        self.assertFalse(os.path.exists(cache.storage.build_path("key")), 'error test_expired')
+        self.assertRaises(KeyError, cache.open_stream, "missing")
+
+    def test_corrupted(self):
+        ''' test for detecting a corrupted payload while reading '''
+        cache = self.cache
+        cache.store_stream("key", ["a" * 1000])
+        path = cache.storage.build_path("key")
+        with open(path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write("b")
+        reader = cache.open_stream("key")
+        self.assertRaises(LoadError, reader.read)
+        reader.close()
+
+    def test_not_raw(self):
+        ''' test for open_stream rejects values which are not raw bytes '''
+        cache = self.cache
+        cache.store("key", {"a": 1})
+        self.assertRaises(TypeError, cache.open_stream, "key")
+        self.assertRaises(DumpError, cache.store_stream, "key", [u"unicode"])
+        self.assertEqual(cache.fetch("key"), {"a": 1}, 'error test_not_raw')
+
+    def test_log_storage(self):
+        ''' test for streams on the log storage '''
+        cache = Cache(cache_root=cache_root, default_expires=default_expires,
+                      namespace=namespace + "-log", storage='log')
+        try:
+            val = os.urandom(300 * 1024)
+            cache.store_stream("key", StringIO(val))
+            cache.store_stream("key2", ["small"])
+            with cache.open_stream("key") as reader:
+                self.assertEqual(reader.length, len(val), 'error test_log_storage')
+                self.assertEqual("".join(reader), val, 'error test_log_storage')
+            self.assertEqual(cache.fetch("key"), val, 'error test_log_storage')
+            self.assertEqual(cache.open_stream("key2").read(), "small", 'error test_log_storage')
+            self.assertRaises(KeyError, cache.open_stream, "missing")
+            self.assertRaises(DumpError, cache.store_stream, "key3", [u"unicode"])
+            self.assertRaises(KeyError, cache.open_stream, "key3")
+        finally:
+            cache.clear_cache()
+            cache.close()
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestStream)
+unittest.TextTestRunner(verbosity=2).run(suite)
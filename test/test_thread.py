@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+from Lamia.lock import SingleFlight
+import threading
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-thread"
+
+def run_threads(target, count=8):
+    errors = []
+    def run():
+        try:
+            target()
+        except Exception, err:
+            errors.append(err)
+    threads = [threading.Thread(target=run) for _ in xrange(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return errors
+
+class TestThreadSafeCache(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              max_entries=500,
+              thread_safe=True)
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def test_concurrent_access(self):
+        ''' test for concurrent store, fetch, purge and save '''
+        cache = self.cache
+        def work():
+            for i in xrange(300):
+                key = "key%d" % (i % 50)
+                cache.store(key, i, expires=0 if i % 7 == 0 else 10,
+                            is_store_file=(i % 10 == 0))
+                cache.get(key)
+                if i % 25 == 0:
+                    cache.purge_memory()
+                    cache.save()
+        self.assertEqual(run_threads(work), [], 'error test_concurrent_access')
+
+    def test_single_flight_decorator(self):
+        ''' test for only one caller computes a missing key '''
+        calls = []
+        @self.cache.cache_decorator(expires=10)
+        def slow(arg):
+            calls.append(arg)
+            time.sleep(0.05)
+            return arg * 2
+        results = []
+        errors = run_threads(lambda: results.append(slow(21)))
+        self.assertEqual(errors, [], 'error test_single_flight_decorator')
+        self.assertEqual(results, [42] * 8, 'error test_single_flight_decorator')
+        self.assertEqual(calls, [21], 'error test_single_flight_decorator')
+
+    def test_single_flight_error(self):
+        ''' test for waiting callers receive the leader's exception '''
+        flights = SingleFlight()
+        def fail():
+            time.sleep(0.05)
+            raise ValueError("fail")
+        errors = run_threads(lambda: flights.do("key", fail), count=4)
+        self.assertEqual(len(errors), 4, 'error test_single_flight_error')
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors),
+                        'error test_single_flight_error')
+        self.assertEqual(len(flights), 0, 'error test_single_flight_error')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestThreadSafeCache)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from Lamia.cache import Cache
+import time
+import unittest
+
+cache_root="/tmp/lamia"
+default_expires=10
+namespace="lamia-test-writeback"
+
+class TestWriteBack(unittest.TestCase):
+
+    def setUp(self):
+        ''' do initialization '''
+        self.cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict())
+
+    def tearDown(self):
+        ''' do finalization '''
+        self.cache.clear_cache()
+
+    def file_count(self, cache):
+        return len(list(cache.layout.iter_paths(cache.cache_dir)))
+
+    def test_dirty_tracking(self):
+        ''' test for save writes only entries that changed '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              write_behind=True,
+              flush_interval=60)
+        for i in xrange(5):
+            cache.store("file", i)
+        cache.store("memory", "val", is_store_file=False)
+        self.assertEqual(cache.dirty_keys(), ["file"], 'error test_dirty_tracking')
+        self.assertEqual(cache.flush(), 1, 'error test_dirty_tracking')
+        self.assertEqual(cache.flush(), 0, 'error test_dirty_tracking')
+        del cache["file"]
+        self.assertEqual(cache["file"], 4, 'error test_dirty_tracking')
+        self.assertEqual(self.file_count(cache), 1, 'error test_dirty_tracking')
+        cache.save(full=True)
+        self.assertEqual(self.file_count(cache), 2, 'error test_dirty_tracking')
+        cache.close()
+
+    def test_write_behind(self):
+        ''' test for background flushing on size and time triggers '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              cache=dict(),
+              write_behind=True,
+              flush_interval=0.2,
+              flush_batch=10)
+        for i in xrange(10):
+            cache.store("key%d" % i, i)
+        time.sleep(0.1)
+        self.assertEqual(self.file_count(cache), 10, 'error test_write_behind')
+        cache.store("late", "val")
+        self.assertEqual(self.file_count(cache), 10, 'error test_write_behind')
+        time.sleep(0.3)
+        self.assertEqual(self.file_count(cache), 11, 'error test_write_behind')
+        cache.store("closing", "val")
+        cache.close()
+        self.assertEqual(self.file_count(cache), 12, 'error test_write_behind')
+
+    def test_evict_dirty(self):
+        ''' test for evicted dirty entries are written to file '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              max_entries=2,
+              write_behind=True,
+              flush_interval=60)
+        for i in xrange(3):
+            cache.store("key%d" % i, i)
+        self.assertEqual(self.file_count(cache), 1, 'error test_evict_dirty')
+        self.assertEqual(cache["key0"], 0, 'error test_evict_dirty')
+        cache.close()
+
+    def test_evict_memory_only(self):
+        ''' test for evicted memory-only entries are never written '''
+        cache = Cache(cache_root=cache_root,
+              default_expires=default_expires,
+              namespace=namespace,
+              max_entries=10)
+        for i in xrange(100):
+            cache.store("key%d" % i, i, is_store_file=False)
+        self.assertEqual(self.file_count(cache), 0, 'error test_evict_memory_only')
+        self.assertEqual(cache.dirty_keys(), [], 'error test_evict_memory_only')
+        cache.close()
+        self.assertEqual(self.file_count(cache), 0, 'error test_evict_memory_only')
+
+# do unittest
+suite = unittest.TestLoader().loadTestsFromTestCase(TestWriteBack)
+unittest.TextTestRunner(verbosity=2).run(suite)